@@ -0,0 +1,96 @@
+"""
+Benchmark for decoding a large metadata_json, as `cidc admin list` does.
+
+Compares the standard library's `json.loads` against `cli.dbedit.core`'s
+`json_loads_exact` (the same, pausing garbage collection) and `json_loads` (orjson
+when installed) on a synthetic trial of about `--mb` megabytes of JSON, alone and
+followed by listing an assay from it.
+
+    $ python benchmarks/dbedit_json_decode.py [--mb 50] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from cli.dbedit import core
+from cli.dbedit.layouts import LAYOUTS
+from cli.dbedit.list import iter_rows
+
+
+def _synthetic_trial_text(megabytes: float) -> str:
+    def record(b: int, s: int) -> dict:
+        cimac_id = f"CTTT{b:04}{s:04}.00"
+        prefix = f"trial/wes/{cimac_id}"
+        return {
+            "cimac_id": cimac_id,
+            "files": {
+                "r1": [{"object_url": f"{prefix}/r1_L{n}.fastq.gz"} for n in range(2)],
+                "r2": [{"object_url": f"{prefix}/r2_L{n}.fastq.gz"} for n in range(2)],
+                "bam": {
+                    "object_url": f"{prefix}/reads.bam",
+                    "md5_hash": "x" * 24,
+                    "file_size_bytes": 123456789,
+                    "upload_placeholder": "0" * 36,
+                },
+            },
+            "sequencing_date": "2020-01-01 00:00:00",
+            "quality_flag": 1.5,
+        }
+
+    batch = {"batch_id": "batch_0", "records": [record(0, s) for s in range(100)]}
+    per_batch: int = len(json.dumps(batch))
+    num_batches: int = max(1, int(megabytes * 1024 * 1024 / per_batch))
+    trial = {
+        "protocol_identifier": "trial",
+        "assays": {
+            "wes": [
+                {
+                    "batch_id": f"batch_{b}",
+                    "records": [record(b, s) for s in range(100)],
+                }
+                for b in range(num_batches)
+            ]
+        },
+    }
+    return json.dumps(trial)
+
+
+def _best_of(repeat: int, f: Callable[[], object]) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = _synthetic_trial_text(args.mb)
+    layout = LAYOUTS["wes"]
+    assert json.loads(text) == core.json_loads(text)
+    print(f"{len(text) / 1024 / 1024:.1f} MB of JSON")
+    print(f"core.json_loads uses {'orjson' if core.orjson else 'json'}")
+
+    for name, loads in [
+        ("json.loads", json.loads),
+        ("core.json_loads_exact", core.json_loads_exact),
+        ("core.json_loads", core.json_loads),
+    ]:
+        decode = _best_of(args.repeat, lambda: loads(text))
+        listing = _best_of(
+            args.repeat, lambda: sum(1 for _ in iter_rows(loads(text), layout))
+        )
+        print(f"  {name}: decode {decode:.3f}s, decode + list wes {listing:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
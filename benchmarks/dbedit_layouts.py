@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of layout dispatch and traversal for each assay / analysis.
+
+Times looking up each assay's layout in `cli.dbedit.layouts.LAYOUTS` and walking
+its rows in the test trial's metadata_json, as done by `cidc admin list assay`,
+along with removing its first batch as done by `cidc admin remove assay`.
+
+    $ python benchmarks/dbedit_layouts.py [--number 10000]
+"""
+import argparse
+import os
+import sys
+from copy import deepcopy
+from timeit import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from cli.dbedit import list as dblist, remove
+from cli.dbedit.layouts import LAYOUTS
+from tests.dbedit.constants import TEST_METADATA_JSON, TEST_TRIAL_ID
+
+
+def _list(name: str) -> None:
+    for _ in dblist.iter_rows(TEST_METADATA_JSON, LAYOUTS[name]):
+        pass
+
+
+def _remove(name: str, metadata_json: dict, target_id: str) -> None:
+    layout = LAYOUTS[name]
+    remove._REMOVERS[layout.kind](metadata_json, TEST_TRIAL_ID, layout, target_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'assay / analysis':<30} {'list (us)':>10} {'remove (us)':>12}")
+    for name, layout in sorted(LAYOUTS.items()):
+        if layout.kind in ("clinical_data", "misc_data"):
+            continue
+
+        list_us = timeit(lambda: _list(name), number=args.number) / args.number * 1e6
+
+        remove_us = float("nan")
+        batches = layout.batches(TEST_METADATA_JSON)
+        if batches:
+            target_id = layout.get_batch_id(batches[0]) or "0"
+            copies = [deepcopy(TEST_METADATA_JSON) for _ in range(args.number // 10)]
+            blobs = iter(copies)
+            remove_us = (
+                timeit(
+                    lambda: _remove(name, next(blobs), target_id), number=len(copies)
+                )
+                / len(copies)
+                * 1e6
+            )
+
+        print(f"{name:<30} {list_us:>10.2f} {remove_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark for building `cidc admin list assay` tables from a large trial blob.
+
+Compares the single-pass row builders in `cli.dbedit.list` against the previous
+approach of appending one DataFrame per batch, on a synthetic trial.
+
+    $ python benchmarks/dbedit_list.py [--batches 500] [--samples 1000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from cli.dbedit import list as dblist
+
+
+def _synthetic_trial(num_batches: int, num_samples: int) -> dict:
+    return {
+        "assays": {
+            "wes": [
+                {
+                    "batch_id": f"batch_{b}",
+                    "records": [
+                        {"cimac_id": f"CTTT{b:04}{s:04}.00"} for s in range(num_samples)
+                    ],
+                }
+                for b in range(num_batches)
+            ],
+            "olink": {
+                "batches": [
+                    {
+                        "batch_id": f"batch_{b}",
+                        "records": [
+                            {
+                                "files": {
+                                    "assay_npx": {
+                                        "object_url": f"trial/olink/batch_{b}/assay_npx.xlsx",
+                                        "samples": [
+                                            f"CTTT{b:04}{s:04}.00"
+                                            for s in range(num_samples)
+                                        ],
+                                    }
+                                }
+                            }
+                        ],
+                    }
+                    for b in range(num_batches)
+                ]
+            },
+        }
+    }
+
+
+def _append_per_batch(metadata_json: dict) -> pd.DataFrame:
+    """The previous implementation of `_describe_generic`, one copy per batch"""
+    ret = pd.DataFrame(columns=["batch_id", "cimac_id"])
+    for batch_num, batch in enumerate(metadata_json["assays"]["wes"]):
+        ret = pd.concat(
+            [
+                ret,
+                pd.DataFrame(
+                    [
+                        {
+                            "batch_id": batch.get("batch_id", str(batch_num)),
+                            "cimac_id": record["cimac_id"],
+                        }
+                        for record in batch["records"]
+                    ]
+                ),
+            ]
+        )
+    return ret.reset_index(drop=True)
+
+
+def _time(label: str, func, *args, **kwargs) -> pd.DataFrame:
+    start = time.perf_counter()
+    df = func(*args, **kwargs)
+    print(f"{label:<32} {time.perf_counter() - start:8.3f}s  {len(df):>9} rows")
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batches", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    metadata_json = _synthetic_trial(args.batches, args.samples)
+    print(f"synthetic trial: {args.batches} batches x {args.samples} samples")
+
+    old = _time("append per batch (generic)", _append_per_batch, metadata_json)
+    new = _time(
+        "single pass (generic)",
+        dblist.describe,
+        metadata_json,
+        assay_or_analysis="wes",
+    )
+    assert (old.values == new.values).all()
+
+    _time(
+        "single pass (olink)",
+        dblist.describe,
+        metadata_json,
+        assay_or_analysis="olink",
+    )
+
+
+if __name__ == "__main__":
+    main()
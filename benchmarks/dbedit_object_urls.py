@@ -0,0 +1,115 @@
+"""
+Benchmark for finding the object_urls removed by `cidc admin remove assay`.
+
+Compares the previous recursive collector against the iterative walker in
+`cli.dbedit.remove`, on a whole synthetic trial, and then times a batch of
+removals from that trial, which only walk what they pop.
+
+    $ python benchmarks/dbedit_object_urls.py [--batches 200] [--samples 500] [--removals 300]
+"""
+import argparse
+import os
+import sys
+import time
+from copy import deepcopy
+from typing import List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from cli.dbedit import remove as dbremove
+from cli.dbedit.layouts import LAYOUTS
+
+
+def _synthetic_trial(num_batches: int, num_samples: int) -> dict:
+    def files(b: int, s: int) -> dict:
+        prefix = f"trial/wes/CTTT{b:04}{s:04}.00"
+        return {
+            "r1": [
+                {"object_url": f"{prefix}/r1_L{lane}.fastq.gz"} for lane in range(2)
+            ],
+            "r2": [
+                {"object_url": f"{prefix}/r2_L{lane}.fastq.gz"} for lane in range(2)
+            ],
+            "bam": {"object_url": f"{prefix}/reads.bam", "md5_hash": "x" * 24},
+        }
+
+    return {
+        "assays": {
+            "wes": [
+                {
+                    "batch_id": f"batch_{b}",
+                    "records": [
+                        {"cimac_id": f"CTTT{b:04}{s:04}.00", "files": files(b, s)}
+                        for s in range(num_samples)
+                    ],
+                }
+                for b in range(num_batches)
+            ]
+        }
+    }
+
+
+def _recursive_object_urls(target: dict) -> List[str]:
+    """The previous implementation of `_get_all_object_urls`"""
+    ret = []
+    for key, value in target.items():
+        if key == "object_url":
+            ret.append(value)
+        if isinstance(value, dict):
+            ret.extend(_recursive_object_urls(value))
+        if isinstance(value, list):
+            for each in value:
+                if isinstance(each, dict):
+                    ret.extend(_recursive_object_urls(each))
+    return ret
+
+
+def _time(f) -> float:
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--removals", type=int, default=300)
+    args = parser.parse_args()
+
+    trial = _synthetic_trial(args.batches, args.samples)
+
+    recursive, iterative = [], []
+    t_recursive = _time(lambda: recursive.extend(_recursive_object_urls(trial)))
+    t_iterative = _time(lambda: iterative.extend(dbremove._get_all_object_urls(trial)))
+    assert recursive == iterative
+    print(f"whole trial, {len(iterative)} object_urls")
+    print(f"  recursive: {t_recursive:.3f}s")
+    print(f"  iterative: {t_iterative:.3f}s")
+
+    # remove single records spread across batches, then their emptied batches
+    layout = LAYOUTS["wes"]
+    targets = [
+        (
+            f"batch_{i % args.batches}",
+            f"CTTT{i % args.batches:04}{i // args.batches:04}.00",
+        )
+        for i in range(min(args.removals, args.batches * args.samples))
+    ]
+
+    def remove_all(metadata_json: dict) -> List[str]:
+        urls = []
+        for target_id in targets:
+            _, removed = dbremove._remove_batched_assay_from_blob(
+                metadata_json, "trial", layout, *target_id
+            )
+            urls.extend(removed)
+        return urls
+
+    removed, metadata_json = [], deepcopy(trial)
+    t_removals = _time(lambda: removed.extend(remove_all(metadata_json)))
+    print(f"{len(targets)} removals, {len(removed)} object_urls")
+    print(f"  walking each removal: {t_removals:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""
+Performance harness for `cidc admin list` / `remove` against a local Postgres.
+
+Starts a throwaway Postgres with `initdb` / `pg_ctl` in a temporary directory,
+creates the API's trial_metadata, downloadable_files, upload_jobs and users tables,
+loads generated trials, and runs the dbedit commands against it. For each command it
+reports the wall time, the number of SQL statements, the bytes sent to / received
+from the server, and how long the trial row was locked FOR UPDATE.
+
+Save the results with --save and compare a later run with --baseline, which exits
+non-zero if any command got slower by more than --tolerance or ran more statements.
+
+    $ python benchmarks/dbedit_postgres.py [--trials 3] [--batches 20] [--samples 100]
+        [--pg-bin /usr/lib/postgresql/14/bin] [--save FILE] [--baseline FILE]
+
+Needs the Postgres server binaries, which aren't installed with the CLI.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from copy import deepcopy
+from typing import Callable, Dict, Iterator, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import pg8000
+import sqlalchemy
+
+from cli.dbedit import core, list as dblist, remove as dbremove, snapshots
+
+# the columns of the API's tables that dbedit uses, plus the usual bookkeeping
+SCHEMA = """
+CREATE TABLE trial_metadata (
+    id SERIAL PRIMARY KEY,
+    _created TIMESTAMP DEFAULT now(),
+    _updated TIMESTAMP DEFAULT now(),
+    _etag VARCHAR(40),
+    trial_id VARCHAR NOT NULL UNIQUE,
+    metadata_json JSONB NOT NULL
+);
+CREATE TABLE downloadable_files (
+    id SERIAL PRIMARY KEY,
+    _created TIMESTAMP DEFAULT now(),
+    _updated TIMESTAMP DEFAULT now(),
+    _etag VARCHAR(40),
+    trial_id VARCHAR NOT NULL REFERENCES trial_metadata (trial_id),
+    upload_type VARCHAR NOT NULL,
+    object_url VARCHAR NOT NULL UNIQUE,
+    file_size_bytes BIGINT,
+    md5_hash VARCHAR,
+    uploaded_timestamp TIMESTAMP,
+    facet_group VARCHAR,
+    additional_metadata JSONB
+);
+CREATE INDEX ix_downloadable_files_trial_id ON downloadable_files (trial_id);
+CREATE TABLE upload_jobs (
+    id SERIAL PRIMARY KEY,
+    _created TIMESTAMP DEFAULT now(),
+    _updated TIMESTAMP DEFAULT now(),
+    _etag VARCHAR(40),
+    status VARCHAR NOT NULL,
+    trial_id VARCHAR NOT NULL REFERENCES trial_metadata (trial_id),
+    upload_type VARCHAR NOT NULL,
+    uploader_email VARCHAR,
+    metadata_patch JSONB,
+    gcs_xlsx_uri VARCHAR,
+    gcs_file_map JSONB,
+    multifile BOOLEAN
+);
+CREATE TABLE users (
+    id SERIAL PRIMARY KEY,
+    _created TIMESTAMP DEFAULT now(),
+    _updated TIMESTAMP DEFAULT now(),
+    _etag VARCHAR(40),
+    email VARCHAR NOT NULL UNIQUE,
+    role VARCHAR
+);
+"""
+
+
+def _find_pg_bin(pg_bin: Optional[str]) -> str:
+    if pg_bin:
+        return pg_bin
+    initdb: Optional[str] = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    candidates = sorted(glob.glob("/usr/lib/postgresql/*/bin/initdb"))
+    if candidates:
+        return os.path.dirname(candidates[-1])
+    sys.exit("Cannot find initdb / pg_ctl, give --pg-bin")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_postgres(pg_bin: str) -> Iterator[Callable[[], pg8000.Connection]]:
+    """Runs a throwaway Postgres, yielding a function to connect to it"""
+    tmp: str = tempfile.mkdtemp(prefix="cidc_dbedit_bench_")
+    data, port = os.path.join(tmp, "data"), _free_port()
+    try:
+        subprocess.run(
+            [os.path.join(pg_bin, "initdb"), "-D", data, "-U", "postgres"]
+            + ["--auth=trust", "-E", "UTF8"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        subprocess.run(
+            [os.path.join(pg_bin, "pg_ctl"), "-D", data, "-l", f"{tmp}/log", "-w"]
+            + ["-o", f"-p {port} -k {tmp} -c listen_addresses=''", "start"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        yield lambda: pg8000.connect(
+            user="postgres", unix_sock=f"{tmp}/.s.PGSQL.{port}", database="postgres"
+        )
+    finally:
+        if os.path.exists(os.path.join(data, "postmaster.pid")):
+            subprocess.run(
+                [os.path.join(pg_bin, "pg_ctl"), "-D", data, "-m", "fast", "stop"],
+                stdout=subprocess.DEVNULL,
+            )
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _trial(trial_id: str, num_batches: int, num_samples: int) -> dict:
+    def record(b: int, s: int) -> dict:
+        cimac_id = f"C{trial_id[-3:]}{b:03}{s:03}.00"
+        prefix = f"{trial_id}/wes/{cimac_id}"
+        return {
+            "cimac_id": cimac_id,
+            "files": {
+                "r1": [{"object_url": f"{prefix}/r1_L{n}.fastq.gz"} for n in range(2)],
+                "r2": [{"object_url": f"{prefix}/r2_L{n}.fastq.gz"} for n in range(2)],
+                "bam": {"object_url": f"{prefix}/reads.bam", "md5_hash": "x" * 24},
+            },
+        }
+
+    return {
+        "protocol_identifier": trial_id,
+        "participants": [
+            {
+                "cimac_participant_id": f"C{trial_id[-3:]}{b:03}",
+                "samples": [
+                    {"cimac_id": f"C{trial_id[-3:]}{b:03}{s:03}.00"}
+                    for s in range(num_samples)
+                ],
+            }
+            for b in range(num_batches)
+        ],
+        "shipments": [
+            {"manifest_id": f"{trial_id}_manifest_{b}"} for b in range(num_batches)
+        ],
+        "clinical_data": {
+            "records": [
+                {
+                    "clinical_file": {
+                        "object_url": f"{trial_id}/clinical/file_{n}.xlsx",
+                        "number_of_participants": num_batches,
+                    }
+                }
+                for n in range(3)
+            ]
+        },
+        "assays": {
+            "wes": [
+                {
+                    "batch_id": f"batch_{b}",
+                    "records": [record(b, s) for s in range(num_samples)],
+                }
+                for b in range(num_batches)
+            ]
+        },
+    }
+
+
+def _load(engine, num_trials: int, num_batches: int, num_samples: int) -> List[str]:
+    trial_ids = [f"bench_trial_{n:03}" for n in range(num_trials)]
+    with engine.begin() as conn:
+        conn.exec_driver_sql(SCHEMA)
+        for trial_id in trial_ids:
+            metadata_json = _trial(trial_id, num_batches, num_samples)
+            conn.execute(
+                sqlalchemy.text(
+                    "INSERT INTO trial_metadata (trial_id, metadata_json, _etag) "
+                    "VALUES (:trial_id, CAST(:metadata_json AS JSONB), :etag)"
+                ),
+                dict(
+                    trial_id=trial_id,
+                    metadata_json=json.dumps(metadata_json),
+                    etag=uuid.uuid4().hex,
+                ),
+            )
+            object_urls = [
+                url
+                for url in dbremove._get_all_object_urls(metadata_json)
+                if "/wes/" in url or "/clinical/" in url
+            ]
+            conn.execute(
+                sqlalchemy.text(
+                    "INSERT INTO downloadable_files "
+                    "(trial_id, upload_type, object_url, file_size_bytes) "
+                    "VALUES (:trial_id, :upload_type, :object_url, 1024)"
+                ),
+                [
+                    dict(
+                        trial_id=trial_id,
+                        upload_type="wes" if "/wes/" in url else "clinical_data",
+                        object_url=url,
+                    )
+                    for url in object_urls
+                ],
+            )
+            conn.execute(
+                sqlalchemy.text(
+                    "INSERT INTO upload_jobs "
+                    "(status, trial_id, upload_type, metadata_patch) "
+                    "VALUES ('merge-completed', :trial_id, 'pbmc', "
+                    "CAST(:metadata_patch AS JSONB))"
+                ),
+                [
+                    dict(
+                        trial_id=trial_id,
+                        metadata_patch=json.dumps(
+                            {
+                                "participants": [participant],
+                                "shipments": [shipment],
+                            }
+                        ),
+                    )
+                    for participant, shipment in zip(
+                        metadata_json["participants"], metadata_json["shipments"]
+                    )
+                ],
+            )
+    return trial_ids
+
+
+class _Metrics:
+    def __init__(self):
+        self.statements = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.locked_at: Optional[float] = None
+        self.lock_held = 0.0
+
+
+class _CountingFile:
+    """Wraps pg8000's socket file to count the bytes sent and received"""
+
+    def __init__(self, file, metrics: _Metrics):
+        self._file, self._metrics = file, metrics
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._metrics.bytes_received += len(data)
+        return data
+
+    def write(self, data):
+        self._metrics.bytes_sent += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def _instrument(engine, metrics: _Metrics) -> None:
+    @sqlalchemy.event.listens_for(engine, "connect")
+    def connect(dbapi_conn, record):
+        dbapi_conn._sock = _CountingFile(dbapi_conn._sock, metrics)
+
+    @sqlalchemy.event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, many):
+        metrics.statements += 1
+        if "FOR UPDATE" in statement and metrics.locked_at is None:
+            metrics.locked_at = time.perf_counter()
+
+    def end_transaction(conn):
+        if metrics.locked_at is not None:
+            metrics.lock_held += time.perf_counter() - metrics.locked_at
+            metrics.locked_at = None
+
+    sqlalchemy.event.listen(engine, "commit", end_transaction)
+    sqlalchemy.event.listen(engine, "rollback", end_transaction)
+
+
+def _measure(metrics: _Metrics, f: Callable[[], object]) -> Dict[str, float]:
+    metrics.__init__()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        f()
+    return {
+        "seconds": round(time.perf_counter() - start, 4),
+        "statements": metrics.statements,
+        "bytes_sent": metrics.bytes_sent,
+        "bytes_received": metrics.bytes_received,
+        "lock_seconds": round(metrics.lock_held, 4),
+    }
+
+
+def _commands(
+    trial_ids: List[str], num_batches: int, num_samples: int
+) -> Dict[str, Callable[[], object]]:
+    trial_id = trial_ids[0]
+
+    def in_session(f):
+        def run():
+            with core.Session.begin() as session:
+                f(session)
+
+        return run
+
+    def removals(first_batch: int) -> List[dbremove.RemovalTarget]:
+        return [
+            (
+                trial_id,
+                "wes",
+                (f"batch_{first_batch}", f"C{trial_id[-3:]}{first_batch:03}{s:03}.00"),
+            )
+            for s in range(num_samples // 2)
+        ] + [(trial_id, "wes", (f"batch_{first_batch + 1}",))]
+
+    def many_changes() -> None:
+        # single records from batches 4 onwards, leaving one in each, so each is a
+        # change of its own, until there are more than fit in one UPDATE
+        targets = [
+            (trial_id, "wes", (f"batch_{b}", f"C{trial_id[-3:]}{b:03}{s:03}.00"))
+            for b in range(4, num_batches)
+            for s in range(1, num_samples)
+        ][: dbremove.PATCH_OPS_PER_STATEMENT * 2 + 1]
+        with core.Session.begin() as session:
+            expected = deepcopy(
+                core.get_trial_if_exists(trial_id, session=session).metadata_json
+            )
+        dbremove._plan_removals(expected, trial_id, targets)
+
+        dbremove.remove_data_batch(targets)
+        with core.Session.begin() as session:
+            trial = core.get_trial_if_exists(trial_id, session=session)
+            assert trial.metadata_json == expected, "patched metadata_json differs"
+
+    return {
+        "get_trial_if_exists": in_session(
+            lambda session: core.get_trial_if_exists(trial_id, session=session)
+        ),
+        "get_shipments": in_session(
+            lambda session: core.get_shipments(trial_id, session=session)
+        ),
+        "list assay (cold snapshot)": lambda: dblist.list_data_cimac_ids(
+            trial_id, "wes", output_format="csv"
+        ),
+        "list assay (warm snapshot)": lambda: dblist.list_data_cimac_ids(
+            trial_id, "wes", output_format="csv"
+        ),
+        "list clinical": lambda: dblist.list_clinical(trial_id, output_format="csv"),
+        "list shipments": lambda: dblist.list_shipments(trial_id, output_format="csv"),
+        "list assay --trial ... --assay all": lambda: dblist.list_bulk_cimac_ids(
+            trial_ids, ["all"], output_format="csv"
+        ),
+        "remove assay --dry-run": lambda: dbremove.remove_data_batch(
+            removals(0), dry_run=True
+        ),
+        "remove assay --two-phase": lambda: dbremove.remove_data_batch(
+            removals(0), two_phase=True
+        ),
+        "remove assay": lambda: dbremove.remove_data_batch(removals(2)),
+        "remove assay (several UPDATEs, checked)": many_changes,
+    }
+
+
+def _compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: {before['seconds']}s -> {result['seconds']}s")
+        if result["statements"] > before["statements"]:
+            regressions.append(
+                f"{name}: {before['statements']} -> {result['statements']} statements"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--pg-bin", default=None)
+    parser.add_argument("--save", default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="compare to saved results")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    if args.batches < 4:
+        parser.error("--batches must be at least 4 for the removals")
+
+    with local_postgres(
+        _find_pg_bin(args.pg_bin)
+    ) as connect, tempfile.TemporaryDirectory() as cache:
+        engine = sqlalchemy.create_engine(
+            "postgresql+pg8000://",
+            creator=connect,
+            json_deserializer=core.json_loads_exact,
+        )
+        trial_ids = _load(engine, args.trials, args.batches, args.samples)
+
+        metrics = _Metrics()
+        _instrument(engine, metrics)
+        core.use_engine(engine, dblist)
+        core.wire(dbremove)
+        snapshots.CIDC_WORKING_DIR = cache
+
+        results = {
+            name: _measure(metrics, command)
+            for name, command in _commands(
+                trial_ids, args.batches, args.samples
+            ).items()
+        }
+
+    print(f"{args.trials} trials of {args.batches} x {args.samples} wes samples")
+    width = max(len(name) for name in results)
+    print(f"{'command':<{width}}  seconds  statements  sent KB  received KB  locked s")
+    for name, r in results.items():
+        print(
+            f"{name:<{width}}  {r['seconds']:7.3f}  {r['statements']:10}"
+            f"  {r['bytes_sent'] / 1024:7.1f}  {r['bytes_received'] / 1024:11.1f}"
+            f"  {r['lock_seconds']:8.3f}"
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = _compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
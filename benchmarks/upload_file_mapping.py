@@ -0,0 +1,109 @@
+"""
+Benchmark for resolving an upload's local files, as `cidc assays upload` does.
+
+Builds a synthetic tree of `--files` files in directories of `--per-dir`, with
+`--optional` of the mapped files optional and missing, and times
+`cli.upload._compose_file_mapping` against checking each file in turn and matching
+it against every optional file. `--latency-ms` adds a delay to each file system
+metadata call to stand in for a network file system like NFS or Lustre.
+
+    $ python benchmarks/upload_file_mapping.py [--files 50000] [--per-dir 100]
+        [--optional 1000] [--latency-ms 0]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from cli import api, upload
+
+
+def _make_tree(root: str, num_files: int, per_dir: int) -> List[str]:
+    paths = []
+    for n in range(num_files):
+        directory = os.path.join(root, f"batch_{n // per_dir:04}")
+        if n % per_dir == 0:
+            os.makedirs(directory)
+        path = os.path.join(directory, f"CTTTPP{n:06}.00_r1.fastq.gz")
+        open(path, "w").close()
+        paths.append(os.path.relpath(path, root))
+    return paths
+
+
+def _serial(upload_info: api.UploadInfo, xlsx: str) -> Tuple[list, list]:
+    """The file by file resolution _compose_file_mapping replaced"""
+    res, missing_optional_files = [], []
+    xlsx_dir = os.path.abspath(os.path.dirname(xlsx))
+    for source_path, gcs_uri in upload_info.url_mapping.items():
+        source_path = os.path.join(xlsx_dir, source_path)
+        if not os.path.isfile(source_path):
+            if any(source_path.endswith(f) for f in upload_info.optional_files):
+                missing_optional_files.append(gcs_uri)
+                continue
+        res.append([source_path, f"gs://{upload_info.gcs_bucket}/{gcs_uri}"])
+    return res, missing_optional_files
+
+
+def _with_latency(latency: float):
+    isfile, scandir = os.path.isfile, os.scandir
+
+    def slow_isfile(path):
+        time.sleep(latency)
+        return isfile(path)
+
+    def slow_scandir(path):
+        time.sleep(latency)
+        return scandir(path)
+
+    os.path.isfile, os.scandir = slow_isfile, slow_scandir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=50_000)
+    parser.add_argument("--per-dir", type=int, default=100)
+    parser.add_argument("--optional", type=int, default=1_000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="cidc_upload_bench_")
+    try:
+        paths = _make_tree(root, args.files, args.per_dir)
+        optional = [
+            f"missing/CTTTPP{n:06}.00_r2.fastq.gz" for n in range(args.optional)
+        ]
+        upload_info = api.UploadInfo(
+            job_id=0,
+            job_etag="",
+            gcs_bucket="bucket",
+            url_mapping={path: f"gcs/{path}" for path in paths + optional},
+            extra_metadata={},
+            gcs_file_map={},
+            optional_files=optional,
+            token="",
+        )
+        xlsx = os.path.join(root, "manifest.xlsx")
+        if args.latency_ms:
+            _with_latency(args.latency_ms / 1000)
+
+        print(f"{args.files} files in directories of {args.per_dir}")
+        print(f"{args.optional} optional files, {args.latency_ms} ms per metadata call")
+        for name, compose in [
+            ("file by file", _serial),
+            ("upload._compose_file_mapping", upload._compose_file_mapping),
+        ]:
+            start = time.perf_counter()
+            res, skipping = compose(upload_info, xlsx)
+            elapsed = time.perf_counter() - start
+            assert len(res) == args.files and len(skipping) == args.optional
+            print(f"  {name}: {elapsed:.3f}s")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 """Implements a client for the CIDC API running on Google App Engine"""
+import os
+import threading
+import time
+from datetime import datetime
 from functools import wraps
 from collections import namedtuple
 from typing import Optional, List, BinaryIO, NamedTuple, Dict, Callable
@@ -7,7 +11,7 @@ import click
 import requests
 import pyperclip
 
-from . import auth, __version__
+from . import auth, cache, __version__
 from .config import API_V2_URL, get_env
 
 
@@ -70,19 +74,102 @@ def check_auth(id_token: str) -> Optional[str]:
         raise ApiError(_error_message(response))
 
 
+def _token_url() -> str:
+    return f'https://{"staging" if get_env() != "prod" else ""}portal.cimac-network.org/assays/cli-instructions'
+
+
+def _prompt_for_token() -> Optional[str]:
+    """
+    Prompt the user for a fresh ID token from the portal until they give a valid one,
+    which is cached. Returns None if the token can't be read from the clipboard.
+    """
+    while True:
+        click.prompt(
+            (
+                "\nCIDC reauthentication required. Please copy a fresh identity token from the Portal "
+                f"to your clipboard at this URL:\n\n\t{_token_url()}\n\n"
+                "Then, press 'enter' to paste your copied token below"
+            ),
+            default="enter",
+            show_default=False,
+        )
+        try:
+            id_token = _read_clipboard()
+        except:
+            click.echo(
+                f"\n\nError: could not read token from clipboard.\n",
+                color="red",
+            )
+            return None
+        click.echo(f"\n{id_token}\n")
+
+        # Validate and cache the user's ID token. If the token is invalid,
+        # inform the user, and re-prompt them for an identity token.
+        try:
+            auth.validate_and_cache_token(id_token)
+            return id_token
+        except auth.AuthError:
+            click.echo("The token you entered is invalid.")
+
+
+# set when a background thread's request needs the main thread to get a fresh ID token
+_token_wanted = threading.Event()
+# the token it wants replaced
+_wanted_to_replace: Optional[str] = None
+# how long a background thread waits for the main thread to get a fresh ID token
+REAUTH_TIMEOUT = 10 * 60
+# how often it checks if it has, in seconds
+REAUTH_POLL_INTERVAL = 0.5
+
+
+def _refresh_token(stale_token: Optional[str]) -> Optional[str]:
+    """
+    Get a fresh ID token to replace `stale_token`, or None if there isn't one.
+    Only the main thread prompts the user, so prompts never interleave with
+    output from other threads. Others flag that they want one with
+    `_token_wanted`, for the main thread to see in `refresh_token_if_due`,
+    and wait up to REAUTH_TIMEOUT for it.
+    """
+    global _wanted_to_replace
+    if threading.current_thread() is threading.main_thread():
+        _token_wanted.clear()
+    id_token = cache.get(auth.TOKEN)
+    if id_token and id_token != stale_token:
+        return id_token
+    if threading.current_thread() is threading.main_thread():
+        return _prompt_for_token()
+
+    _wanted_to_replace = stale_token
+    _token_wanted.set()
+    deadline = time.time() + REAUTH_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(REAUTH_POLL_INTERVAL)
+        id_token = cache.get(auth.TOKEN)
+        if id_token and id_token != stale_token:
+            return id_token
+    return None
+
+
+def _sent_token(kwargs: dict) -> Optional[str]:
+    """The ID token a request with these kwargs will be sent with"""
+    authorization = (kwargs.get("headers") or {}).get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer ") :]
+    return cache.get(auth.TOKEN)
+
+
 def retry_with_reauth(api_request):
     """
     For a function `api_request` that returns a `Response` object, if that response
     has status code 403, prompt the user to enter a fresh ID token from the portal,
     and retry the request.
+    If several threads' requests need a fresh token, the user is only prompted once.
     """
 
-    TOKEN_URL = f'https://{"staging" if get_env() != "prod" else ""}portal.cimac-network.org/assays/cli-instructions'
-
     @wraps(api_request)
     def wrapped(*args, **kwargs):
-        retry = True
-        while retry:
+        while True:
+            sent_token = _sent_token(kwargs)
             res = api_request(*args, **kwargs)
             # If the error isn't auth-related, break out of the retry loop.
             if res.status_code != 401:
@@ -94,39 +181,11 @@ def retry_with_reauth(api_request):
             if "is not authorized to upload" in error_message:
                 raise ApiError(error_message)
 
-            # Prompt the user for a new ID token.
-            while True:
-                click.prompt(
-                    (
-                        "\nCIDC reauthentication required. Please copy a fresh identity token from the Portal "
-                        f"to your clipboard at this URL:\n\n\t{TOKEN_URL}\n\n"
-                        "Then, press 'enter' to paste your copied token below"
-                    ),
-                    default="enter",
-                    show_default=False,
-                )
-                try:
-                    id_token = _read_clipboard()
-                except:
-                    click.echo(
-                        f"\n\nError: could not read token from clipboard.\n",
-                        color="red",
-                    )
-                    retry = False
-                    break
-                click.echo(f"\n{id_token}\n")
-
-                # Validate and cache the user's ID token. If the token is invalid,
-                # inform the user, and re-prompt them for an identity token.
-                try:
-                    auth.validate_and_cache_token(id_token)
-                    kwargs["headers"] = _with_auth(kwargs.get("headers"), id_token)
-                    break
-                except auth.AuthError:
-                    click.echo("The token you entered is invalid.")
-
-            if not retry:
+            # Get a new ID token, waiting on any other thread already getting one
+            id_token = _refresh_token(sent_token)
+            if not id_token:
                 break
+            kwargs["headers"] = _with_auth(kwargs.get("headers"), id_token)
 
             # Rewind any file pointers to avoid sending empty files on retry
             if "files" in kwargs:
@@ -142,6 +201,92 @@ def retry_with_reauth(api_request):
     return wrapped
 
 
+# how long before the cached ID token expires to ask for a fresh one, in seconds
+REFRESH_MARGIN = 15 * 60
+# how often to check when the cached ID token expires, in seconds
+REFRESH_INTERVAL = 60
+
+
+# the TokenRefresher in use, if any
+_refresher: Optional["TokenRefresher"] = None
+
+
+class TokenRefresher:
+    """
+    Watches the cached ID token in a background thread, and flags when it's
+    about to expire, for the main thread to ask for a fresh one in
+    `refresh_token_if_due` between checks on transfers, which carry on
+    meanwhile. That way, a long-running command like an upload doesn't stop
+    on its next API request for one, and it never prompts off the main thread.
+    Use as a context manager around the command.
+    """
+
+    def __init__(
+        self, margin: float = REFRESH_MARGIN, interval: float = REFRESH_INTERVAL
+    ):
+        self.margin = margin
+        self.interval = interval
+        self.expiry: Optional[float] = None
+        self._due = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "TokenRefresher":
+        global _refresher
+        _refresher = self
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _refresher
+        if _refresher is self:
+            _refresher = None
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            id_token = cache.get(auth.TOKEN)
+            expiry = id_token and auth.get_token_expiry(id_token)
+            if expiry and expiry - time.time() <= self.margin:
+                self.expiry = expiry
+                self._due.set()
+
+    def is_due(self) -> bool:
+        return self._due.is_set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._due.clear()
+
+
+def refresh_token_if_due() -> None:
+    """
+    On the main thread, ask for a fresh ID token if the `TokenRefresher` in use
+    found the cached one is about to expire, or another thread's request needs one.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    refresher = _refresher
+    due = refresher is not None and refresher.is_due()
+    if not (due or _token_wanted.is_set()):
+        return
+
+    if due:
+        click.secho(
+            f"\nYour CIDC identity token expires at "
+            f"{datetime.fromtimestamp(refresher.expiry):%H:%M}; transfers will carry on "
+            "while you get a new one.",
+            fg="yellow",
+        )
+    stale_token = cache.get(auth.TOKEN) if due else _wanted_to_replace
+    if not _refresh_token(stale_token) and refresher is not None:
+        # don't keep prompting if the clipboard doesn't work
+        refresher.stop()
+    elif refresher is not None:
+        refresher._due.clear()
+
+
 class _RequestsWithReauth:
     def __init__(self):
         """Build a `request` instance with all methods wrapped in the `retry_with_reauth` decorator."""
@@ -179,6 +324,8 @@ class UploadInfo(NamedTuple):
     gcs_file_map: dict
     optional_files: list
     token: str
+    # signed resumable upload URLs by object name, if the API made them
+    signed_urls: Optional[dict] = None
 
 
 def test_csms():
@@ -187,6 +334,17 @@ def test_csms():
     click.echo(response.json())
 
 
+def _transfer_modes() -> List[str]:
+    """
+    The ways this CLI can upload files, in order of preference, for the API to pick
+    from: with signed URLs it makes, or with gsutil. Set CIDC_TRANSFER_MODE=gsutil
+    to always upload with gsutil.
+    """
+    if os.environ.get("CIDC_TRANSFER_MODE") == "gsutil":
+        return ["gsutil"]
+    return ["signed_url", "gsutil"]
+
+
 def initiate_upload(
     upload_type: str, xlsx_file: BinaryIO, is_analysis: bool = False
 ) -> UploadInfo:
@@ -203,7 +361,7 @@ def initiate_upload(
         UploadInfo: a mapping from local filepaths to GCS upload URIs,
         along with an upload job ID.
     """
-    data = {"schema": upload_type}
+    data = {"schema": upload_type, "transfer_modes": ",".join(_transfer_modes())}
 
     files = {"template": xlsx_file}
 
@@ -215,7 +373,10 @@ def initiate_upload(
 
     try:
         upload_info = response.json()
-        return UploadInfo(**upload_info)
+        # ignore anything from a newer API this CLI doesn't know about
+        return UploadInfo(
+            **{k: v for k, v in upload_info.items() if k in UploadInfo._fields}
+        )
     except:
         raise ApiError(
             "Cannot decode API response. You may need to update the CIDC CLI."
@@ -265,6 +426,78 @@ def upload_failed(job_id: int, job_token: str, etag: str, gcs_file_map: Dict[str
     _update_upload_status(job_id, job_token, etag, "upload-failed", gcs_file_map)
 
 
+class DownloadableFile(NamedTuple):
+    """A trial file that can be downloaded, as listed by the API"""
+
+    id: int
+    object_url: str
+    file_size_bytes: int
+    # base64 encoded, as GCS reports it, if GCS has one for the object
+    md5_hash: Optional[str]
+
+
+# how many files to list per request
+FILES_PAGE_SIZE = 200
+
+
+def list_downloadable_files(
+    trial_id: str, facets: List[str] = None
+) -> List[DownloadableFile]:
+    """List a trial's downloadable files, or those matching any of `facets`"""
+    params = {"trial_ids": trial_id, "page_size": FILES_PAGE_SIZE}
+    if facets:
+        params["facets"] = ",".join(facets)
+
+    files = []
+    page_num = 0
+    while True:
+        response = _requests_with_reauth.get(
+            _url("/downloadable_files"),
+            params={**params, "page_num": page_num},
+            headers=_with_auth(),
+        )
+        if not response.ok:
+            raise ApiError(_error_message(response))
+        try:
+            page = response.json()
+            files.extend(
+                DownloadableFile(
+                    item["id"],
+                    item["object_url"],
+                    item["file_size_bytes"],
+                    item.get("md5_hash"),
+                )
+                for item in page["_items"]
+            )
+        except (ValueError, KeyError, TypeError):
+            raise ApiError(
+                "Cannot decode API response. You may need to update the CIDC CLI."
+            )
+        if not page["_items"] or len(files) >= page["_meta"]["total"]:
+            return files
+        page_num += 1
+
+
+def get_download_url(file_id: int) -> str:
+    """Get a signed URL to download a file from"""
+    response = _requests_with_reauth.get(
+        _url("/downloadable_files/download_url"),
+        params={"id": file_id},
+        headers=_with_auth(),
+    )
+    if not response.ok:
+        raise ApiError(_error_message(response))
+    try:
+        url = response.json()
+    except ValueError:
+        url = None
+    if not isinstance(url, str):
+        raise ApiError(
+            "Cannot decode API response. You may need to update the CIDC CLI."
+        )
+    return url
+
+
 class MergeStatus(NamedTuple):
     status: Optional[str]
     status_details: Optional[str]
@@ -1,4 +1,6 @@
 """Methods for working with id tokens"""
+from typing import Optional
+
 import click
 from jose import jwt
 from jose.exceptions import JWTError
@@ -70,3 +72,11 @@ def get_user_email() -> str:
         raise unauthenticated()
 
     return claims["email"]
+
+
+def get_token_expiry(id_token: str) -> Optional[int]:
+    """When an id token expires, as a unix timestamp, if it says."""
+    try:
+        return jwt.get_unverified_claims(id_token).get("exp")
+    except JWTError:
+        return None
@@ -1,8 +1,17 @@
 """The second generation CIDC command-line interface."""
+import os
+
 import click
 
-from . import api, auth, gcloud, upload, config, consent, __version__
-from .dbedit.cli import get_username, list_, remove_, set_username
+from . import api, auth, download, upload, config, consent, __version__
+from .dbedit.cli import (
+    get_replica,
+    get_username,
+    list_,
+    remove_,
+    set_replica,
+    set_username,
+)
 
 #### $ cidc ####
 @click.group()
@@ -12,7 +21,6 @@ def cidc(ignore):
     config.check_env_warning(ignore)
     if not consent.check_consent():
         exit(0)
-    gcloud.check_installed()
 
 
 #### $ cidc version ####
@@ -88,11 +96,52 @@ def list_assays():
 @click.command("upload")
 @click.option("--assay", required=True, help="Assay type.")
 @click.option("--xlsx", required=True, help="Path to the assay metadata spreadsheet.")
-def upload_assay(assay, xlsx):
+@click.option(
+    "--shards",
+    default=1,
+    type=click.IntRange(min=1),
+    help="How many worker nodes to split the upload between, with --journal.",
+)
+@click.option(
+    "--journal",
+    type=click.Path(file_okay=False),
+    help="An empty directory, shared with the worker nodes, to coordinate them through.",
+)
+def upload_assay(assay, xlsx, shards, journal):
     """
     Upload data for an assay.
+    With --shards and --journal, split the files between worker nodes,
+    each running `cidc assays upload-worker --journal`.
+    """
+    _check_journal(shards, journal)
+    upload.run_upload(assay, xlsx, journal_dir=journal, num_shards=shards)
+
+
+def _check_journal(shards: int, journal: str):
+    if shards > 1 and not journal:
+        raise click.UsageError("--shards needs a --journal directory")
+    if journal and os.path.isdir(journal) and os.listdir(journal):
+        raise click.BadParameter(f"{journal} isn't empty", param_hint="--journal")
+
+
+#### $ cidc assays upload-worker ####
+@click.command("upload-worker")
+@click.option(
+    "--journal",
+    required=True,
+    type=click.Path(exists=True, file_okay=False),
+    help="The --journal directory of the upload.",
+)
+@click.option(
+    "--shard",
+    type=int,
+    help="Upload this shard, eg again after it failed, instead of the next unclaimed one.",
+)
+def upload_worker(journal, shard):
     """
-    upload.run_upload(assay, xlsx)
+    Upload a shard of an upload split between worker nodes.
+    """
+    upload.run_upload_worker(journal, shard)
 
 
 #### $ cidc analyses ####
@@ -116,11 +165,51 @@ def list_analyses():
 @click.option(
     "--xlsx", required=True, help="Path to the analysis metadata spreadsheet."
 )
-def upload_analysis(analysis, xlsx):
+@click.option(
+    "--shards",
+    default=1,
+    type=click.IntRange(min=1),
+    help="How many worker nodes to split the upload between, with --journal.",
+)
+@click.option(
+    "--journal",
+    type=click.Path(file_okay=False),
+    help="An empty directory, shared with the worker nodes, to coordinate them through.",
+)
+def upload_analysis(analysis, xlsx, shards, journal):
     """
     Upload data for an analysis.
+    With --shards and --journal, split the files between worker nodes,
+    each running `cidc analyses upload-worker --journal`.
     """
-    upload.run_upload(analysis, xlsx, is_analysis=True)
+    _check_journal(shards, journal)
+    upload.run_upload(
+        analysis, xlsx, is_analysis=True, journal_dir=journal, num_shards=shards
+    )
+
+
+#### $ cidc files ####
+@click.group()
+def files():
+    """Manage trial files."""
+
+
+#### $ cidc files download ####
+@click.command("download")
+@click.option("--trial", required=True, help="Trial ID.")
+@click.option(
+    "--facet",
+    "facets",
+    multiple=True,
+    help="Only download files of this facet, eg 'Assay Type|WES|Source'. Can be repeated.",
+)
+@click.argument("dest", type=click.Path(file_okay=False))
+def download_files(trial, facets, dest):
+    """
+    Download a trial's files to DEST.
+    Files already in DEST are skipped, and interrupted downloads carry on when run again.
+    """
+    download.run_download(trial, list(facets), dest)
 
 
 # Wire up the interface
@@ -128,6 +217,7 @@ cidc.add_command(version)
 cidc.add_command(login)
 cidc.add_command(assays)
 cidc.add_command(analyses)
+cidc.add_command(files)
 cidc.add_command(config_)
 cidc.add_command(admin_)
 
@@ -136,14 +226,20 @@ config_.add_command(get_env)
 
 assays.add_command(list_assays)
 assays.add_command(upload_assay)
+assays.add_command(upload_worker)
 
 analyses.add_command(list_analyses)
 analyses.add_command(upload_analysis)
+analyses.add_command(upload_worker)
+
+files.add_command(download_files)
 
 admin_.add_command(test_csms)
+admin_.add_command(get_replica)
 admin_.add_command(get_username)
 admin_.add_command(list_)
 admin_.add_command(remove_)
+admin_.add_command(set_replica)
 admin_.add_command(set_username)
 
 if __name__ == "__main__":
@@ -1,8 +1,63 @@
-from typing import Tuple
+from typing import Optional, Tuple
 import click
 
-from . import core, remove, list as dblist
+from . import core, gcs, remove, list as dblist
 from . import config
+from .output import OUTPUT_FORMATS
+
+
+def _output_options(f):
+    """Add --format, --output, and --log-queries options to a listing command"""
+    f = click.option(
+        "--output",
+        "output_file",
+        type=click.Path(dir_okay=False, writable=True),
+        default=None,
+        help="Write to FILE instead of stdout.",
+    )(f)
+    f = click.option(
+        "--format",
+        "output_format",
+        type=click.Choice(OUTPUT_FORMATS),
+        default="table",
+        show_default=True,
+        help="Pretty table, or streamed csv / tsv / jsonl / parquet rows.",
+    )(f)
+    f = click.option(
+        "--log-queries",
+        is_flag=True,
+        help="Print how long each database query takes to stderr.",
+    )(f)
+    return f
+
+
+def _delete_objects_option(f):
+    """Add a --delete-objects flag to a removal command"""
+    return click.option(
+        "--delete-objects",
+        is_flag=True,
+        help="Also delete the removed files from GCS once the removal is committed.",
+    )(f)
+
+
+def _phase_options(f):
+    """Add --dry-run and --two-phase flags to a removal command"""
+    f = click.option(
+        "--two-phase",
+        is_flag=True,
+        help="Plan without locking, then lock only to check for changes and apply.",
+    )(f)
+    f = click.option(
+        "--dry-run",
+        is_flag=True,
+        help="Only print what would be removed, without locking or changing anything.",
+    )(f)
+    return f
+
+
+def _check_phase_options(dry_run: bool, two_phase: bool) -> None:
+    if dry_run and two_phase:
+        raise click.UsageError("Give at most one of --dry-run and --two-phase")
 
 
 #### $ cidc admin get-username ####
@@ -21,6 +76,28 @@ def set_username(username: str):
     click.echo(f"Updated database username to {username}")
 
 
+#### $ cidc admin get-replica ####
+@click.command()
+def get_replica():
+    """Get the read replica that listing commands use for the current environment."""
+    replica: Optional[str] = config.get_replica(core.get_db_env())
+    click.echo(" ".join(["read replica:", replica or "none, using primary"]))
+
+
+#### $ cidc admin set-replica ####
+@click.command()
+@click.argument("connection_name", required=True, type=str)
+def set_replica(connection_name: str):
+    """
+    Set the read replica that listing commands use for the current environment.
+
+    CONNECTION_NAME is the Cloud SQL instance connection name of the replica,
+    eg project:region:instance, or "" to use the primary.
+    """
+    config.set_replica(core.get_db_env(), connection_name)
+    click.echo(f"Updated read replica to {connection_name or 'none, using primary'}")
+
+
 #### $ cidc admin list ####
 @click.group("list")
 def list_():
@@ -37,57 +114,124 @@ def list_supported():
 
 #### $ cidc admin list assay ####
 @click.command("assay")
-@click.argument("trial_id", required=True, type=str)
-@click.argument("assay_or_analysis", required=True, type=str)
-def list_assay(trial_id: str, assay_or_analysis: str):
+@click.argument("trial_id", required=False, type=str)
+@click.argument("assay_or_analysis", required=False, type=str)
+@click.option(
+    "--trial",
+    "trial_ids",
+    multiple=True,
+    help="A trial to list, can be given multiple times.",
+)
+@click.option(
+    "--assay",
+    "assays_or_analyses",
+    multiple=True,
+    help="An assay or analysis to list, can be given multiple times; `all` for all.",
+)
+@_output_options
+def list_assay(
+    trial_id: Optional[str],
+    assay_or_analysis: Optional[str],
+    trial_ids: Tuple[str, ...],
+    assays_or_analyses: Tuple[str, ...],
+    output_format: str,
+    output_file: Optional[str],
+    log_queries: bool,
+):
     """
     List CIMAC IDs for a given assay or analysis for a given trial
     Same as `cidc admin list analysis`
 
     TRIAL_ID is the id of the trial to affect
     ASSAY_OR_ANALYSIS is the assay or analysis to list CIMAC IDs for
+
+    Instead, use --trial and --assay any number of times to list all of them
+    in a single table with trial_id and assay_or_analysis columns.
     """
-    core.connect(dblist)
-    dblist.list_data_cimac_ids(trial_id=trial_id, assay_or_analysis=assay_or_analysis)
+    trial_ids = ((trial_id,) if trial_id else ()) + trial_ids
+    assays_or_analyses = (
+        (assay_or_analysis,) if assay_or_analysis else ()
+    ) + assays_or_analyses
+    if not trial_ids or not assays_or_analyses:
+        raise click.UsageError(
+            "Give TRIAL_ID ASSAY_OR_ANALYSIS, or at least one each of --trial and --assay"
+        )
+
+    core.connect(dblist, read_only=True, log_queries=log_queries)
+    if (
+        trial_id
+        and assay_or_analysis not in (None, "all")
+        and len(trial_ids) == 1
+        and len(assays_or_analyses) == 1
+    ):
+        # the original single-table listing, without the trial / assay columns
+        dblist.list_data_cimac_ids(
+            trial_id=trial_id,
+            assay_or_analysis=assay_or_analysis,
+            output_format=output_format,
+            output_file=output_file,
+        )
+    else:
+        dblist.list_bulk_cimac_ids(
+            trial_ids=trial_ids,
+            assays_or_analyses=assays_or_analyses,
+            output_format=output_format,
+            output_file=output_file,
+        )
 
 
 #### $ cidc admin list clinical ####
 @click.command("clinical")
 @click.argument("trial_id", required=True, type=str)
-def list_clinical(trial_id: str):
+@_output_options
+def list_clinical(
+    trial_id: str, output_format: str, output_file: Optional[str], log_queries: bool
+):
     """
     List clinical files for a given trial
 
     TRIAL_ID is the id of the trial to affect
     """
-    core.connect(dblist)
-    dblist.list_clinical(trial_id=trial_id)
+    core.connect(dblist, read_only=True, log_queries=log_queries)
+    dblist.list_clinical(
+        trial_id=trial_id, output_format=output_format, output_file=output_file
+    )
 
 
 #### $ cidc admin list misc-data ####
 @click.command("misc-data")
 @click.argument("trial_id", required=True, type=str)
-def list_misc_data(trial_id: str):
+@_output_options
+def list_misc_data(
+    trial_id: str, output_format: str, output_file: Optional[str], log_queries: bool
+):
     """
     List files from misc_data uploads for a given trial
 
     TRIAL_ID is the id of the trial to affect
     """
-    core.connect(dblist)
-    dblist.list_misc_data(trial_id=trial_id)
+    core.connect(dblist, read_only=True, log_queries=log_queries)
+    dblist.list_misc_data(
+        trial_id=trial_id, output_format=output_format, output_file=output_file
+    )
 
 
 #### $ cidc admin list shipments ####
 @click.command("shipments")
 @click.argument("trial_id", required=True, type=str)
-def list_shipments(trial_id: str):
+@_output_options
+def list_shipments(
+    trial_id: str, output_format: str, output_file: Optional[str], log_queries: bool
+):
     """
     List shipments for a given trial
 
     TRIAL_ID is the id of the trial to affect
     """
-    core.connect(dblist)
-    dblist.list_shipments(trial_id=trial_id)
+    core.connect(dblist, read_only=True, log_queries=log_queries)
+    dblist.list_shipments(
+        trial_id=trial_id, output_format=output_format, output_file=output_file
+    )
 
 
 #### $ cidc admin remove ####
@@ -99,10 +243,27 @@ def remove_():
 
 #### $ cidc admin remove assay ####
 @click.command("assay")
-@click.argument("trial_id", required=True, type=str)
-@click.argument("assay_or_analysis", required=True, type=str)
-@click.argument("target_id", required=True, nargs=-1)
-def remove_assay(trial_id: str, assay_or_analysis: str, target_id: Tuple[str]):
+@click.argument("trial_id", required=False, type=str)
+@click.argument("assay_or_analysis", required=False, type=str)
+@click.argument("target_id", required=False, nargs=-1)
+@click.option(
+    "--from-file",
+    "from_file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="Tab-separated file of `TRIAL_ID ASSAY_OR_ANALYSIS TARGET_ID...` lines to remove.",
+)
+@_delete_objects_option
+@_phase_options
+def remove_assay(
+    trial_id: Optional[str],
+    assay_or_analysis: Optional[str],
+    target_id: Tuple[str],
+    from_file: Optional[str],
+    dry_run: bool,
+    two_phase: bool,
+    delete_objects: bool,
+):
     """
     Remove a given clinical data file from a given trial's metadata
     as well as remove the associated files themselves from the portal.
@@ -114,10 +275,45 @@ def remove_assay(trial_id: str, assay_or_analysis: str, target_id: Tuple[str]):
         eg if ASSAY_OR_ANALYSIS == "elisa", only `assay_run_id` is accepted
         eg if ASSAY_OR_ANALYSIS == "wes_analysis", only `run_id` is accepted
         eg if ASSAY_OR_ANALYSIS == "olink", `batch_id [file]` is assumed
+
+    Instead, use --from-file with one of the above per line, separated by tabs,
+    to make all removals for each trial in a single update.
+
+    Use --dry-run to print the changes, files, and size reduction without making them,
+    or --two-phase to hold the trial's lock only while applying the planned changes.
+    Use --delete-objects to also delete the removed files from GCS afterwards.
     """
+    _check_phase_options(dry_run, two_phase)
+
+    if from_file:
+        if trial_id:
+            raise click.UsageError("Give either --from-file or TRIAL_ID, not both")
+        targets = remove.read_removal_targets(from_file)
+        if targets is None:
+            return
+
+        core.connect(remove)
+        remove.remove_data_batch(
+            targets,
+            dry_run=dry_run,
+            two_phase=two_phase,
+            delete_objects=delete_objects,
+        )
+        return
+
+    if not trial_id or not assay_or_analysis or not target_id:
+        raise click.UsageError(
+            "Give TRIAL_ID ASSAY_OR_ANALYSIS TARGET_ID..., or --from-file"
+        )
+
     core.connect(remove)
     remove.remove_data(
-        trial_id=trial_id, assay_or_analysis=assay_or_analysis, target_id=target_id
+        trial_id=trial_id,
+        assay_or_analysis=assay_or_analysis,
+        target_id=target_id,
+        dry_run=dry_run,
+        two_phase=two_phase,
+        delete_objects=delete_objects,
     )
 
 
@@ -125,7 +321,15 @@ def remove_assay(trial_id: str, assay_or_analysis: str, target_id: Tuple[str]):
 @click.command("clinical")
 @click.argument("trial_id", required=True, type=str)
 @click.argument("target_id", required=True, type=str)
-def remove_clinical(trial_id: str, target_id: str):
+@_delete_objects_option
+@_phase_options
+def remove_clinical(
+    trial_id: str,
+    target_id: str,
+    dry_run: bool,
+    two_phase: bool,
+    delete_objects: bool,
+):
     """
     Remove a given clinical data file from a given trial's metadata
     as well as remove the file itself from the portal.
@@ -134,24 +338,52 @@ def remove_clinical(trial_id: str, target_id: str):
     TARGET_ID is the object_url of the clinical data to remove
         not including {trial_id}/clinical/
         special value * for all files for this trial
+
+    Use --dry-run to print the changes, files, and size reduction without making them,
+    or --two-phase to hold the trial's lock only while applying the planned changes.
+    Use --delete-objects to also delete the removed files from GCS afterwards.
     """
+    _check_phase_options(dry_run, two_phase)
     core.connect(remove)
-    remove.remove_clinical(trial_id=trial_id, target_id=target_id)
+    remove.remove_clinical(
+        trial_id=trial_id,
+        target_id=target_id,
+        dry_run=dry_run,
+        two_phase=two_phase,
+        delete_objects=delete_objects,
+    )
 
 
 #### $ cidc admin remove shipment ####
 @click.command("shipment")
 @click.argument("trial_id", required=True, type=str)
 @click.argument("target_id", required=True, type=str)
-def remove_shipment(trial_id: str, target_id: str):
+@_phase_options
+def remove_shipment(trial_id: str, target_id: str, dry_run: bool, two_phase: bool):
     """
     Remove a given shipment from a given trial's metadata
 
     TRIAL_ID is the id of the trial to affect
     TARGET_ID is the manifest_id of the shipment to remove
+
+    Use --dry-run to print the changes and size reduction without making them,
+    or --two-phase to hold the trial's lock only while applying the planned changes.
     """
+    _check_phase_options(dry_run, two_phase)
     core.connect(remove)
-    remove.remove_shipment(trial_id=trial_id, target_id=target_id)
+    remove.remove_shipment(
+        trial_id=trial_id, target_id=target_id, dry_run=dry_run, two_phase=two_phase
+    )
+
+
+#### $ cidc admin remove pending-objects ####
+@click.command("pending-objects")
+def remove_pending_objects():
+    """
+    Finish deleting files from GCS that a previous --delete-objects
+    was interrupted before deleting or failed to delete.
+    """
+    gcs.resume_deletions()
 
 
 list_.add_command(list_assay)
@@ -161,4 +393,5 @@ list_.add_command(list_shipments)
 list_.add_command(list_supported)
 remove_.add_command(remove_assay)
 remove_.add_command(remove_clinical)
+remove_.add_command(remove_pending_objects)
 remove_.add_command(remove_shipment)
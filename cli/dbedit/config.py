@@ -10,3 +10,14 @@ def set_username(value: str) -> None:
 
 def get_username() -> Optional[str]:
     return cache.get(_USERNAME_KEY)
+
+
+_REPLICA_KEY = "replica"
+
+
+def set_replica(env: str, value: str) -> None:
+    cache.store(f"{_REPLICA_KEY}_{env}", value)
+
+
+def get_replica(env: str) -> Optional[str]:
+    return cache.get(f"{_REPLICA_KEY}_{env}")
@@ -1,11 +1,16 @@
+import gc
 import getpass
+import json
+import sys
+import time
 from types import ModuleType
-from typing import List, Optional
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
 import warnings
-from .config import get_username, set_username
+from .config import get_replica, get_username, set_username
 
 from google.cloud.sql.connector import Connector
 import sqlalchemy
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker
 
@@ -17,8 +22,74 @@ global DownloadableFiles, TrialMetadata, UploadJobs, Users
 Session = None
 DownloadableFiles, TrialMetadata, UploadJobs, Users = None, None, None, None
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
-def connect(list_mod: ModuleType) -> None:
+
+def json_loads_exact(text: Any) -> Any:
+    """
+    Parses JSON text or bytes with the standard library, pausing garbage collection
+    Building the millions of objects in a large metadata_json otherwise triggers
+    repeated collections that take most of the time, and they can't be garbage anyway
+    """
+    if not gc.isenabled():
+        return json.loads(text)
+
+    gc.disable()
+    try:
+        return json.loads(text)
+    finally:
+        gc.enable()
+
+
+def json_loads(text: Any) -> Any:
+    """
+    Parses JSON text or bytes for reading, with orjson if it is installed as it is
+    faster still, pausing garbage collection as for `json_loads_exact`
+    Not for anything written back: orjson parses integers beyond 64 bits as floats
+    """
+    if orjson is None:
+        return json_loads_exact(text)
+    if not gc.isenabled():
+        return orjson.loads(text)
+
+    gc.disable()
+    try:
+        return orjson.loads(text)
+    finally:
+        gc.enable()
+
+
+# the most keys to match in a single statement of `bulk_delete` / `bulk_count`
+# each chunk is sent as a single array parameter, so this only bounds statement size
+BULK_KEYS_PER_STATEMENT = 5_000
+
+
+def get_db_env() -> str:
+    """The database environment for ENV: `prod` if specified, otherwise staging"""
+    ENV: str = get_env()
+    return ENV if ENV in ["prod", "staging"] else "staging"
+
+
+def _set_read_only(conn: Any) -> None:
+    conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, many):
+    elapsed: float = time.perf_counter() - conn.info["query_start"].pop()
+    query: str = " ".join(statement.split())
+    print(f"{elapsed * 1000:.1f} ms: {query[:120]}", file=sys.stderr)
+
+
+def connect(
+    list_mod: ModuleType, read_only: bool = False, log_queries: bool = False
+) -> None:
     """
     Set up this module to be able to make sqlalchemy calls
     uses ENV as set by $ cidc config set-env
@@ -26,6 +97,17 @@ def connect(list_mod: ModuleType) -> None:
 
     If not already loaded, will ask for your database username
     Asks for database password every time as to not store it
+
+    Parameters
+    ----------
+    list_mod: ModuleType
+        the module to wire up with Session and the table classes
+    read_only: bool = False
+        connect to the read replica for ENV if one is set by $ cidc admin set-replica,
+        otherwise to the primary, and make every transaction READ ONLY
+        also decodes json with `json_loads`
+    log_queries: bool = False
+        print how long each query takes to stderr
     """
     ENV: str = get_env()
     if ENV not in ["prod", "staging"]:
@@ -44,6 +126,10 @@ def connect(list_mod: ModuleType) -> None:
         else "cidc-dfci-staging:us-central1:cidc-postgresql-staging"
     )
 
+    replica: Optional[str] = get_replica(ENV) if read_only else None
+    if replica:
+        connection_name = replica
+
     # initialize Connector object
     connector = Connector()
 
@@ -58,8 +144,36 @@ def connect(list_mod: ModuleType) -> None:
         )
         return conn
 
+    # json_deserializer is registered with pg8000 to decode json / jsonb columns
+    # the faster one is only for reading, so that anything written back is exact
+    engine = sqlalchemy.create_engine(
+        "postgresql+pg8000://",
+        creator=getconn,
+        json_deserializer=json_loads if read_only else json_loads_exact,
+    )
+    if read_only:
+        sqlalchemy.event.listen(engine, "begin", _set_read_only)
+    if log_queries:
+        sqlalchemy.event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        sqlalchemy.event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    use_engine(engine, list_mod)
+
+
+def use_engine(engine: Any, list_mod: ModuleType) -> None:
+    """
+    Set up this module and `list_mod` to make sqlalchemy calls with `engine`
+    `connect` does this for the Cloud SQL database; this is also for local databases
+    with the same tables, eg for benchmarks
+
+    Parameters
+    ----------
+    engine: Any
+        the sqlalchemy engine to use
+    list_mod: ModuleType
+        the module to wire up with Session and the table classes
+    """
     Base = automap_base()
-    engine = sqlalchemy.create_engine("postgresql+pg8000://", creator=getconn)
 
     global Session
     Session = sessionmaker(engine)
@@ -84,7 +198,11 @@ def connect(list_mod: ModuleType) -> None:
     UploadJobs = Base.classes.upload_jobs
     Users = Base.classes.users
 
-    # wire up the passed module
+    wire(list_mod)
+
+
+def wire(list_mod: ModuleType) -> None:
+    """Give `list_mod` this module's Session and table classes, once set up"""
     # this is a hack to not pass them around
     list_mod.Session = Session
     list_mod.DownloadableFiles = DownloadableFiles
@@ -165,6 +283,80 @@ def get_shipments(trial_id: str, *, session: Session) -> List[UploadJobs]:
     return shipments
 
 
+def get_trials_as_text(
+    trial_ids: List[str], *, session: Session
+) -> List[Tuple[str, str]]:
+    """
+    Get the trial_id and metadata_json of each of the given trials in a single query
+    metadata_json is returned as its JSON text so it can be parsed elsewhere
+    Trials that do not exist are not returned
+
+    Parameters
+    ----------
+    trial_ids: List[str]
+        the ids of the trials to get
+    session: Session
+        a session created from this module's `Session` after `connect()` is called
+    """
+    return (
+        session.query(
+            TrialMetadata.trial_id,
+            sqlalchemy.cast(TrialMetadata.metadata_json, sqlalchemy.Text),
+        )
+        .filter(TrialMetadata.trial_id.in_(trial_ids))
+        .all()
+    )
+
+
+def get_trial_version(
+    trial_id: str, *, with_for_update: bool = False, session: Session
+) -> Optional[Tuple[Any, Any]]:
+    """
+    Get the `_etag` and `_updated` of the trial, or None if it doesn't exist
+    Only fetches those columns, so with_for_update locks the row without reading its metadata_json
+
+    Parameters
+    ----------
+    trial_id: str
+        the id of the trial to get
+    with_for_update: bool = False
+        whether to lock the row until the end of the transaction
+    session: Session
+        a session created from this module's `Session` after `connect()` is called
+    """
+    query = session.query(TrialMetadata._etag, TrialMetadata._updated).filter(
+        TrialMetadata.trial_id == trial_id
+    )
+    if with_for_update:
+        query = query.with_for_update()
+    row = query.first()
+    return tuple(row) if row is not None else None
+
+
+def get_trial_versions(
+    trial_ids: List[str], *, session: Session
+) -> List[Tuple[str, Any, Any]]:
+    """
+    Get the trial_id, `_etag`, and `_updated` of each of the given trials in a single query
+    Trials that do not exist are not returned
+
+    Parameters
+    ----------
+    trial_ids: List[str]
+        the ids of the trials to get
+    session: Session
+        a session created from this module's `Session` after `connect()` is called
+    """
+    return [
+        tuple(row)
+        for row in session.query(
+            TrialMetadata.trial_id, TrialMetadata._etag, TrialMetadata._updated
+        )
+        .filter(TrialMetadata.trial_id.in_(trial_ids))
+        .all()
+    ]
+
+
 def get_trial_if_exists(
     trial_id: str, *, with_for_update: bool = False, session: Session
 ) -> TrialMetadata:
@@ -189,3 +381,83 @@ def get_trial_if_exists(
         exit()
 
     return trial
+
+
+def _key_chunks(keys: Sequence[Any], chunk_size: int) -> Iterator[List[Any]]:
+    """Unique keys in order, in lists of at most `chunk_size`"""
+    unique: List[Any] = list(dict.fromkeys(keys))
+    for start in range(0, len(unique), chunk_size):
+        yield unique[start : start + chunk_size]
+
+
+def _matches_any(column: Any, keys: List[Any]) -> Any:
+    """`column = ANY(:keys)`, with all of the keys bound as a single array parameter"""
+    return column == sqlalchemy.any_(sqlalchemy.literal(keys, ARRAY(column.type)))
+
+
+def bulk_count(
+    column: Any,
+    keys: Sequence[Any],
+    *,
+    chunk_size: int = BULK_KEYS_PER_STATEMENT,
+    session: Session,
+) -> int:
+    """
+    Count the rows whose `column` is any of `keys`, in chunks as for `bulk_delete`
+
+    Parameters
+    ----------
+    column: Any
+        the column of the table to count in, eg DownloadableFiles.object_url
+    keys: Sequence[Any]
+        the values of `column` to count
+    chunk_size: int = BULK_KEYS_PER_STATEMENT
+        the most keys to match in a single statement
+    session: Session
+        a session created from this module's `Session` after `connect()` is called
+    """
+    return sum(
+        session.query(column.class_).filter(_matches_any(column, chunk)).count()
+        for chunk in _key_chunks(keys, chunk_size)
+    )
+
+
+def bulk_delete(
+    column: Any,
+    keys: Sequence[Any],
+    *,
+    chunk_size: int = BULK_KEYS_PER_STATEMENT,
+    session: Session,
+) -> int:
+    """
+    Delete the rows whose `column` is any of `keys`, returning how many were deleted
+    Keys are deduplicated and matched with `= ANY(array)` in chunks of `chunk_size`,
+    so no statement has more than one parameter however many keys there are
+    Prints progress if it takes more than one chunk
+
+    Parameters
+    ----------
+    column: Any
+        the column of the table to delete from, eg DownloadableFiles.object_url
+    keys: Sequence[Any]
+        the values of `column` to delete
+    chunk_size: int = BULK_KEYS_PER_STATEMENT
+        the most keys to match in a single statement
+    session: Session
+        a session created from this module's `Session` after `connect()` is called
+    """
+    chunks: List[List[Any]] = list(_key_chunks(keys, chunk_size))
+    num_keys: int = sum(len(chunk) for chunk in chunks)
+    num_deleted: int = 0
+    for n, chunk in enumerate(chunks):
+        num_deleted += (
+            session.query(column.class_)
+            .filter(_matches_any(column, chunk))
+            .delete(synchronize_session=False)
+        )
+        if len(chunks) > 1:
+            print(
+                f"Deleted {num_deleted} {column.class_.__table__.name} rows",
+                f"matching {n * chunk_size + len(chunk)} of {num_keys} keys",
+            )
+    return num_deleted
@@ -0,0 +1,252 @@
+"""
+Deleting the GCS objects behind removed downloadable_files
+
+Objects are deleted through the JSON API's batch endpoint, up to `BATCH_SIZE` per
+request with `MAX_WORKERS` requests in flight, retrying throttled / failed calls.
+Every object is written to a journal under CIDC_WORKING_DIR before it is deleted
+and again once it is, so an interrupted run can be finished with `resume_deletions`.
+
+Uses Application Default Credentials, as for the database connection.
+If STORAGE_EMULATOR_HOST is set, requests go there without credentials instead.
+"""
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+import requests
+
+from ..config import CIDC_WORKING_DIR, get_env
+
+# the most calls the JSON API accepts in a single batch request
+BATCH_SIZE = 100
+# how many batch requests to have in flight at once
+MAX_WORKERS = 8
+# how many times to try each deletion, waiting RETRY_BACKOFF * 2 ** attempt between
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 1.0
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+GCS_HOST = "https://storage.googleapis.com"
+SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+_local = threading.local()
+_credentials_lock = threading.Lock()
+_credentials = None
+
+
+def get_data_bucket() -> str:
+    """The bucket that downloadable_files object_urls are in for the current ENV"""
+    return "cidc-data-prod" if get_env() == "prod" else "cidc-data-staging"
+
+
+def _host() -> str:
+    return os.environ.get("STORAGE_EMULATOR_HOST", GCS_HOST).rstrip("/")
+
+
+def _session() -> requests.Session:
+    """A session for this thread, authorized unless using an emulator"""
+    if getattr(_local, "session", None) is None:
+        if "STORAGE_EMULATOR_HOST" in os.environ:
+            _local.session = requests.Session()
+        else:
+            import google.auth
+            from google.auth.transport.requests import AuthorizedSession
+
+            global _credentials
+            with _credentials_lock:
+                if _credentials is None:
+                    _credentials, _ = google.auth.default(scopes=SCOPES)
+            _local.session = AuthorizedSession(_credentials)
+    return _local.session
+
+
+def _journal_path(bucket: str) -> str:
+    return os.path.join(CIDC_WORKING_DIR, f"gcs_deletions_{bucket}.jsonl")
+
+
+def pending_deletions(bucket: Optional[str] = None) -> List[str]:
+    """
+    The objects journaled for deletion from `bucket` that aren't yet deleted, in order
+
+    Parameters
+    ----------
+    bucket: Optional[str] = None
+        the bucket to check, defaults to `get_data_bucket()`
+    """
+    path: str = _journal_path(bucket or get_data_bucket())
+    if not os.path.exists(path):
+        return []
+
+    pending: Dict[str, None] = dict()
+    with open(path) as journal:
+        for line in journal:
+            try:
+                entry: dict = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by an interruption
+                continue
+            if "delete" in entry:
+                pending[entry["delete"]] = None
+            elif "done" in entry:
+                pending.pop(entry["done"], None)
+    return list(pending)
+
+
+def _batch_body(bucket: str, names: List[str], boundary: str) -> str:
+    parts: List[str] = [
+        "\r\n".join(
+            [
+                f"--{boundary}",
+                "Content-Type: application/http",
+                f"Content-ID: <item-{n}>",
+                "",
+                f"DELETE /storage/v1/b/{bucket}/o/{quote(name, safe='')} HTTP/1.1",
+                "",
+                "",
+            ]
+        )
+        for n, name in enumerate(names)
+    ]
+    return "".join(parts) + f"--{boundary}--\r\n"
+
+
+_CONTENT_ID = re.compile(r"Content-ID:\s*<response-item-(\d+)>", re.IGNORECASE)
+_STATUS = re.compile(r"^HTTP/1\.1 (\d{3})", re.MULTILINE)
+
+
+def _parse_batch_response(response: requests.Response) -> Dict[int, int]:
+    """The status of each call in a batch response, by its index in the request"""
+    match = re.search(
+        r"boundary=\"?([^\";]+)", response.headers.get("Content-Type", "")
+    )
+    if match is None:
+        return dict()
+
+    statuses: Dict[int, int] = dict()
+    for part in response.text.split(f"--{match.group(1)}"):
+        content_id, status = _CONTENT_ID.search(part), _STATUS.search(part)
+        if content_id and status:
+            statuses[int(content_id.group(1))] = int(status.group(1))
+    return statuses
+
+
+def _delete_batch(bucket: str, names: List[str]) -> Dict[str, int]:
+    """
+    Deletes up to BATCH_SIZE objects in a single batch request, retrying throttled
+    or failed calls; returns the final status of each, 0 if no response
+    """
+    statuses: Dict[str, int] = {name: 0 for name in names}
+    remaining: List[str] = list(names)
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+        boundary: str = f"cidc_cli_batch_{attempt}"
+        try:
+            response: requests.Response = _session().post(
+                f"{_host()}/batch/storage/v1",
+                data=_batch_body(bucket, remaining, boundary),
+                headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+            )
+        except requests.RequestException:
+            continue
+
+        if response.status_code in RETRY_STATUSES:
+            continue
+        for n, status in _parse_batch_response(response).items():
+            if n < len(remaining):
+                statuses[remaining[n]] = status
+
+        remaining = [
+            name
+            for name in remaining
+            if statuses[name] == 0 or statuses[name] in RETRY_STATUSES
+        ]
+        if not remaining:
+            break
+
+    return statuses
+
+
+def delete_objects(
+    object_names: Iterable[str],
+    bucket: Optional[str] = None,
+    *,
+    max_workers: int = MAX_WORKERS,
+) -> List[str]:
+    """
+    Deletes the objects from GCS in parallel batches, returning those that could not be
+    Objects that are already gone count as deleted
+    Those that fail are left in the journal, see `resume_deletions`
+
+    Parameters
+    ----------
+    object_names: Iterable[str]
+        the names of the objects within the bucket, ie downloadable_files object_urls
+    bucket: Optional[str] = None
+        the bucket to delete from, defaults to `get_data_bucket()`
+    max_workers: int = MAX_WORKERS
+        how many batch requests to have in flight at once
+    """
+    bucket = bucket or get_data_bucket()
+    names: List[str] = list(dict.fromkeys(object_names))
+    if not names:
+        return []
+
+    os.makedirs(CIDC_WORKING_DIR, exist_ok=True)
+    failed: List[str] = []
+    num_deleted: int = 0
+    with open(_journal_path(bucket), "a") as journal:
+        # journal everything before starting, so an interruption can be resumed
+        journal.writelines(json.dumps({"delete": name}) + "\n" for name in names)
+        journal.flush()
+        os.fsync(journal.fileno())
+
+        batches = [
+            names[start : start + BATCH_SIZE]
+            for start in range(0, len(names), BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_delete_batch, bucket, b) for b in batches]
+            for future in as_completed(futures):
+                for name, status in future.result().items():
+                    if status in (200, 204, 404):
+                        journal.write(json.dumps({"done": name}) + "\n")
+                        num_deleted += 1
+                    else:
+                        failed.append(name)
+                journal.flush()
+                print(f"Deleted {num_deleted} of {len(names)} objects from {bucket}")
+
+    if not pending_deletions(bucket):
+        os.remove(_journal_path(bucket))
+    if failed:
+        print(
+            f"{len(failed)} objects could not be deleted from {bucket},",
+            "retry with $ cidc admin remove pending-objects",
+        )
+    return failed
+
+
+def resume_deletions(bucket: Optional[str] = None) -> List[str]:
+    """
+    Deletes any objects left in the journal by an interrupted or failed `delete_objects`
+    Returns those that still could not be deleted
+
+    Parameters
+    ----------
+    bucket: Optional[str] = None
+        the bucket to delete from, defaults to `get_data_bucket()`
+    """
+    bucket = bucket or get_data_bucket()
+    pending: List[str] = pending_deletions(bucket)
+    if not pending:
+        print(f"No pending deletions from {bucket}")
+        return []
+
+    return delete_objects(pending, bucket)
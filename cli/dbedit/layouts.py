@@ -0,0 +1,260 @@
+"""
+Registry of where each assay / analysis lives in a trial's metadata_json
+
+Both `cidc admin list` and `cidc admin remove` look up an assay's layout here
+instead of hand-coding its JSON paths, so new assays only need to be added once.
+"""
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+# copied from cidc_schemas.prism.constants
+# Windows doesn't handle current jsonschemas RefResolver configuration
+SUPPORTED_ANALYSES: List[str] = [
+    "atacseq_analysis",
+    "cytof_analysis",
+    "rna_level1_analysis",
+    "tcr_analysis",
+    "wes_analysis",
+    "wes_tumor_only_analysis",
+]
+SUPPORTED_ASSAYS: List[str] = [
+    "atacseq_fastq",
+    "wes_fastq",
+    "wes_bam",
+    "olink",
+    "cytof",
+    "ihc",
+    "elisa",
+    "rna_fastq",
+    "rna_bam",
+    "mif",
+    "tcr_adaptive",
+    "tcr_fastq",
+    "hande",
+    "nanostring",
+    "clinical_data",
+    "misc_data",
+    "ctdna",
+    "microbiome",
+    "mibi",
+]
+
+SUPPORTED_ASSAYS_AND_ANALYSES: Set[str] = {
+    # everything once, without file type specifiers
+    a.split("_fastq")[0].split("_bam")[0].split("_adaptive")[0]
+    for a in SUPPORTED_ASSAYS + SUPPORTED_ANALYSES
+} | {"wes_analysis_old", "wes_tumor_only_analysis_old"}
+
+
+Path = Tuple[str, ...]
+
+
+def _compile_getter(path: Path) -> Callable[[Any], Any]:
+    """
+    Compile a path of keys into a function returning the value at that path,
+    or None if any part of it is missing
+    """
+    if not path:
+        return lambda node: None
+    if len(path) == 1:
+        (key,) = path
+        return lambda node: node.get(key)
+
+    def get(node: Any) -> Any:
+        for key in path:
+            node = node.get(key)
+            if node is None:
+                return None
+        return node
+
+    return get
+
+
+class AssayLayout(NamedTuple):
+    """
+    The hierarchy of an assay / analysis within metadata_json
+
+    Its data is at `metadata_json[section][key]` for each of `keys`, optionally
+    nested under `batches_key`, giving a list of batches. Each batch is found by
+    the value at `batch_id`, and if `positional` also by its index in that list.
+    Each batch may have a list of records under `record_key`, each found by the
+    value at `record_id`. `kind` selects the list / remove implementation.
+    """
+
+    name: str
+    kind: str
+    section: str
+    keys: Tuple[str, ...]
+    batches_key: Optional[str]
+    batch_id: Path
+    positional: bool
+    record_key: Optional[str]
+    record_id: Path
+    columns: Tuple[str, ...]
+    target_ids: Tuple[str, ...]
+
+    # compiled from the above by `_layout`
+    batch_lists: Tuple[Callable[[dict], Optional[list]], ...]
+    get_batch_id: Callable[[dict], Any]
+    get_record_id: Callable[[dict], Any]
+
+    @property
+    def usage(self) -> str:
+        """The accepted TARGET_IDs, eg `batch_id [cimac_id]`"""
+        required, *optional = self.target_ids
+        return " ".join([required] + [f"[{o}]" for o in optional])
+
+    @property
+    def paths(self) -> Tuple[Path, ...]:
+        """The paths of everything that removing from this assay / analysis can change"""
+        return tuple((self.section, key) for key in self.keys)
+
+    def batches(self, metadata_json: dict) -> list:
+        """The list of batches under the first of `keys`, empty if missing"""
+        return self.batch_lists[0](metadata_json) or []
+
+    def iter_batch_lists(self, metadata_json: dict) -> Iterator[Tuple[str, list]]:
+        """Each of `keys` that exists, along with its list of batches"""
+        for key, get_batches in zip(self.keys, self.batch_lists):
+            batches: Optional[list] = get_batches(metadata_json)
+            if batches is not None:
+                yield key, batches
+
+    def pop_root(self, metadata_json: dict, key: Optional[str] = None) -> Any:
+        """Remove the whole assay / analysis, ie the now-empty hanging structure"""
+        return metadata_json[self.section].pop(key or self.keys[0])
+
+
+def _layout(
+    name: str,
+    kind: str,
+    *,
+    section: Optional[str] = None,
+    keys: Tuple[str, ...] = None,
+    batches_key: Optional[str] = None,
+    batch_id: Path = ("batch_id",),
+    positional: bool = False,
+    record_key: Optional[str] = "records",
+    record_id: Path = ("cimac_id",),
+    columns: Tuple[str, ...] = ("batch_id", "cimac_id"),
+    target_ids: Tuple[str, ...] = ("batch_id", "cimac_id"),
+) -> AssayLayout:
+    section = section or ("analysis" if "analysis" in name else "assays")
+    keys = keys or (name,)
+    return AssayLayout(
+        name=name,
+        kind=kind,
+        section=section,
+        keys=keys,
+        batches_key=batches_key,
+        batch_id=batch_id,
+        positional=positional,
+        record_key=record_key,
+        record_id=record_id,
+        columns=columns,
+        target_ids=target_ids,
+        batch_lists=tuple(
+            _compile_getter(
+                (section, key, batches_key) if batches_key else (section, key)
+            )
+            for key in keys
+        ),
+        get_batch_id=_compile_getter(batch_id),
+        get_record_id=_compile_getter(record_id),
+    )
+
+
+_SPECIAL_LAYOUTS: List[AssayLayout] = [
+    _layout("clinical_data", "clinical_data", section="clinical_data"),
+    _layout(
+        "misc_data",
+        "misc_data",
+        batch_id=(),
+        positional=True,
+        record_key="files",
+        record_id=("file", "object_url"),
+        columns=("batch_id", "object_url", "filename", "created", "description"),
+        target_ids=("batch_id", "filename"),
+    ),
+    _layout(
+        "olink",
+        "olink",
+        batches_key="batches",
+        record_id=("files", "assay_npx", "object_url"),
+        columns=("batch_id", "file", "cimac_id"),
+        target_ids=("batch_id", "file"),
+    ),
+    _layout(
+        "elisa",
+        "elisa",
+        batch_id=("assay_run_id",),
+        record_key=None,
+        record_id=(),
+        columns=("assay_run_id", "cimac_id"),
+        target_ids=("assay_run_id",),
+    ),
+    _layout(
+        "nanostring",
+        "nanostring",
+        record_key="runs",
+        record_id=("run_id",),
+        columns=("batch_id", "run_id", "cimac_id"),
+        target_ids=("batch_id", "run_id"),
+    ),
+    _layout(
+        "rna_level1_analysis",
+        "rna_analysis",
+        keys=("rna_analysis",),
+        batches_key="level_1",
+        batch_id=("cimac_id",),
+        record_key=None,
+        record_id=(),
+        columns=("cimac_id",),
+        target_ids=("cimac_id",),
+    ),
+    _layout("cytof_analysis", "cytof_analysis", section="assays", keys=("cytof",)),
+    *[
+        _layout(
+            name,
+            "wes_analysis",
+            keys=keys,
+            batches_key="pair_runs",
+            batch_id=("run_id",),
+            record_key=None,
+            record_id=(),
+            columns=("run_id", "tumor_cimac_id", "normal_cimac_id"),
+            target_ids=("run_id",),
+        )
+        for name, keys in [
+            ("wes_analysis", ("wes_analysis", "wes_analysis_old")),
+            ("wes_analysis_old", ("wes_analysis_old",)),
+        ]
+    ],
+    *[
+        _layout(
+            name,
+            "wes_tumor_only_analysis",
+            keys=keys,
+            batches_key="runs",
+            batch_id=("tumor", "cimac_id"),
+            record_key=None,
+            record_id=(),
+            columns=("cimac_id",),
+            target_ids=("cimac_id",),
+        )
+        for name, keys in [
+            (
+                "wes_tumor_only_analysis",
+                ("wes_tumor_only_analysis", "wes_tumor_only_analysis_old"),
+            ),
+            ("wes_tumor_only_analysis_old", ("wes_tumor_only_analysis_old",)),
+        ]
+    ],
+    # batches nested under "batches" and only found by their batch_id
+    _layout("mibi", "batched", batches_key="batches"),
+    _layout("tcr_analysis", "batched", batches_key="batches"),
+]
+
+LAYOUTS: Dict[str, AssayLayout] = {layout.name: layout for layout in _SPECIAL_LAYOUTS}
+for _name in sorted(SUPPORTED_ASSAYS_AND_ANALYSES - set(LAYOUTS)):
+    # everything else is a list of batches, found by batch_id or their index
+    LAYOUTS[_name] = _layout(_name, "batched", positional=True)
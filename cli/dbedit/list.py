@@ -1,251 +1,156 @@
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from typing import Dict, List, Set
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 from .core import (
     DownloadableFiles,
     get_clinical_downloadable_files,
     get_misc_data_files,
-    get_trial_if_exists,
     get_shipments,
+    json_loads,
     Session,
     TrialMetadata,
     UploadJobs,
 )
-
-# copied from cidc_schemas.prism.constants
-# Windows doesn't handle current jsonschemas RefResolver configuration
-SUPPORTED_ANALYSES: List[str] = [
-    "atacseq_analysis",
-    "cytof_analysis",
-    "rna_level1_analysis",
-    "tcr_analysis",
-    "wes_analysis",
-    "wes_tumor_only_analysis",
-]
-SUPPORTED_ASSAYS: List[str] = [
-    "atacseq_fastq",
-    "wes_fastq",
-    "wes_bam",
-    "olink",
-    "cytof",
-    "ihc",
-    "elisa",
-    "rna_fastq",
-    "rna_bam",
-    "mif",
-    "tcr_adaptive",
-    "tcr_fastq",
-    "hande",
-    "nanostring",
-    "clinical_data",
-    "misc_data",
-    "ctdna",
-    "microbiome",
-    "mibi",
-]
-
-SUPPORTED_ASSAYS_AND_ANALYSES: Set[str] = {
-    # everything once, without file type specifiers
-    a.split("_fastq")[0].split("_bam")[0].split("_adaptive")[0]
-    for a in SUPPORTED_ASSAYS + SUPPORTED_ANALYSES
-} | {"wes_analysis_old", "wes_tumor_only_analysis_old"}
-
+from .output import write_rows
+from .snapshots import get_trial_metadata, get_trials_as_text
+from .layouts import (
+    AssayLayout,
+    LAYOUTS,
+    SUPPORTED_ANALYSES,
+    SUPPORTED_ASSAYS,
+    SUPPORTED_ASSAYS_AND_ANALYSES,
+)
 
 pd.set_option("display.max_columns", None)
 pd.set_option("display.max_colwidth", None)
 pd.set_option("display.max_rows", None)
 
 
-def _describe_olink(metadata_json: dict) -> pd.DataFrame:
-    ret = pd.DataFrame(columns=["batch_id", "file", "cimac_id"])
-    for batch in metadata_json.get("assays", {}).get("olink", {"batches": []})[
-        "batches"
-    ]:
+# each _iter_* generator yields one tuple per row, in the order of its layout's columns
+# the frame is then built once from all rows instead of appending batch by batch
+Row = Tuple[Any, ...]
+
+
+def _build_frame(rows: Iterable[Row], columns: Sequence[str]) -> pd.DataFrame:
+    """Build a single DataFrame from an iterable of row tuples in one pass"""
+    return pd.DataFrame.from_records(list(rows), columns=list(columns))
+
+
+def _iter_olink(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
+    for batch in layout.batches(metadata_json):
+        batch_id: str = layout.get_batch_id(batch)
         if "combined" not in batch:
-            for record in batch["records"]:
-                ret = ret.append(
-                    pd.DataFrame(
-                        [
-                            {
-                                "batch_id": batch["batch_id"],
-                                "file": record["files"]["assay_npx"]["object_url"],
-                                "cimac_id": sample,
-                            }
-                            for sample in record["files"]["assay_npx"]["samples"]
-                        ]
-                    )
-                )
+            for record in batch[layout.record_key]:
+                object_url: str = layout.get_record_id(record)
+                for sample in record["files"]["assay_npx"]["samples"]:
+                    yield batch_id, object_url, sample
         else:
-            ret = ret.append(
-                pd.DataFrame(
-                    [
-                        {
-                            "batch_id": batch["batch_id"],
-                            "file": "combined",
-                            "cimac_id": sample,
-                        }
-                        for sample in batch["combined"]["npx_file"]["samples"]
-                    ]
-                )
-            )
+            for sample in batch["combined"]["npx_file"]["samples"]:
+                yield batch_id, "combined", sample
 
-    return ret.reset_index(drop=True)
 
-
-def _describe_elisa(metadata_json: dict) -> pd.DataFrame:
+def _iter_elisa(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
     # elisa is special case
-    ret = pd.DataFrame(columns=["assay_run_id", "cimac_id"])
-    for batch in metadata_json.get("assays", {}).get("elisa", []):
-        ret = ret.append(
-            pd.DataFrame(
-                [
-                    {"cimac_id": sample, "assay_run_id": batch["assay_run_id"]}
-                    for sample in batch["assay_xlsx"]["samples"]
-                ]
-            )
-        )
-    return ret.reset_index(drop=True)
+    for batch in layout.batches(metadata_json):
+        assay_run_id: str = layout.get_batch_id(batch)
+        for sample in batch["assay_xlsx"]["samples"]:
+            yield assay_run_id, sample
 
 
-def _describe_nanostring(metadata_json: dict) -> pd.DataFrame:
+def _iter_nanostring(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
     # nanostring is special case
-    ret = pd.DataFrame(columns=["batch_id", "run_id", "cimac_id"])
-    for batch in metadata_json.get("assays", {}).get("nanostring", []):
-        for run in batch["runs"]:
-            ret = ret.append(
-                pd.DataFrame(
-                    [
-                        {
-                            "batch_id": batch["batch_id"],
-                            "run_id": run["run_id"],
-                            "cimac_id": sample["cimac_id"],
-                        }
-                        for sample in run["samples"]
-                    ]
-                )
-            )
-    return ret.reset_index(drop=True)
+    for batch in layout.batches(metadata_json):
+        batch_id: str = layout.get_batch_id(batch)
+        for run in batch[layout.record_key]:
+            run_id: str = layout.get_record_id(run)
+            for sample in run["samples"]:
+                yield batch_id, run_id, sample["cimac_id"]
 
 
-def _describe_rna_analysis(metadata_json: dict) -> pd.DataFrame:
-    return pd.DataFrame(
-        [
-            {"cimac_id": record["cimac_id"]}
-            for record in metadata_json.get("analysis", {}).get(
-                "rna_analysis", {"level_1": []}
-            )["level_1"]
-        ]
-    )
+def _iter_rna_analysis(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
+    for record in layout.batches(metadata_json):
+        yield (layout.get_batch_id(record),)
 
 
-def _describe_cytof_analysis(
-    metadata_json: dict,
-) -> pd.DataFrame:
-    ret = pd.DataFrame(columns=["batch_id", "cimac_id"])
-    for batch in metadata_json.get("assays", {}).get("cytof", []):
+def _iter_cytof_analysis(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
+    for batch in layout.batches(metadata_json):
         if "astrolabe_analysis" in batch:
-            ret = ret.append(
-                pd.DataFrame(
-                    [
-                        {
-                            "batch_id": batch["batch_id"],
-                            "cimac_id": record["cimac_id"],
-                        }
-                        for record in batch["records"]
-                        if "output_files" in record
-                    ]
-                )
-            )
-    return ret.reset_index(drop=True)
-
-
-def _describe_wes_analysis(metadata_json: dict, just_old: bool = False) -> pd.DataFrame:
-    ret = pd.DataFrame(columns=["run_id", "tumor_cimac_id", "normal_cimac_id"])
-
-    for subkey in ["wes_analysis", "wes_analysis_old"]:
-        if just_old and "old" not in subkey:
-            continue
-
-        ret = ret.append(
-            pd.DataFrame(
-                [
-                    {
-                        "run_id": run["run_id"],
-                        "tumor_cimac_id": run["tumor"]["cimac_id"],
-                        "normal_cimac_id": run["normal"]["cimac_id"],
-                    }
-                    for run in metadata_json.get("analysis", {}).get(
-                        subkey, {"pair_runs": []}
-                    )["pair_runs"]
-                ]
-            )
-        )
-    return ret.reset_index(drop=True)
-
-
-def _describe_wes_tumor_only_analysis(
-    metadata_json: dict, just_old: bool = False
-) -> pd.DataFrame:
-    ret = pd.DataFrame(columns=["cimac_id"])
-
-    for subkey in ["wes_tumor_only_analysis", "wes_tumor_only_analysis_old"]:
-        if just_old and "old" not in subkey:
-            continue
-
-        ret = ret.append(
-            pd.DataFrame(
-                [
-                    {"cimac_id": run["tumor"]["cimac_id"]}
-                    for run in metadata_json.get("analysis", {}).get(
-                        subkey, {"runs": []}
-                    )["runs"]
-                ]
-            )
-        )
-    return ret.reset_index(drop=True)
-
-
-def _describe_batched(metadata_json: dict, assay_or_analysis: str) -> pd.DataFrame:
-    ret = pd.DataFrame(columns=["batch_id", "cimac_id"])
-    for batch in metadata_json.get(
-        "analysis" if "analysis" in assay_or_analysis else "assays", {}
-    ).get(assay_or_analysis, {"batches": []})["batches"]:
-        ret = ret.append(
-            pd.DataFrame(
-                [
-                    {
-                        "batch_id": batch["batch_id"],
-                        "cimac_id": record["cimac_id"],
-                    }
-                    for record in batch["records"]
-                ]
-            )
-        )
-    return ret.reset_index(drop=True)
-
-
-def _describe_generic(metadata_json: dict, assay_or_analysis: str) -> pd.DataFrame:
-    ret = pd.DataFrame(columns=["batch_id", "cimac_id"])
-    for batch_num, batch in enumerate(
-        metadata_json.get(
-            "analysis" if "analysis" in assay_or_analysis else "assays", {}
-        ).get(assay_or_analysis, [])
-    ):
-        ret = ret.append(
-            pd.DataFrame(
-                [
-                    {
-                        "batch_id": batch.get("batch_id", str(batch_num)),
-                        "cimac_id": record["cimac_id"],
-                    }
-                    for record in batch["records"]
-                ]
-            )
-        )
-    return ret.reset_index(drop=True)
+            batch_id: str = layout.get_batch_id(batch)
+            for record in batch[layout.record_key]:
+                if "output_files" in record:
+                    yield batch_id, layout.get_record_id(record)
+
+
+def _iter_wes_analysis(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
+    for _, runs in layout.iter_batch_lists(metadata_json):
+        for run in runs:
+            tumor, normal = run["tumor"]["cimac_id"], run["normal"]["cimac_id"]
+            yield layout.get_batch_id(run), tumor, normal
+
+
+def _iter_wes_tumor_only_analysis(
+    metadata_json: dict, layout: AssayLayout
+) -> Iterator[Row]:
+    for _, runs in layout.iter_batch_lists(metadata_json):
+        for run in runs:
+            yield (layout.get_batch_id(run),)
+
 
+def _iter_batched(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
+    for batch_num, batch in enumerate(layout.batches(metadata_json)):
+        batch_id: Optional[str] = layout.get_batch_id(batch)
+        if batch_id is None and layout.positional:
+            batch_id = str(batch_num)
+        for record in batch[layout.record_key]:
+            yield batch_id, layout.get_record_id(record)
 
-def list_data_cimac_ids(trial_id: str, assay_or_analysis: str) -> None:
+
+_ROW_ITERATORS: Dict[str, Callable[[dict, AssayLayout], Iterator[Row]]] = {
+    "olink": _iter_olink,
+    "elisa": _iter_elisa,
+    "nanostring": _iter_nanostring,
+    "rna_analysis": _iter_rna_analysis,
+    "cytof_analysis": _iter_cytof_analysis,
+    "wes_analysis": _iter_wes_analysis,
+    "wes_tumor_only_analysis": _iter_wes_tumor_only_analysis,
+    "batched": _iter_batched,
+}
+
+
+def iter_rows(metadata_json: dict, layout: AssayLayout) -> Iterator[Row]:
+    """
+    Yields a tuple for each sample of the given assay / analysis in `metadata_json`
+    with values in the order of `layout.columns`
+    """
+    return _ROW_ITERATORS[layout.kind](metadata_json, layout)
+
+
+def describe(metadata_json: dict, assay_or_analysis: str) -> pd.DataFrame:
+    """
+    Returns a table listing all samples for the given assay/analysis in `metadata_json`
+    `assay_or_analysis` must have a layout listed in LAYOUTS
+    """
+    layout: AssayLayout = LAYOUTS[assay_or_analysis]
+    return _build_frame(iter_rows(metadata_json, layout), columns=layout.columns)
+
+
+def list_data_cimac_ids(
+    trial_id: str,
+    assay_or_analysis: str,
+    output_format: str = "table",
+    output_file: Optional[str] = None,
+) -> None:
     """
     Prints a table listing all samples for the given assay/analysis and trial
 
@@ -256,74 +161,197 @@ def list_data_cimac_ids(trial_id: str, assay_or_analysis: str) -> None:
     assay_or_analysis: str
         the name of the assay / analysis to investigate
         must be in SUPPORTED_ASSAYS_AND_ANALYSES
+    output_format: str = "table"
+        one of output.OUTPUT_FORMATS; all but "table" are streamed
+    output_file: Optional[str] = None
+        the path to write to instead of stdout
     """
-    if assay_or_analysis not in SUPPORTED_ASSAYS_AND_ANALYSES:
+    layout: Optional[AssayLayout] = LAYOUTS.get(assay_or_analysis)
+    if layout is None:
         print("Assay / analysis not supported:", assay_or_analysis)
         return
 
-    elif assay_or_analysis == "clinical_data":
-        list_clinical(trial_id)
+    elif layout.kind == "clinical_data":
+        list_clinical(trial_id, output_format=output_format, output_file=output_file)
         return
-    elif assay_or_analysis == "misc_data":
-        list_misc_data(trial_id)
+    elif layout.kind == "misc_data":
+        list_misc_data(trial_id, output_format=output_format, output_file=output_file)
         return
 
     with Session.begin() as session:
-        trial: TrialMetadata = get_trial_if_exists(trial_id, session=session)
-        cimac_ids: pd.DataFrame
-
-        if assay_or_analysis == "olink":
-            cimac_ids: pd.DataFrame = _describe_olink(metadata_json=trial.metadata_json)
-        elif assay_or_analysis == "elisa":
-            cimac_ids: pd.DataFrame = _describe_elisa(metadata_json=trial.metadata_json)
-        elif assay_or_analysis == "nanostring":
-            cimac_ids: pd.DataFrame = _describe_nanostring(
-                metadata_json=trial.metadata_json
-            )
+        metadata_json: dict = get_trial_metadata(trial_id, session=session)
+        write_rows(
+            layout.columns,
+            iter_rows(metadata_json, layout),
+            output_format=output_format,
+            output_file=output_file,
+        )
 
-        elif assay_or_analysis == "rna_level1_analysis":
-            cimac_ids: pd.DataFrame = _describe_rna_analysis(
-                metadata_json=trial.metadata_json
-            )
 
-        elif assay_or_analysis == "cytof_analysis":
-            cimac_ids: pd.DataFrame = _describe_cytof_analysis(
-                metadata_json=trial.metadata_json
-            )
+BULK_COLUMNS: Tuple[str, ...] = ("trial_id", "assay_or_analysis")
 
-        elif assay_or_analysis in ["wes_analysis", "wes_analysis_old"]:
-            cimac_ids: pd.DataFrame = _describe_wes_analysis(
-                metadata_json=trial.metadata_json,
-                just_old="old" in assay_or_analysis,
-            )
+# metadata_json of at least this many characters is parsed and listed in a worker
+# process; smaller blobs are faster to handle inline than to hand off
+PROCESS_POOL_THRESHOLD: int = 1_000_000
 
-        elif assay_or_analysis in [
-            "wes_tumor_only_analysis",
-            "wes_tumor_only_analysis_old",
-        ]:
-            cimac_ids: pd.DataFrame = _describe_wes_tumor_only_analysis(
-                metadata_json=trial.metadata_json,
-                just_old="old" in assay_or_analysis,
-            )
 
-        elif assay_or_analysis in [
-            "mibi",
-            "tcr_analysis",
-        ]:
-            cimac_ids: pd.DataFrame = _describe_batched(
-                metadata_json=trial.metadata_json, assay_or_analysis=assay_or_analysis
+def _bulk_layouts(assays_or_analyses: Sequence[str]) -> List[AssayLayout]:
+    """
+    Get the layouts to list, expanding `all` to every assay / analysis whose samples
+    are in metadata_json; clinical_data and misc_data are files, not samples, and
+    the *_old analyses are already listed under their current name
+    """
+    names: List[str] = []
+    for name in assays_or_analyses:
+        if name == "all":
+            names.extend(
+                n
+                for n, layout in sorted(LAYOUTS.items())
+                if layout.kind not in ("clinical_data", "misc_data")
+                and not n.endswith("_old")
             )
-
         else:
-            cimac_ids: pd.DataFrame = _describe_generic(
-                metadata_json=trial.metadata_json, assay_or_analysis=assay_or_analysis
+            names.append(name)
+
+    # keep the order given, without repeats
+    return [LAYOUTS[n] for n in dict.fromkeys(names)]
+
+
+def _bulk_columns(layouts: Sequence[AssayLayout]) -> Tuple[str, ...]:
+    """The union of the columns of all `layouts`, after the trial and assay columns"""
+    columns: Dict[str, None] = dict.fromkeys(BULK_COLUMNS)
+    for layout in layouts:
+        columns.update(dict.fromkeys(layout.columns))
+    return tuple(columns)
+
+
+def _iter_bulk_rows(
+    trial_id: str,
+    metadata_json: dict,
+    layouts: Sequence[AssayLayout],
+    columns: Sequence[str],
+) -> Iterator[Row]:
+    """Yields rows for all `layouts` in a single trial, spread out over `columns`"""
+    for layout in layouts:
+        positions: List[int] = [columns.index(c) for c in layout.columns]
+        for row in iter_rows(metadata_json, layout):
+            full_row: List[Any] = [None] * len(columns)
+            full_row[0], full_row[1] = trial_id, layout.name
+            for position, value in zip(positions, row):
+                full_row[position] = value
+            yield tuple(full_row)
+
+
+def _list_trial_text(
+    trial_id: str,
+    metadata_text: str,
+    assays_or_analyses: Sequence[str],
+    columns: Sequence[str],
+) -> List[Row]:
+    """Parses and lists a single trial; module-level so it can run in a worker process"""
+    layouts: List[AssayLayout] = [LAYOUTS[n] for n in assays_or_analyses]
+    return list(_iter_bulk_rows(trial_id, json_loads(metadata_text), layouts, columns))
+
+
+def _iter_bulk_trials(
+    trials: Sequence[Tuple[str, str]],
+    layouts: Sequence[AssayLayout],
+    columns: Sequence[str],
+) -> Iterator[Row]:
+    """
+    Yields the rows for each of `trials` in order, listing large blobs in parallel
+    in a process pool while the rows of earlier trials are being written
+    """
+    names: List[str] = [layout.name for layout in layouts]
+    large: List[Tuple[str, str]] = [
+        t for t in trials if len(t[1]) >= PROCESS_POOL_THRESHOLD
+    ]
+    if len(large) < 2:
+        for trial_id, metadata_text in trials:
+            yield from _list_trial_text(trial_id, metadata_text, names, columns)
+        return
+
+    with ProcessPoolExecutor(max_workers=len(large)) as executor:
+        futures = {
+            trial_id: executor.submit(
+                _list_trial_text, trial_id, metadata_text, names, columns
             )
+            for trial_id, metadata_text in large
+        }
+        for trial_id, metadata_text in trials:
+            if trial_id in futures:
+                yield from futures.pop(trial_id).result()
+            else:
+                yield from _list_trial_text(trial_id, metadata_text, names, columns)
+
+
+def list_bulk_cimac_ids(
+    trial_ids: Sequence[str],
+    assays_or_analyses: Sequence[str],
+    output_format: str = "table",
+    output_file: Optional[str] = None,
+) -> None:
+    """
+    Prints a single table listing all samples for the given assays/analyses and trials
+    All trials are fetched in one query, reusing local snapshots of unchanged ones,
+    and each trial's metadata_json is parsed once
+    The table starts with `trial_id` and `assay_or_analysis` columns, followed by
+    the union of the columns of each assay / analysis, empty where not applicable
 
-        # business print
-        print(cimac_ids)
+    Parameters
+    ----------
+    trial_ids: Sequence[str]
+        the ids of the trials to investigate
+    assays_or_analyses: Sequence[str]
+        the names of the assays / analyses to investigate
+        each must be in SUPPORTED_ASSAYS_AND_ANALYSES, or `all` for every one
+        clinical_data and misc_data are not supported, see `list_clinical` etc
+    output_format: str = "table"
+        one of output.OUTPUT_FORMATS; all but "table" are streamed
+    output_file: Optional[str] = None
+        the path to write to instead of stdout
+    """
+    for name in assays_or_analyses:
+        if name != "all" and name not in LAYOUTS:
+            print("Assay / analysis not supported:", name)
+            return
+        elif name in ("clinical_data", "misc_data"):
+            print(f"Bulk listing of {name} not supported, list each trial instead")
+            return
+
+    layouts: List[AssayLayout] = _bulk_layouts(assays_or_analyses)
+    columns: Tuple[str, ...] = _bulk_columns(layouts)
+    trial_ids = list(dict.fromkeys(trial_ids))
 
+    with Session.begin() as session:
+        found: Dict[str, str] = dict(get_trials_as_text(trial_ids, session=session))
+
+    missing: List[str] = [t for t in trial_ids if t not in found]
+    if missing:
+        for trial_id in missing:
+            print(f"Trial {trial_id} cannot be found")
+        return
+
+    write_rows(
+        columns,
+        _iter_bulk_trials([(t, found[t]) for t in trial_ids], layouts, columns),
+        output_format=output_format,
+        output_file=output_file,
+    )
+
+
+CLINICAL_COLUMNS: Tuple[str, ...] = (
+    "object_url",
+    "filename",
+    "num_participants",
+    "created",
+    "comment",
+)
 
-def list_clinical(trial_id: str) -> None:
+
+def list_clinical(
+    trial_id: str, output_format: str = "table", output_file: Optional[str] = None
+) -> None:
     """
     Prints a table describing all clinical files for the given trial
 
@@ -331,16 +359,20 @@ def list_clinical(trial_id: str) -> None:
     ----------
     trial_id: str
         the id of the trial to investigate
+    output_format: str = "table"
+        one of output.OUTPUT_FORMATS; all but "table" are streamed
+    output_file: Optional[str] = None
+        the path to write to instead of stdout
     """
     with Session.begin() as session:
-        trial: TrialMetadata = get_trial_if_exists(trial_id, session=session)
+        metadata_json: dict = get_trial_metadata(trial_id, session=session)
         clinical_files: List[DownloadableFiles] = get_clinical_downloadable_files(
             trial_id, session=session
         )
 
         number_of_participants: Dict[str, int] = dict()
         comments: Dict[str, str] = dict()
-        for record in trial.metadata_json.get("clinical_data", {}).get("records", []):
+        for record in metadata_json.get("clinical_data", {}).get("records", []):
             object_url: str = record["clinical_file"]["object_url"]
             number_of_participants[object_url] = record["clinical_file"][
                 "number_of_participants"
@@ -348,21 +380,26 @@ def list_clinical(trial_id: str) -> None:
             if "comment" in record:
                 comments[object_url] = record["comment"]
 
-        print(
-            pd.DataFrame(
-                {
-                    "object_url": f.object_url,
-                    "filename": f.object_url.split("/clinical/")[1],
-                    "num_participants": number_of_participants.get(f.object_url),
-                    "created": f._created,
-                    "comment": comments.get(f.object_url, pd.NA),
-                }
+        write_rows(
+            CLINICAL_COLUMNS,
+            (
+                (
+                    f.object_url,
+                    f.object_url.split("/clinical/")[1],
+                    number_of_participants.get(f.object_url),
+                    f._created,
+                    comments.get(f.object_url, pd.NA),
+                )
                 for f in clinical_files
-            )
+            ),
+            output_format=output_format,
+            output_file=output_file,
         )
 
 
-def list_misc_data(trial_id: str) -> None:
+def list_misc_data(
+    trial_id: str, output_format: str = "table", output_file: Optional[str] = None
+) -> None:
     """
     Prints a table describing all misc_data files for the given trial
 
@@ -370,40 +407,56 @@ def list_misc_data(trial_id: str) -> None:
     ----------
     trial_id: str
         the id of the trial to investigate
+    output_format: str = "table"
+        one of output.OUTPUT_FORMATS; all but "table" are streamed
+    output_file: Optional[str] = None
+        the path to write to instead of stdout
     """
+    layout: AssayLayout = LAYOUTS["misc_data"]
     with Session.begin() as session:
-        trial: TrialMetadata = get_trial_if_exists(trial_id, session=session)
+        metadata_json: dict = get_trial_metadata(trial_id, session=session)
         misc_data_files: List[DownloadableFiles] = get_misc_data_files(
             trial_id, session=session
         )
 
         descriptions: Dict[str, str] = dict()
         batch_numbers: Dict[str, int] = dict()
-        for batch_idx, batch in enumerate(
-            trial.metadata_json.get("assays", {}).get("misc_data", [])
-        ):
-            for file in batch["files"]:
-                object_url = file["file"]["object_url"]
+        for batch_idx, batch in enumerate(layout.batches(metadata_json)):
+            for file in batch[layout.record_key]:
+                object_url = layout.get_record_id(file)
                 batch_numbers[object_url] = batch_idx
 
                 if "description" in file:
                     descriptions[object_url] = file["description"]
 
-        print(
-            pd.DataFrame(
-                {
-                    "batch_id": batch_numbers.get(f.object_url, pd.NA),
-                    "object_url": f.object_url,
-                    "filename": f.object_url.split("/misc_data/")[1],
-                    "created": f._created,
-                    "description": descriptions.get(f.object_url, pd.NA),
-                }
+        write_rows(
+            layout.columns,
+            (
+                (
+                    batch_numbers.get(f.object_url, pd.NA),
+                    f.object_url,
+                    f.object_url.split("/misc_data/")[1],
+                    f._created,
+                    descriptions.get(f.object_url, pd.NA),
+                )
                 for f in misc_data_files
-            )
+            ),
+            output_format=output_format,
+            output_file=output_file,
         )
 
 
-def list_shipments(trial_id: str) -> None:
+SHIPMENT_COLUMNS: Tuple[str, ...] = (
+    "upload_type",
+    "manifest_id",
+    "num_samples",
+    "created",
+)
+
+
+def list_shipments(
+    trial_id: str, output_format: str = "table", output_file: Optional[str] = None
+) -> None:
     """
     Prints a table describing all shipments for the given trial
 
@@ -411,19 +464,24 @@ def list_shipments(trial_id: str) -> None:
     ----------
     trial_id: str
         the id of the trial to investigate
+    output_format: str = "table"
+        one of output.OUTPUT_FORMATS; all but "table" are streamed
+    output_file: Optional[str] = None
+        the path to write to instead of stdout
     """
     with Session.begin() as session:
         shipments: List[UploadJobs] = get_shipments(trial_id, session=session)
-        print(
-            pd.DataFrame(
-                {
-                    "upload_type": u.upload_type,
-                    "manifest_id": u.metadata_patch["shipments"][0]["manifest_id"],
-                    "num_samples": sum(
-                        len(p["samples"]) for p in u.metadata_patch["participants"]
-                    ),
-                    "created": u._created,
-                }
+        write_rows(
+            SHIPMENT_COLUMNS,
+            (
+                (
+                    u.upload_type,
+                    u.metadata_patch["shipments"][0]["manifest_id"],
+                    sum(len(p["samples"]) for p in u.metadata_patch["participants"]),
+                    u._created,
+                )
                 for u in shipments
-            )
+            ),
+            output_format=output_format,
+            output_file=output_file,
         )
@@ -0,0 +1,142 @@
+"""Writers for the tables produced by `cidc admin list`"""
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import click
+import pandas as pd
+
+OUTPUT_FORMATS: List[str] = ["table", "csv", "tsv", "jsonl", "parquet"]
+
+# number of rows held in memory per parquet row group
+PARQUET_CHUNK_SIZE: int = 10000
+
+
+def _clean(value: Any) -> Any:
+    """Convert a value to one that can be written by csv / json"""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+@contextmanager
+def _open_text(output_file: Optional[str]) -> Iterator[TextIO]:
+    if output_file is None:
+        yield sys.stdout
+    else:
+        with open(output_file, "w", newline="") as f:
+            yield f
+
+
+def _write_table(
+    columns: Sequence[str], rows: Iterable[Tuple], output_file: Optional[str]
+) -> None:
+    df = pd.DataFrame.from_records(list(rows), columns=list(columns))
+    if output_file is None:
+        # business print
+        print(df)
+    else:
+        with open(output_file, "w") as f:
+            f.write(df.to_string())
+            f.write("\n")
+
+
+def _write_delimited(
+    columns: Sequence[str],
+    rows: Iterable[Tuple],
+    output_file: Optional[str],
+    delimiter: str,
+) -> None:
+    with _open_text(output_file) as f:
+        writer = csv.writer(f, delimiter=delimiter, lineterminator="\n")
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(["" if v is None else v for v in (_clean(v) for v in row)])
+
+
+def _write_jsonl(
+    columns: Sequence[str], rows: Iterable[Tuple], output_file: Optional[str]
+) -> None:
+    with _open_text(output_file) as f:
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, (_clean(v) for v in row)))))
+            f.write("\n")
+
+
+def _write_parquet(
+    columns: Sequence[str], rows: Iterable[Tuple], output_file: Optional[str]
+) -> None:
+    if output_file is None:
+        raise click.ClickException("--output FILE is required for parquet format")
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise click.ClickException(
+            "Writing parquet requires pyarrow, install it with: pip install pyarrow"
+        )
+
+    writer, chunk = None, []
+
+    def flush():
+        nonlocal writer
+        data = {col: [_clean(row[i]) for row in chunk] for i, col in enumerate(columns)}
+        if writer is None:
+            table = pa.Table.from_pydict(data)
+            writer = pq.ParquetWriter(output_file, table.schema)
+        else:
+            table = pa.Table.from_pydict(data, schema=writer.schema)
+        writer.write_table(table)
+        chunk.clear()
+
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= PARQUET_CHUNK_SIZE:
+                flush()
+        if chunk or writer is None:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_rows(
+    columns: Sequence[str],
+    rows: Iterable[Tuple],
+    output_format: str = "table",
+    output_file: Optional[str] = None,
+) -> None:
+    """
+    Writes rows of a table as they are produced
+
+    Parameters
+    ----------
+    columns: Sequence[str]
+        the names of the columns, in the order of the values in each row
+    rows: Iterable[Tuple]
+        the rows themselves, which are only consumed once
+    output_format: str = "table"
+        one of OUTPUT_FORMATS
+        "table" is pretty-printed, so is built in memory and best for small results
+        all others are streamed row by row, or in chunks for "parquet"
+    output_file: Optional[str] = None
+        the path to write to; defaults to stdout, required for "parquet"
+    """
+    if output_format == "table":
+        _write_table(columns, rows, output_file)
+    elif output_format == "csv":
+        _write_delimited(columns, rows, output_file, delimiter=",")
+    elif output_format == "tsv":
+        _write_delimited(columns, rows, output_file, delimiter="\t")
+    elif output_format == "jsonl":
+        _write_jsonl(columns, rows, output_file)
+    elif output_format == "parquet":
+        _write_parquet(columns, rows, output_file)
+    else:
+        raise click.ClickException(f"Unsupported output format: {output_format}")
@@ -0,0 +1,208 @@
+"""
+Partial updates of a trial's metadata_json
+
+Instead of writing back a whole (possibly very large) metadata_json, the subtrees
+a change can affect are copied beforehand and diffed with the result afterwards.
+The diff is a list of operations on paths into the blob, applied server-side with
+`jsonb_set` and `#-`, so only the changed subtrees are sent to the database.
+"""
+import json
+from copy import deepcopy
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+JsonPath = Tuple[Union[str, int], ...]
+
+
+class PatchOp(NamedTuple):
+    """Set the value at `path`, or delete it if `op` is "delete" """
+
+    op: str
+    path: JsonPath
+    value: Any = None
+
+
+class _Missing:
+    """Stands in for a path that doesn't exist, as None is a valid JSON value"""
+
+    def __deepcopy__(self, memo: dict) -> "_Missing":
+        return self
+
+
+_MISSING = _Missing()
+
+
+def _get(doc: Any, path: JsonPath) -> Any:
+    for key in path:
+        try:
+            doc = doc[key]
+        except (KeyError, IndexError, TypeError):
+            return _MISSING
+    return doc
+
+
+def snapshot(doc: dict, paths: Iterable[JsonPath]) -> Dict[JsonPath, Any]:
+    """
+    Copies the values at each of `paths` in `doc` before it is changed, for `diff_paths`
+    Only the subtrees at `paths` are copied, not the whole of `doc`
+    """
+    return {path: deepcopy(_get(doc, path)) for path in dict.fromkeys(paths)}
+
+
+def diff_paths(before: Dict[JsonPath, Any], after: dict) -> List[PatchOp]:
+    """
+    Returns the operations that turn the `snapshot` of each path into its value in `after`
+    Anything in `after` outside of those paths is assumed unchanged
+    """
+    ops: List[PatchOp] = []
+    for path, old in before.items():
+        new: Any = _get(after, path)
+        if new is _MISSING:
+            if old is not _MISSING:
+                ops.append(PatchOp("delete", path))
+        elif old is _MISSING:
+            ops.append(PatchOp("set", path, new))
+        else:
+            ops.extend(diff(old, new, path))
+    return ops
+
+
+def size_change(before: Dict[JsonPath, Any], after: dict) -> int:
+    """
+    Returns how many characters of JSON the values at the paths of the `snapshot`
+    grew by in `after`, ie negative if they shrank
+    """
+    size = lambda value: 0 if value is _MISSING else len(json.dumps(value))
+    return sum(size(_get(after, path)) - size(old) for path, old in before.items())
+
+
+def diff(old: Any, new: Any, path: JsonPath = ()) -> List[PatchOp]:
+    """
+    Returns the operations that turn `old` into `new`, both found at `path`
+    Recurses into dicts and into lists that only had elements removed or changed,
+    otherwise sets the whole value
+    """
+    if old == new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: List[PatchOp] = [
+            PatchOp("delete", path + (k,)) for k in old if k not in new
+        ]
+        for key, value in new.items():
+            if key in old:
+                ops.extend(diff(old[key], value, path + (key,)))
+            else:
+                ops.append(PatchOp("set", path + (key,), value))
+        return ops
+
+    if isinstance(old, list) and isinstance(new, list):
+        ops: Optional[List[PatchOp]] = _diff_list(old, new, path)
+        if ops is not None:
+            return ops
+
+    return [PatchOp("set", path, new)]
+
+
+def _same_scalars(old: Any, new: Any) -> bool:
+    """Whether two dicts look like the same entry, ie have the same non-nested values"""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return False
+    scalars = lambda d: {k: v for k, v in d.items() if not isinstance(v, (dict, list))}
+    old_scalars: dict = scalars(old)
+    return bool(old_scalars) and old_scalars == scalars(new)
+
+
+def _diff_list(old: list, new: list, path: JsonPath) -> Optional[List[PatchOp]]:
+    """
+    Returns the operations that turn `old` into `new` if `new` is `old` with some
+    elements removed and others changed in place, otherwise None
+    Changed elements are diffed at their original index, then removed ones are
+    deleted from the end first so that every index stays valid
+    """
+    num_removed: int = len(old) - len(new)
+    if num_removed < 0:
+        return None
+
+    ops: List[PatchOp] = []
+    removed: List[int] = []
+    idx: int = 0
+    for item in new:
+        # skip as few elements as possible to find this one unchanged, or else changed
+        candidates = range(num_removed - len(removed) + 1)
+        skip: Optional[int] = next(
+            (k for k in candidates if old[idx + k] == item), None
+        )
+        if skip is None:
+            skip = next((k for k in candidates if _same_scalars(old[idx + k], item)), 0)
+
+        removed.extend(range(idx, idx + skip))
+        idx += skip
+        ops.extend(diff(old[idx], item, path + (idx,)))
+        idx += 1
+
+    removed.extend(range(idx, len(old)))
+    ops.extend(PatchOp("delete", path + (i,)) for i in reversed(removed))
+    return ops
+
+
+def apply_patch(doc: dict, ops: Iterable[PatchOp]) -> dict:
+    """
+    Applies the operations to `doc` in place, as the database does in `patch_expression`
+    Returns `doc` for convenience
+    """
+    for op in ops:
+        *parent_path, key = op.path
+        parent: Any = doc
+        for k in parent_path:
+            parent = parent[k]
+
+        if op.op == "delete":
+            del parent[key]
+        else:
+            parent[key] = deepcopy(op.value)
+
+    return doc
+
+
+def patch_expression(column: Any, ops: Iterable[PatchOp]) -> Any:
+    """
+    Returns a SQL expression applying the operations to a jsonb `column`,
+    for use as the new value in an UPDATE
+    The operations nest into a single jsonb_set / #- expression, which is built
+    as text so that compiling it doesn't recurse once per operation
+
+    Parameters
+    ----------
+    column: Any
+        the jsonb column to update, eg TrialMetadata.metadata_json
+    ops: Iterable[PatchOp]
+        the operations to apply in order, as from `diff_paths`
+    """
+    # the first operation is innermost, so its opening comes last
+    openings: List[str] = []
+    closings: List[str] = []
+    params: List[Any] = []
+    for n, op in enumerate(ops):
+        path = sqlalchemy.bindparam(
+            f"patch_path_{n}", [str(k) for k in op.path], type_=ARRAY(sqlalchemy.Text)
+        )
+        params.append(path)
+        if op.op == "delete":
+            openings.append("(")
+            closings.append(f" #- :{path.key})")
+        else:
+            value = sqlalchemy.bindparam(
+                f"patch_value_{n}", json.dumps(op.value), type_=sqlalchemy.Text
+            )
+            params.append(value)
+            openings.append("jsonb_set(")
+            closings.append(f", :{path.key}, CAST(:{value.key} AS JSONB))")
+
+    if not params:
+        return column
+    openings.reverse()
+    sql: str = "".join(openings) + column.name + "".join(closings)
+    return sqlalchemy.type_coerce(sqlalchemy.text(sql).bindparams(*params), JSONB)
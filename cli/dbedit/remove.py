@@ -1,38 +1,231 @@
+import csv
+from copy import deepcopy
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
+from . import gcs
 from .core import (
+    bulk_count,
+    bulk_delete,
     DownloadableFiles,
     get_clinical_downloadable_files,
     get_shipments,
     get_trial_if_exists,
+    get_trial_version,
     Session,
     TrialMetadata,
     UploadJobs,
 )
-from .list import SUPPORTED_ASSAYS_AND_ANALYSES
+from .layouts import AssayLayout, LAYOUTS
+from .patch import diff_paths, patch_expression, PatchOp, size_change, snapshot
+
+# the most operations to apply in a single UPDATE, each a level of the nested
+# jsonb_set / #- expression and up to two bind parameters, to keep it well within
+# the database's max_stack_depth and the driver's limit on parameters
+PATCH_OPS_PER_STATEMENT: int = 250
+
+
+def _iter_object_urls(target: Any) -> Iterator[str]:
+    """
+    Yields every object_url in `target`, in the order of a depth-first walk through
+    each of its values, descending into dicts and the dicts directly in lists
+    Uses a stack of iterators instead of recursion
+    """
+    # dict items are (key, value) tuples and list elements are dicts to descend into,
+    # or anything else to skip; JSON has no tuples of its own
+    stack: List[Iterator[Any]] = [
+        iter(target.items()) if isinstance(target, dict) else iter(target)
+    ]
+    push, pop = stack.append, stack.pop
+    while stack:
+        for entry in stack[-1]:
+            if type(entry) is tuple:
+                key, value = entry
+                if key == "object_url":
+                    yield value
+                if type(value) is dict:
+                    push(iter(value.items()))
+                    break
+                if type(value) is list:
+                    push(iter(value))
+                    break
+            elif type(entry) is dict:
+                push(iter(entry.items()))
+                break
+            # no second-level lists
+        else:
+            pop()
+
+
+def _get_all_object_urls(target: Any) -> List[str]:
+    """All object_urls in `target`"""
+    return list(_iter_object_urls(target))
+
+
+class IdIndex:
+    """
+    Positions of batches / records in their lists by id, for making several removals
+    from the same blob. Lists given to `remember` before any removal are indexed as
+    they were then, and others the first time they are searched. As removals only
+    ever pop entries, an entry can only have moved towards the start of its list,
+    so it is found by identity from its original position backwards, costing only
+    the number of entries popped before it rather than a full scan.
+    The same goes for positional ids, which refer to the entry at that position
+    when the list was remembered, wherever earlier removals have moved it since.
+    """
+
+    def __init__(self):
+        # (id(entries), id(get_id)) -> (entries, get_id, id -> (original position, entry))
+        # holding on to each list and getter means their ids cannot be reused
+        self._lists: Dict[
+            Tuple[int, int], Tuple[list, Callable, Dict[Any, Tuple[int, Any]]]
+        ] = dict()
+        # id(entries) -> (entries, a copy of them as they were when remembered)
+        self._originals: Dict[int, Tuple[list, list]] = dict()
+
+    def remember(self, entries: list) -> None:
+        """Records the positions of `entries` before any are popped"""
+        if self._original(entries) is entries:
+            self._originals[id(entries)] = (entries, list(entries))
+
+    def _original(self, entries: list) -> list:
+        """`entries` as they were when remembered, or as they are if they weren't"""
+        remembered = self._originals.get(id(entries))
+        if remembered is None or remembered[0] is not entries:
+            return entries
+        return remembered[1]
+
+    def _positions(
+        self, entries: list, get_id: Callable[[Any], Any]
+    ) -> Dict[Any, Tuple[int, Any]]:
+        key: Tuple[int, int] = (id(entries), id(get_id))
+        cached = self._lists.get(key)
+        if cached is None or cached[0] is not entries or cached[1] is not get_id:
+            positions: Dict[Any, Tuple[int, Any]] = dict()
+            for idx, entry in enumerate(self._original(entries)):
+                # the first of any repeated ids, as with a scan
+                positions.setdefault(get_id(entry), (idx, entry))
+            cached = self._lists[key] = (entries, get_id, positions)
+        return cached[2]
+
+    def _now_at(self, entries: list, original_idx: int, entry: Any) -> Optional[int]:
+        """Where `entry`, originally at `original_idx`, is now, or None if popped"""
+        for idx in range(min(original_idx, len(entries) - 1), -1, -1):
+            if entries[idx] is entry:
+                return idx
+        return None
+
+    def find(
+        self, entries: list, get_id: Callable[[Any], Any], entry_id: Any
+    ) -> Optional[int]:
+        """Returns the position in `entries` of the first with the id, or None"""
+        found: Optional[Tuple[int, Any]] = self._positions(entries, get_id).get(
+            entry_id
+        )
+        if found is not None:
+            idx: Optional[int] = self._now_at(entries, *found)
+            if idx is not None:
+                return idx
+
+        # already popped, but there may be another with the same id
+        for idx, entry in enumerate(entries):
+            if get_id(entry) == entry_id:
+                return idx
+        return None
+
+    def find_position(self, entries: list, position: int) -> Optional[int]:
+        """
+        Returns where the entry that was at `position` when `entries` was remembered
+        is now, or None if it has been popped since
+        """
+        original: list = self._original(entries)
+        if position >= len(original):
+            return None
+        return self._now_at(entries, position, original[position])
+
+    def remember_batches(self, layout: AssayLayout, metadata_json: dict) -> None:
+        """Remembers each list of batches of `layout`, and their lists of records"""
+        for _, batches in layout.iter_batch_lists(metadata_json):
+            self.remember(batches)
+            for batch in batches:
+                records = (
+                    batch.get(layout.record_key)
+                    if layout.record_key and isinstance(batch, dict)
+                    else None
+                )
+                if isinstance(records, list):
+                    self.remember(records)
+
+
+def _find_entry(
+    entries: list,
+    get_id: Callable[[Any], Any],
+    entry_id: Any,
+    ids: Optional[IdIndex] = None,
+) -> Optional[int]:
+    """Returns the index of the first entry with the given id, or None if there isn't one"""
+    if ids is not None:
+        return ids.find(entries, get_id, entry_id)
 
+    for idx, entry in enumerate(entries):
+        if get_id(entry) == entry_id:
+            return idx
 
-def _get_all_object_urls(target: dict) -> List[str]:
-    ret = []
-    for key, value in target.items():
-        if key == "object_url":
-            ret.append(value)
-        if isinstance(value, dict):
-            ret.extend(_get_all_object_urls(value))
-        if isinstance(value, list):
-            for each in value:
-                if isinstance(each, dict):
-                    ret.extend(_get_all_object_urls(each))
-                # no second-level lists
-    return ret
+    return None
+
+
+def _find_batch(
+    layout: AssayLayout, batches: list, batch_id: str, ids: Optional[IdIndex] = None
+) -> Optional[int]:
+    """
+    Returns the index of the batch with the given id, or None if it can't be found
+    If `layout.positional`, an index as a string is also accepted as the id,
+    which with `ids` is the batch's index before any removals
+    """
+    batch_idx: Optional[int] = _find_entry(batches, layout.get_batch_id, batch_id, ids)
+    if batch_idx is not None:
+        return batch_idx
+
+    if layout.positional and batch_id.isnumeric():
+        # only convert if if possible and not an actual id
+        if ids is not None:
+            # the batch at that position before any removals
+            return ids.find_position(batches, int(batch_id))
+        if int(batch_id) < len(batches):
+            return int(batch_id)
+
+    return None
+
+
+def _find_record(
+    layout: AssayLayout, records: list, record_id: str, ids: Optional[IdIndex] = None
+) -> Optional[int]:
+    """Returns the index of the record with the given id, or None if it can't be found"""
+    return _find_entry(records, layout.get_record_id, record_id, ids)
+
+
+def _misc_data_filename(file: dict) -> str:
+    return LAYOUTS["misc_data"].get_record_id(file).split("/misc_data/")[1]
 
 
 def _remove_misc_data_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     batch_id: str,
     filename: str = None,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
     try:
         batch_id: int = int(batch_id)
@@ -40,86 +233,82 @@ def _remove_misc_data_from_blob(
         print(f"Error: for misc_data, batch_id must be an integer, not {batch_id}")
         return None, []
 
-    if batch_id >= len(metadata_json.get("assays", {}).get("misc_data", [])):
+    batches: list = layout.batches(metadata_json)
+    batch_idx: Optional[int] = batch_id if batch_id < len(batches) else None
+    if ids is not None:
+        # the batch at that position before any removals
+        batch_idx = ids.find_position(batches, batch_id)
+    if batch_idx is None:
         print(f"Cannot find misc_data batch {batch_id} for trial {trial_id}")
         return None, []
 
     object_urls_to_delete: List[str] = []
     if filename:
-        filenames: List[str] = [
-            file["file"]["object_url"].split("/misc_data/")[1]
-            for file in metadata_json["assays"]["misc_data"][batch_id]["files"]
-        ]
-        if filename not in filenames:
+        files: list = batches[batch_idx][layout.record_key]
+        file_idx: Optional[int] = _find_entry(files, _misc_data_filename, filename, ids)
+        if file_idx is None:
             print(
                 f"Cannot find file {filename} in batch {batch_id} for trial {trial_id}"
             )
         else:
-            record: dict = metadata_json["assays"]["misc_data"][batch_id]["files"].pop(
-                filenames.index(filename)
-            )
+            record: dict = files.pop(file_idx)
             object_urls_to_delete.extend(_get_all_object_urls(record))
 
     else:
-        batch: dict = metadata_json["assays"]["misc_data"].pop(batch_id)
+        batch: dict = batches.pop(batch_idx)
         object_urls_to_delete.extend(_get_all_object_urls(batch))
 
     return metadata_json, object_urls_to_delete
 
 
 def _remove_olink_from_blob(
-    metadata_json: dict, trial_id: str, batch_id: str, filename: str = None
+    metadata_json: dict,
+    trial_id: str,
+    layout: AssayLayout,
+    batch_id: str,
+    filename: str = None,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    batch_ids: List[str] = [
-        batch["batch_id"]
-        for batch in metadata_json.get("assays", {}).get("olink", {"batches": []})[
-            "batches"
-        ]
-    ]
-    if batch_id != "study" and batch_id not in batch_ids:
+    batches: list = layout.batches(metadata_json)
+    batch_idx: Optional[int] = (
+        _find_batch(layout, batches, batch_id, ids) if batch_id != "study" else None
+    )
+    if batch_id != "study" and batch_idx is None:
         print(f"Cannot find olink batch {batch_id} for trial {trial_id}")
         return None, []
 
     object_urls_to_delete: List[str] = []
-    batch_idx: int = batch_ids.index(batch_id) if batch_id != "study" else None
     if filename:
         if filename == "combined":
-            if "combined" not in metadata_json["assays"]["olink"]["batches"][batch_idx]:
+            if "combined" not in batches[batch_idx]:
                 print(
                     f"Cannot find a combined file for olink batch {batch_id} for trial {trial_id}"
                 )
                 return None, []
             else:
                 # otherwise just the one file
-                target: dict = metadata_json["assays"]["olink"]["batches"][
-                    batch_idx
-                ].pop("combined")
+                target: dict = batches[batch_idx].pop("combined")
                 object_urls_to_delete.extend(_get_all_object_urls(target))
         else:
-            object_urls: List[str] = [
-                record["files"]["assay_npx"]["object_url"]
-                for record in metadata_json["assays"]["olink"]["batches"][batch_idx][
-                    "records"
-                ]
-            ]
-            if filename not in object_urls:
+            records: list = batches[batch_idx][layout.record_key]
+            record_idx: Optional[int] = _find_record(layout, records, filename, ids)
+            if record_idx is None:
                 print(
                     f"Cannot find a file {filename} in olink batch {batch_id} for trial {trial_id}"
                 )
                 return None, []
             else:
-                target: dict = metadata_json["assays"]["olink"]["batches"][batch_idx][
-                    "records"
-                ].pop(object_urls.index(filename))
+                target: dict = records.pop(record_idx)
                 object_urls_to_delete.extend(_get_all_object_urls(target))
 
     elif batch_id == "study":
         # batch_idx is None
-        target: dict = metadata_json["assays"]["olink"].pop("study")
+        target: dict = metadata_json[layout.section][layout.keys[0]].pop("study")
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
     else:
-        target: dict = metadata_json["assays"]["olink"]["batches"].pop(batch_idx)
+        target: dict = batches.pop(batch_idx)
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
     # also remove hanging structures
@@ -127,15 +316,13 @@ def _remove_olink_from_blob(
     if filename:
         # if we didn't pop the batch but might have left it hanging
         # if we DID pop, batch_idx would either not exist or point to the following entry
-        batch: dict = metadata_json["assays"]["olink"]["batches"][
-            batch_idx
-        ]  # for convenience
-        if "combined" not in batch and not batch["records"]:
+        batch: dict = batches[batch_idx]  # for convenience
+        if "combined" not in batch and not batch[layout.record_key]:
             # if no combined or any records, remove the whole batch
-            target["batch"] = metadata_json["assays"]["olink"]["batches"].pop(batch_idx)
-    if "study" not in metadata_json and not metadata_json["assays"]["olink"]["batches"]:
+            target["batch"] = batches.pop(batch_idx)
+    if "study" not in metadata_json and not batches:
         # if no batches, remove the whole assay
-        target["assay"] = metadata_json["assays"].pop("olink")
+        target["assay"] = layout.pop_root(metadata_json)
     if target:
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
@@ -145,27 +332,26 @@ def _remove_olink_from_blob(
 def _remove_elisa_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     assay_run_id: str,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    assay_run_ids: List[str] = [
-        assay_run["assay_run_id"]
-        for assay_run in metadata_json.get("assays", {}).get("elisa", [])
-    ]
-    if assay_run_id not in assay_run_ids:
+    assay_runs: list = layout.batches(metadata_json)
+    assay_run_idx: Optional[int] = _find_batch(layout, assay_runs, assay_run_id, ids)
+    if assay_run_idx is None:
         print(f"Cannot find elisa batch {assay_run_id} for trial {trial_id}")
         return None, []
 
     object_urls_to_delete: List[str] = []
-    assay_run_idx: int = assay_run_ids.index(assay_run_id)
-
-    assay_run: dict = metadata_json["assays"]["elisa"].pop(assay_run_idx)
+    assay_run: dict = assay_runs.pop(assay_run_idx)
     object_urls_to_delete.extend(_get_all_object_urls(assay_run))
 
     # also remove hanging structures
     target = dict()
-    if not metadata_json["assays"]["elisa"]:
+    if not assay_runs:
         # if no batches, remove the whole assay
-        target: dict = metadata_json["assays"].pop("elisa")
+        target: dict = layout.pop_root(metadata_json)
     if target:
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
@@ -175,36 +361,32 @@ def _remove_elisa_from_blob(
 def _remove_nanostring_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     batch_id: str,
     run_id: str = None,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    batch_ids: List[str] = [
-        batch["batch_id"]
-        for batch in metadata_json.get("assays", {}).get("nanostring", [])
-    ]
-    if batch_id not in batch_ids:
+    batches: list = layout.batches(metadata_json)
+    batch_idx: Optional[int] = _find_batch(layout, batches, batch_id, ids)
+    if batch_idx is None:
         print(f"Cannot find nanostring batch {batch_id} for trial {trial_id}")
         return None, []
 
     object_urls_to_delete: List[str] = []
-    batch_idx: int = batch_ids.index(batch_id)
     if run_id:
-        run_ids: List[str] = [
-            run["run_id"]
-            for run in metadata_json["assays"]["nanostring"][batch_idx]["runs"]
-        ]
-        if run_id not in run_ids:
+        runs: list = batches[batch_idx][layout.record_key]
+        run_idx: Optional[int] = _find_record(layout, runs, run_id, ids)
+        if run_idx is None:
             print(
                 f"Cannot find a run {run_id} in nanostring batch {batch_id} for trial {trial_id}"
             )
             return None, []
         else:
-            record: dict = metadata_json["assays"]["nanostring"][batch_idx]["runs"].pop(
-                run_ids.index(run_id)
-            )
+            record: dict = runs.pop(run_idx)
             object_urls_to_delete.extend(_get_all_object_urls(record))
     else:
-        batch: dict = metadata_json["assays"]["nanostring"].pop(batch_idx)
+        batch: dict = batches.pop(batch_idx)
         object_urls_to_delete.extend(_get_all_object_urls(batch))
 
     # also remove hanging structures
@@ -212,15 +394,13 @@ def _remove_nanostring_from_blob(
     if run_id:
         # if we didn't pop the batch but might have left it hanging
         # if we DID pop, batch_idx would either not exist or point to the following entry
-        batch: dict = metadata_json["assays"]["nanostring"][
-            batch_idx
-        ]  # for convenience
-        if not batch["runs"]:
+        batch: dict = batches[batch_idx]  # for convenience
+        if not batch[layout.record_key]:
             # if no combined or any runs, remove the whole batch
-            target["batch"] = metadata_json["assays"]["nanostring"].pop(batch_idx)
-    if not metadata_json["assays"]["nanostring"]:
+            target["batch"] = batches.pop(batch_idx)
+    if not batches:
         # if no batches, remove the whole assay
-        target["assay"] = metadata_json["assays"].pop("nanostring")
+        target["assay"] = layout.pop_root(metadata_json)
     if target:
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
@@ -230,29 +410,26 @@ def _remove_nanostring_from_blob(
 def _remove_rna_analysis_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     cimac_id: str,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    cimac_ids: List[str] = [
-        record["cimac_id"]
-        for record in metadata_json.get("analysis", {}).get(
-            "rna_analysis", {"level_1": []}
-        )["level_1"]
-    ]
-    if cimac_id not in cimac_ids:
+    records: list = layout.batches(metadata_json)
+    record_idx: Optional[int] = _find_batch(layout, records, cimac_id, ids)
+    if record_idx is None:
         print(f"Cannot find RNA analysis for {cimac_id} for trial {trial_id}")
         return None, []
 
     object_urls_to_delete: List[str] = []
-    record_idx: int = cimac_ids.index(cimac_id)
-
-    record: dict = metadata_json["analysis"]["rna_analysis"]["level_1"].pop(record_idx)
+    record: dict = records.pop(record_idx)
     object_urls_to_delete.extend(_get_all_object_urls(record))
 
     # also remove hanging structures
     target = dict()
-    if not metadata_json["analysis"]["rna_analysis"]["level_1"]:
+    if not records:
         # if no batches, remove the whole assay
-        target: dict = metadata_json["analysis"].pop("rna_analysis")
+        target: dict = layout.pop_root(metadata_json)
     if target:
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
@@ -262,42 +439,34 @@ def _remove_rna_analysis_from_blob(
 def _remove_cytof_analysis_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     batch_id: str,
     cimac_id: str = None,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    batch_ids: List[str] = [
-        batch["batch_id"]
-        for batch in metadata_json.get("assays", {}).get("cytof", [])
-        if "astrolabe_analysis" in batch
-    ]
-    if batch_id not in batch_ids:
+    batches: list = layout.batches(metadata_json)
+    batch_idx: Optional[int] = _find_batch(layout, batches, batch_id, ids)
+    if batch_idx is None or "astrolabe_analysis" not in batches[batch_idx]:
         print(f"Cannot find cytof analysis batch {batch_id} for trial {trial_id}")
         return None, []
-    else:
-        batch_idx: int = batch_ids.index(batch_id)
 
     object_urls_to_delete: List[str] = []
+    records: list = batches[batch_idx][layout.record_key]
     if cimac_id:
-        cimac_ids: List[str] = [
-            record["cimac_id"]
-            for record in metadata_json["assays"]["cytof"][batch_idx]["records"]
-            if "output_files" in record
-        ]
-        if cimac_id not in cimac_ids:
+        record_idx: Optional[int] = _find_record(layout, records, cimac_id, ids)
+        if record_idx is None or "output_files" not in records[record_idx]:
             print(
                 f"Cannot find cytof analysis for sample {cimac_id} in batch {batch_id} for trial {trial_id}"
             )
             return None, []
         else:
-            record_idx: int = cimac_ids.index(cimac_id)
-            output_files: dict = metadata_json["assays"]["cytof"][batch_idx]["records"][
-                record_idx
-            ].pop("output_files")
+            output_files: dict = records[record_idx].pop("output_files")
             object_urls_to_delete.extend(_get_all_object_urls(output_files))
 
     else:
         batch: dict = {
-            key: metadata_json["assays"]["cytof"][batch_idx].pop(key, {})
+            key: batches[batch_idx].pop(key, {})
             for key in [
                 "astrolabe_reports",
                 "astrolabe_analysis",
@@ -307,13 +476,9 @@ def _remove_cytof_analysis_from_blob(
         object_urls_to_delete.extend(_get_all_object_urls(batch))
 
         # remove analysis from all samples in this batch as well
-        for record_idx, record in enumerate(
-            metadata_json["assays"]["cytof"][batch_idx]["records"]
-        ):
+        for record in records:
             if "output_files" in record:
-                output_files: dict = metadata_json["assays"]["cytof"][batch_idx][
-                    "records"
-                ][record_idx].pop("output_files")
+                output_files: dict = record.pop("output_files")
                 object_urls_to_delete.extend(_get_all_object_urls(output_files))
 
     # there cannot be any hanging structure to remove
@@ -323,46 +488,35 @@ def _remove_cytof_analysis_from_blob(
 def _remove_wes_analysis_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     run_id: str,
-    just_old: bool = False,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
     object_urls_to_delete: List[str] = []
-    for subkey in ["wes_analysis", "wes_analysis_old"]:
-        if just_old and "old" not in subkey:
-            continue
-
-        run_ids: List[str] = [
-            run["run_id"]
-            for run in metadata_json.get("analysis", {}).get(subkey, {"pair_runs": []})[
-                "pair_runs"
-            ]
-        ]
-        if run_id not in run_ids:
+    for _, runs in layout.iter_batch_lists(metadata_json):
+        record_idx: Optional[int] = _find_batch(layout, runs, run_id, ids)
+        if record_idx is None:
             # has to be missing from both to be an issue
             continue
 
-        record_idx: int = run_ids.index(run_id)
-
-        record: dict = metadata_json["analysis"][subkey]["pair_runs"].pop(record_idx)
+        record: dict = runs.pop(record_idx)
         object_urls_to_delete.extend(_get_all_object_urls(record))
 
     if not len(object_urls_to_delete):
         print(
             f"Cannot find "
-            + ("old " if just_old else "")
+            + ("old " if layout.name.endswith("_old") else "")
             + f"WES paired analysis for {run_id} for trial {trial_id}"
         )
         return None, []
 
     # also remove hanging structures
-    for subkey in ["wes_analysis", "wes_analysis_old"]:
+    for key, runs in list(layout.iter_batch_lists(metadata_json)):
         target = dict()
-        if (
-            subkey in metadata_json["analysis"]
-            and not metadata_json["analysis"][subkey]["pair_runs"]
-        ):
+        if not runs:
             # if no batches, remove the whole assay
-            target: dict = metadata_json["analysis"].pop(subkey)
+            target: dict = layout.pop_root(metadata_json, key)
         if target:
             object_urls_to_delete.extend(_get_all_object_urls(target))
 
@@ -372,46 +526,35 @@ def _remove_wes_analysis_from_blob(
 def _remove_wes_tumor_only_analysis_from_blob(
     metadata_json: dict,
     trial_id: str,
+    layout: AssayLayout,
     cimac_id: str,
-    just_old: bool = False,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
     object_urls_to_delete: List[str] = []
-    for subkey in ["wes_tumor_only_analysis", "wes_tumor_only_analysis_old"]:
-        if just_old and "old" not in subkey:
-            continue
-
-        cimac_ids: List[str] = [
-            run["tumor"]["cimac_id"]
-            for run in metadata_json.get("analysis", {}).get(subkey, {"runs": []})[
-                "runs"
-            ]
-        ]
-        if cimac_id not in cimac_ids:
+    for _, runs in layout.iter_batch_lists(metadata_json):
+        record_idx: Optional[int] = _find_batch(layout, runs, cimac_id, ids)
+        if record_idx is None:
             # has to be missing from both to be an issue
             continue
 
-        record_idx: int = cimac_ids.index(cimac_id)
-
-        record: dict = metadata_json["analysis"][subkey]["runs"].pop(record_idx)
+        record: dict = runs.pop(record_idx)
         object_urls_to_delete.extend(_get_all_object_urls(record))
 
     if not len(object_urls_to_delete):
         print(
             f"Cannot find "
-            + ("old " if just_old else "")
+            + ("old " if layout.name.endswith("_old") else "")
             + f"WES tumor-only analysis for {cimac_id} for trial {trial_id}"
         )
         return None, []
 
     # also remove hanging structures
-    for subkey in ["wes_tumor_only_analysis", "wes_tumor_only_analysis_old"]:
+    for key, runs in list(layout.iter_batch_lists(metadata_json)):
         target = dict()
-        if (
-            subkey in metadata_json["analysis"]
-            and not metadata_json["analysis"][subkey]["runs"]
-        ):
+        if not runs:
             # if no batches, remove the whole assay
-            target: dict = metadata_json["analysis"].pop(subkey)
+            target: dict = layout.pop_root(metadata_json, key)
         if target:
             object_urls_to_delete.extend(_get_all_object_urls(target))
 
@@ -421,43 +564,34 @@ def _remove_wes_tumor_only_analysis_from_blob(
 def _remove_batched_assay_from_blob(
     metadata_json: dict,
     trial_id: str,
-    assay_or_analysis: str,
+    layout: AssayLayout,
     batch_id: str,
     cimac_id: str = None,
+    *,
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    subkey: str = "analysis" if "analysis" in assay_or_analysis else "assays"
-    batch_ids: List[str] = [
-        batch["batch_id"]
-        for batch in metadata_json.get(subkey, {}).get(
-            assay_or_analysis, {"batches": []}
-        )["batches"]
-    ]
-    if batch_id not in batch_ids:
+    assay_or_analysis: str = layout.name
+    batches: list = layout.batches(metadata_json)
+    batch_idx: Optional[int] = _find_batch(layout, batches, batch_id, ids)
+    if batch_idx is None:
         print(f"Cannot find {assay_or_analysis} batch {batch_id} for trial {trial_id}")
         return None, []
 
     object_urls_to_delete: List[str] = []
-    batch_idx: int = batch_ids.index(batch_id)
     if cimac_id:
-        cimac_ids: List[str] = [
-            record["cimac_id"]
-            for record in metadata_json[subkey][assay_or_analysis]["batches"][
-                batch_idx
-            ]["records"]
-        ]
-        if cimac_id not in cimac_ids:
+        records: list = batches[batch_idx][layout.record_key]
+        record_idx: Optional[int] = _find_record(layout, records, cimac_id, ids)
+        if record_idx is None:
             print(
                 f"Cannot find {assay_or_analysis} for sample {cimac_id} in batch {batch_id} for trial {trial_id}"
             )
             return None, []
         else:
-            record: dict = metadata_json[subkey][assay_or_analysis]["batches"][
-                batch_idx
-            ]["records"].pop(cimac_ids.index(cimac_id))
+            record: dict = records.pop(record_idx)
             object_urls_to_delete.extend(_get_all_object_urls(record))
 
     else:
-        batch: dict = metadata_json[subkey][assay_or_analysis]["batches"].pop(batch_idx)
+        batch: dict = batches.pop(batch_idx)
         object_urls_to_delete.extend(_get_all_object_urls(batch))
 
     # also remove hanging structures
@@ -465,96 +599,100 @@ def _remove_batched_assay_from_blob(
     if cimac_id:
         # if we didn't pop the batch but might have left it hanging
         # if we DID pop, batch_idx would either not exist or point to the following entry
-        batch: dict = metadata_json[subkey][assay_or_analysis]["batches"][
-            batch_idx
-        ]  # for convenience
-        if not batch["records"]:
+        batch: dict = batches[batch_idx]  # for convenience
+        if not batch[layout.record_key]:
             # if no combined or any records, remove the whole batch
-            target["batch"] = metadata_json[subkey][assay_or_analysis]["batches"].pop(
-                batch_idx
-            )
-    if not metadata_json[subkey][assay_or_analysis]["batches"]:
+            target["batch"] = batches.pop(batch_idx)
+    if not batches:
         # if no batches, remove the whole assay/analysis
-        target[subkey] = metadata_json[subkey].pop(assay_or_analysis)
+        target[layout.section] = layout.pop_root(metadata_json)
     if target:
         object_urls_to_delete.extend(_get_all_object_urls(target))
 
     return metadata_json, object_urls_to_delete
 
 
-def _remove_generic_assay_from_blob(
+# each takes (metadata_json, trial_id, layout, *target_id) for its layout's kind,
+# optionally with an IdIndex as `ids`, and returns the updated metadata_json,
+# or None if there is nothing to remove, along with the object_urls of the files
+# that were removed
+_REMOVERS: Dict[str, Callable[..., Tuple[Optional[dict], List[str]]]] = {
+    "misc_data": _remove_misc_data_from_blob,
+    "olink": _remove_olink_from_blob,
+    "elisa": _remove_elisa_from_blob,
+    "nanostring": _remove_nanostring_from_blob,
+    "rna_analysis": _remove_rna_analysis_from_blob,
+    "cytof_analysis": _remove_cytof_analysis_from_blob,
+    "wes_analysis": _remove_wes_analysis_from_blob,
+    "wes_tumor_only_analysis": _remove_wes_tumor_only_analysis_from_blob,
+    "batched": _remove_batched_assay_from_blob,
+}
+
+
+def _apply_removal(
     metadata_json: dict,
     trial_id: str,
-    assay_or_analysis: str,
-    batch_id: str,
-    cimac_id: str = None,
+    layout: AssayLayout,
+    target_id: Tuple[str],
+    ids: Optional[IdIndex] = None,
 ) -> Tuple[Optional[dict], List[str]]:
-    subkey: str = "analysis" if "analysis" in assay_or_analysis else "assays"
-    batch_ids: List[str] = [
-        batch["batch_id"]
-        for batch in metadata_json.get(subkey, {}).get(assay_or_analysis, [])
-        if "batch_id" in batch
-    ]
-    if batch_id not in batch_ids:
-        if (
-            batch_id.isnumeric()
-            and "." not in batch_id
-            and int(batch_id) >= 0
-            and int(batch_id)
-            < len(metadata_json.get(subkey, {}).get(assay_or_analysis, []))
-        ):
-            # only convert if if possible and not in batch_ids
-            batch_idx: int = int(batch_id)
-        else:
-            print(
-                f"Cannot find {assay_or_analysis} batch {batch_id} for trial {trial_id}"
-            )
-            return None, []
+    """
+    Removes a single target from `metadata_json` in place, see `remove_data`
+    Returns the updated metadata_json, or None if there is nothing to remove,
+    along with the object_urls of the files that were removed
+    If given, `ids` is used to find batches / records
+    """
+    if 1 <= len(target_id) <= len(layout.target_ids):
+        return _REMOVERS[layout.kind](
+            metadata_json, trial_id, layout, *target_id, ids=ids
+        )
     else:
-        batch_idx: int = batch_ids.index(batch_id)
+        print(
+            f"Error: if ASSAY_OR_ANALYSIS == '{layout.name}', only `{layout.usage}` is accepted"
+        )
+        return None, []
 
-    object_urls_to_delete: List[str] = []
-    if cimac_id:
-        cimac_ids: List[str] = [
-            record["cimac_id"]
-            for record in metadata_json[subkey][assay_or_analysis][batch_idx]["records"]
-        ]
-        if cimac_id not in cimac_ids:
-            print(
-                f"Cannot find {assay_or_analysis} for sample {cimac_id} in batch {batch_id} for trial {trial_id}"
+
+def _update_trial(session: Session, trial_id: str, ops: List[PatchOp]) -> None:
+    """
+    Updates the `trial_metadata` by applying `ops` to its metadata_json server-side,
+    so only the changed subtrees are sent instead of the whole blob
+    Applies them PATCH_OPS_PER_STATEMENT at a time, in `session`'s transaction
+    """
+    trial_query = session.query(TrialMetadata).filter(
+        TrialMetadata.trial_id == trial_id
+    )
+    for start in range(0, max(len(ops), 1), PATCH_OPS_PER_STATEMENT):
+        chunk: List[PatchOp] = ops[start : start + PATCH_OPS_PER_STATEMENT]
+        values: dict = {TrialMetadata._updated: datetime.now()}
+        if chunk:
+            values[TrialMetadata.metadata_json] = patch_expression(
+                TrialMetadata.metadata_json, chunk
             )
-            return None, []
-        else:
-            record: dict = metadata_json[subkey][assay_or_analysis][batch_idx][
-                "records"
-            ].pop(cimac_ids.index(cimac_id))
-            object_urls_to_delete.extend(_get_all_object_urls(record))
+        trial_query.update(values, synchronize_session=False)
 
-    else:
-        batch: dict = metadata_json[subkey][assay_or_analysis].pop(batch_idx)
-        object_urls_to_delete.extend(_get_all_object_urls(batch))
 
-    # also remove hanging structures
-    target = dict()
-    if cimac_id:
-        # if we didn't pop the batch but might have left it hanging
-        # if we DID pop, batch_idx would either not exist or point to the following entry
-        batch: dict = metadata_json[subkey][assay_or_analysis][
-            batch_idx
-        ]  # for convenience
-        if not batch["records"]:
-            # if no combined or any records, remove the whole batch
-            target["batch"] = metadata_json[subkey][assay_or_analysis].pop(batch_idx)
-    if not metadata_json[subkey][assay_or_analysis]:
-        # if no batches, remove the whole assay/analysis
-        target[subkey] = metadata_json[subkey].pop(assay_or_analysis)
-    if target:
-        object_urls_to_delete.extend(_get_all_object_urls(target))
+def _update_trial_and_files(
+    session: Session, trial_id: str, ops: List[PatchOp], object_urls: List[str]
+) -> int:
+    """
+    Patches the metadata_json for the trial and removes the `downloadable_files`
+    Returns the number of files removed
+    """
+    _update_trial(session, trial_id, ops)
 
-    return metadata_json, object_urls_to_delete
+    # remove the `downloadable_files`
+    return bulk_delete(DownloadableFiles.object_url, object_urls, session=session)
 
 
-def remove_data(trial_id: str, assay_or_analysis: str, target_id: Tuple[str]) -> None:
+def remove_data(
+    trial_id: str,
+    assay_or_analysis: str,
+    target_id: Tuple[str],
+    dry_run: bool = False,
+    two_phase: bool = False,
+    delete_objects: bool = False,
+) -> None:
     """
     Removes a data section completely, include its downloadle_files entries
 
@@ -573,15 +711,28 @@ def remove_data(trial_id: str, assay_or_analysis: str, target_id: Tuple[str]) ->
             eg if ASSAY_OR_ANALYSIS == "wes_analysis", only `run_id` is accepted
             eg if ASSAY_OR_ANALYSIS == "olink", `batch_id [file]` is assumed
                 ie `batch_id` is required but `file` is optional
+    dry_run: bool = False
+        only print what would be removed, without locking or changing anything
+    two_phase: bool = False
+        plan the removal without locking the trial, then lock it only to check it
+        hasn't changed since and apply the plan; see `remove_data_batch`
+    delete_objects: bool = False
+        also delete the removed files from GCS once the removal is committed
     """
-
-    if assay_or_analysis not in SUPPORTED_ASSAYS_AND_ANALYSES:
+    layout: Optional[AssayLayout] = LAYOUTS.get(assay_or_analysis)
+    if layout is None:
         print("Assay / analysis not supported:", assay_or_analysis)
         return
 
-    elif assay_or_analysis == "clinical_data":
+    elif layout.kind == "clinical_data":
         if len(target_id) == 1:
-            remove_clinical(trial_id=trial_id, target_id=target_id[0])
+            remove_clinical(
+                trial_id=trial_id,
+                target_id=target_id[0],
+                dry_run=dry_run,
+                two_phase=two_phase,
+                delete_objects=delete_objects,
+            )
         else:
             print(
                 "Error: if ASSAY_OR_ANALYSIS == 'clinical_data', only `filename` is accepted"
@@ -591,169 +742,319 @@ def remove_data(trial_id: str, assay_or_analysis: str, target_id: Tuple[str]) ->
             )
         return
 
+    if dry_run or two_phase:
+        remove_data_batch(
+            [(trial_id, assay_or_analysis, target_id)],
+            dry_run=dry_run,
+            two_phase=two_phase,
+            delete_objects=delete_objects,
+        )
+        return
+
     with Session.begin() as session:
         trial: TrialMetadata = get_trial_if_exists(
             trial_id, with_for_update=True, session=session
         )
 
-        metadata_json, object_urls_to_delete = None, []
-        if assay_or_analysis == "misc_data":
-            if len(target_id) and len(target_id) <= 2:
-                metadata_json, object_urls_to_delete = _remove_misc_data_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    batch_id=target_id[0],
-                    filename=None if len(target_id) == 1 else target_id[1],
-                )
-            else:
-                print(
-                    "Error: if ASSAY_OR_ANALYSIS == 'misc_data', only `batch_id [filename]` is accepted"
-                )
-        elif assay_or_analysis == "olink":
-            if len(target_id) and len(target_id) <= 2:
-                metadata_json, object_urls_to_delete = _remove_olink_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    batch_id=target_id[0],
-                    filename=None if len(target_id) == 1 else target_id[1],
-                )
-            else:
-                print(
-                    "Error: if ASSAY_OR_ANALYSIS == 'olink', only `batch_id [file]` is accepted"
-                )
-        elif assay_or_analysis == "elisa":
-            if len(target_id) == 1:
-                metadata_json, object_urls_to_delete = _remove_elisa_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    assay_run_id=target_id[0],
-                )
-            else:
-                print(
-                    "Error: if ASSAY_OR_ANALYSIS == 'elisa', only `assay_run_id` is accepted"
-                )
-        elif assay_or_analysis == "nanostring":
-            if len(target_id) and len(target_id) <= 2:
-                metadata_json, object_urls_to_delete = _remove_nanostring_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    batch_id=target_id[0],
-                    run_id=None if len(target_id) == 1 else target_id[1],
-                )
-            else:
-                print(
-                    "Error: if ASSAY_OR_ANALYSIS == 'olink', only `batch_id [file]` is accepted"
-                )
-        elif assay_or_analysis == "rna_level1_analysis":
-            if len(target_id) == 1:
-                metadata_json, object_urls_to_delete = _remove_rna_analysis_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    cimac_id=target_id[0],
-                )
-            else:
-                print(
-                    "Error: if ASSAY_OR_ANALYSIS == 'rna_level1_analysis', only `cimac_id` is accepted"
-                )
+        before = snapshot(trial.metadata_json, layout.paths)
+        metadata_json, object_urls_to_delete = _apply_removal(
+            trial.metadata_json, trial_id, layout, target_id
+        )
+        if metadata_json is not None:
+            num_deleted: int = _update_trial_and_files(
+                session,
+                trial_id,
+                diff_paths(before, metadata_json),
+                object_urls_to_delete,
+            )
 
-        elif assay_or_analysis == "cytof_analysis":
-            if len(target_id) <= 2:
-                metadata_json, object_urls_to_delete = _remove_cytof_analysis_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    batch_id=target_id[0],
-                    cimac_id=None if len(target_id) == 1 else target_id[1],
-                )
-            else:
-                print(
-                    "Error: if ASSAY_OR_ANALYSIS == 'cytof_analysis', only `batch_id [cimac_id]` is accepted"
-                )
-        elif assay_or_analysis in ["wes_analysis", "wes_analysis_old"]:
-            if len(target_id) == 1:
-                metadata_json, object_urls_to_delete = _remove_wes_analysis_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    run_id=target_id[0],
-                    just_old="old" in assay_or_analysis,
-                )
-            else:
-                print(
-                    f"Error: if ASSAY_OR_ANALYSIS == '{assay_or_analysis}', only `run_id` is accepted"
-                )
-        elif assay_or_analysis in [
-            "wes_tumor_only_analysis",
-            "wes_tumor_only_analysis_old",
-        ]:
-            if len(target_id) == 1:
-                (
-                    metadata_json,
-                    object_urls_to_delete,
-                ) = _remove_wes_tumor_only_analysis_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    cimac_id=target_id[0],
-                    just_old="old" in assay_or_analysis,
-                )
-            else:
-                print(
-                    f"Error: if ASSAY_OR_ANALYSIS == '{assay_or_analysis}', only `cimac_id` is accepted"
-                )
+            print(
+                f"Updated trial {trial_id}, removing {assay_or_analysis} values {target_id}",
+                f"along with {num_deleted} files",
+            )
 
-        elif assay_or_analysis in [
-            "mibi",
-            "tcr_analysis",
-        ]:
-            if len(target_id) and len(target_id) <= 2:
-                metadata_json, object_urls_to_delete = _remove_batched_assay_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    assay_or_analysis=assay_or_analysis,
-                    batch_id=target_id[0],
-                    cimac_id=None if len(target_id) == 1 else target_id[1],
-                )
-            else:
+    if delete_objects and metadata_json is not None:
+        gcs.delete_objects(object_urls_to_delete)
+
+
+# a single line of a removal file: trial_id, assay_or_analysis, target_id
+RemovalTarget = Tuple[str, str, Tuple[str, ...]]
+
+
+def read_removal_targets(filename: str) -> Optional[List[RemovalTarget]]:
+    """
+    Reads a tab-separated file of removals, one per line, for `remove_data_batch`
+    Each line is `trial_id  assay_or_analysis  target_id [target_id ...]`
+    Blank lines, lines starting with # and a header starting with `trial_id` are skipped
+    Returns None with a message if any line is malformed
+
+    Parameters
+    ----------
+    filename: str
+        the path of the file to read
+    """
+    targets: List[RemovalTarget] = []
+    with open(filename, newline="") as f:
+        for line_num, row in enumerate(csv.reader(f, delimiter="\t"), start=1):
+            row = [value.strip() for value in row]
+            while row and not row[-1]:
+                row.pop()
+            if not row or row[0].startswith("#"):
+                continue
+            if line_num == 1 and row[0] == "trial_id":
+                continue
+
+            if len(row) < 3:
                 print(
-                    f"Error: if ASSAY_OR_ANALYSIS == '{assay_or_analysis}', only `batch_id [cimac_id]` is accepted"
+                    f"Error: line {line_num} of {filename} must have a trial_id,",
+                    "an assay_or_analysis and at least one target_id",
                 )
+                return None
+            targets.append((row[0], row[1], tuple(row[2:])))
+
+    return targets
+
+
+class RemovalPlan(NamedTuple):
+    """The changes to make to a trial for some removals, see `_plan_removals`"""
+
+    # the operations on its metadata_json
+    ops: List[PatchOp]
+    # the downloadable_files to remove
+    object_urls: List[str]
+    # the removals that can and cannot be made
+    made: List[RemovalTarget]
+    failed: List[RemovalTarget]
+    # how many characters of JSON the metadata_json changes by
+    size_change: int
+
+
+def _removal_paths(trial_targets: List[RemovalTarget]) -> List[Tuple[str, str]]:
+    """The paths in metadata_json that the removals can change"""
+    return list(
+        dict.fromkeys(
+            path
+            for _, assay_or_analysis, _ in trial_targets
+            for path in LAYOUTS[assay_or_analysis].paths
+        )
+    )
+
+
+def _working_copy(metadata_json: dict, paths: List[Tuple[str, ...]]) -> dict:
+    """
+    A copy of metadata_json to plan removals on, only copying the parts at `paths`,
+    each either a whole section or a key of one
+    """
+    copy: dict = dict(metadata_json)
+    for section, *keys in paths:
+        if not keys:
+            if section in metadata_json:
+                copy[section] = deepcopy(metadata_json[section])
+            continue
+        (key,) = keys
+        if key in metadata_json.get(section, {}):
+            if copy[section] is metadata_json[section]:
+                copy[section] = dict(metadata_json[section])
+            copy[section][key] = deepcopy(metadata_json[section][key])
+    return copy
+
+
+def _plan_removals(
+    metadata_json: dict, trial_id: str, trial_targets: List[RemovalTarget]
+) -> RemovalPlan:
+    """
+    Makes the removals from `metadata_json` in place, returning what changed
+    Pass a `_working_copy` to only plan them
+    """
+    before = snapshot(metadata_json, _removal_paths(trial_targets))
+    # find batches / records without scanning for each removal, and by their
+    # positions before any removals, as the earlier ones shift the later ones
+    ids = IdIndex()
+    for assay_or_analysis in dict.fromkeys(target[1] for target in trial_targets):
+        ids.remember_batches(LAYOUTS[assay_or_analysis], metadata_json)
+    object_urls: List[str] = []
+    made: List[RemovalTarget] = []
+    failed: List[RemovalTarget] = []
+    for target in trial_targets:
+        _, assay_or_analysis, target_id = target
+        updated, removed_urls = _apply_removal(
+            metadata_json, trial_id, LAYOUTS[assay_or_analysis], target_id, ids=ids
+        )
+        if updated is None:
+            failed.append(target)
         else:
-            if len(target_id) and len(target_id) <= 2:
-                metadata_json, object_urls_to_delete = _remove_generic_assay_from_blob(
-                    metadata_json=trial.metadata_json,
-                    trial_id=trial_id,
-                    assay_or_analysis=assay_or_analysis,
-                    batch_id=target_id[0],
-                    cimac_id=None if len(target_id) == 1 else target_id[1],
+            object_urls.extend(removed_urls)
+            made.append(target)
+
+    return RemovalPlan(
+        ops=diff_paths(before, metadata_json),
+        object_urls=object_urls,
+        made=made,
+        failed=failed,
+        size_change=size_change(before, metadata_json),
+    )
+
+
+def _print_plan(trial_id: str, plan: RemovalPlan, num_files: int) -> None:
+    num_targets: int = len(plan.made) + len(plan.failed)
+    print(f"Plan for trial {trial_id}: {len(plan.made)} of {num_targets} removals")
+    print(f"  {len(plan.ops)} changes to metadata_json:")
+    for op in plan.ops:
+        print(f"    {op.op} {'/'.join(str(key) for key in op.path)}")
+    print(f"  {len(plan.object_urls)} files, {num_files} in downloadable_files:")
+    for object_url in plan.object_urls:
+        print(f"    {object_url}")
+    print(f"  metadata_json changes by {plan.size_change:+} characters")
+
+
+def _unchanged_since(session: Session, trial_id: str, version: Tuple[Any, Any]) -> bool:
+    """Locks the trial, returning whether its `_etag` and `_updated` are still `version`"""
+    return get_trial_version(trial_id, with_for_update=True, session=session) == version
+
+
+def remove_data_batch(
+    targets: List[RemovalTarget],
+    dry_run: bool = False,
+    two_phase: bool = False,
+    delete_objects: bool = False,
+) -> None:
+    """
+    Removes many data sections, include their downloadle_files entries
+    All removals for a trial are applied to its metadata_json in a single transaction,
+    which is written once along with a single deletion of all of their files
+    Removals that cannot be found are skipped and listed in the summary at the end
+
+    Parameters
+    ----------
+    targets: List[RemovalTarget]
+        the removals to make, in order, as from `read_removal_targets`
+        see `remove_data` for the allowed values of each
+        clinical_data is not supported, use `remove_clinical` instead
+    dry_run: bool = False
+        only print the plan for each trial: the changes to its metadata_json,
+        the files to remove, and how much smaller its metadata_json gets
+        reads each trial without locking it and changes nothing
+    two_phase: bool = False
+        plan each trial's removals without locking it, then lock it only to check
+        that its `_etag` and `_updated` haven't changed since and to apply the plan
+        if it has changed, nothing is removed from it
+        otherwise, each trial is locked while its removals are planned and applied
+    delete_objects: bool = False
+        also delete each trial's removed files from GCS once its removals are committed
+        ignored for a dry run
+    """
+    for _, assay_or_analysis, _ in targets:
+        layout: Optional[AssayLayout] = LAYOUTS.get(assay_or_analysis)
+        if layout is None:
+            print("Assay / analysis not supported:", assay_or_analysis)
+            return
+        elif layout.kind == "clinical_data":
+            print(
+                "Error: clinical_data cannot be removed in a batch,",
+                "use $ cidc admin remove clinical TRIAL_ID FILE_NAME",
+            )
+            return
+
+    targets_by_trial: Dict[str, List[RemovalTarget]] = dict()
+    for target in targets:
+        targets_by_trial.setdefault(target[0], []).append(target)
+
+    failed: List[RemovalTarget] = []
+    for trial_id, trial_targets in targets_by_trial.items():
+        if not (dry_run or two_phase):
+            with Session.begin() as session:
+                trial: TrialMetadata = get_trial_if_exists(
+                    trial_id, with_for_update=True, session=session
                 )
-            else:
-                print(
-                    f"Error: if ASSAY_OR_ANALYSIS == '{assay_or_analysis}', only `batch_id [cimac_id]` is accepted"
+                plan: RemovalPlan = _plan_removals(
+                    trial.metadata_json, trial_id, trial_targets
                 )
+                failed.extend(plan.failed)
+                if plan.made:
+                    num_deleted: int = _update_trial_and_files(
+                        session, trial_id, plan.ops, plan.object_urls
+                    )
+                    print(
+                        f"Updated trial {trial_id}, making {len(plan.made)} of {len(trial_targets)} removals",
+                        f"along with {num_deleted} files",
+                    )
+
+            if delete_objects and plan.made:
+                gcs.delete_objects(plan.object_urls)
+            continue
 
-        if metadata_json is not None:
-            # update the `trial_metadata`
-            session.query(TrialMetadata).filter(
-                TrialMetadata.trial_id == trial_id
-            ).update(
-                {
-                    TrialMetadata.metadata_json: metadata_json,
-                    TrialMetadata._updated: datetime.now(),
-                }
+        # plan from a snapshot, without locking
+        with Session.begin() as session:
+            trial: TrialMetadata = get_trial_if_exists(trial_id, session=session)
+            version: Tuple[Any, Any] = (trial._etag, trial._updated)
+            plan: RemovalPlan = _plan_removals(
+                _working_copy(trial.metadata_json, _removal_paths(trial_targets)),
+                trial_id,
+                trial_targets,
             )
+            failed.extend(plan.failed)
 
-            # remove the `downloadable_files`
-            num_deleted: int = (
-                session.query(DownloadableFiles)
-                .filter(DownloadableFiles.object_url.in_(object_urls_to_delete))
-                .delete()
-            )
+            if dry_run:
+                num_files: int = bulk_count(
+                    DownloadableFiles.object_url, plan.object_urls, session=session
+                )
+                _print_plan(trial_id, plan, num_files)
+                continue
+
+        if not plan.made:
+            continue
+
+        # lock only to check nothing has changed and apply
+        with Session.begin() as session:
+            if not _unchanged_since(session, trial_id, version):
+                print(
+                    f"Trial {trial_id} changed since its removals were planned,",
+                    "so none were made; try again",
+                )
+                failed.extend(plan.made)
+                continue
 
+            num_deleted: int = _update_trial_and_files(
+                session, trial_id, plan.ops, plan.object_urls
+            )
             print(
-                f"Updated trial {trial_id}, removing {assay_or_analysis} values {target_id}",
+                f"Updated trial {trial_id}, making {len(plan.made)} of {len(trial_targets)} removals",
                 f"along with {num_deleted} files",
             )
 
+        if delete_objects:
+            gcs.delete_objects(plan.object_urls)
+
+    verb: str = "Can make" if dry_run else "Made"
+    print(
+        f"{verb} {len(targets) - len(failed)} of {len(targets)} removals",
+        f"across {len(targets_by_trial)} trials",
+    )
+    for trial_id, assay_or_analysis, target_id in failed:
+        print(
+            f"{'Cannot remove' if dry_run else 'Failed to remove'} {trial_id} {assay_or_analysis} values {target_id}"
+        )
+
+
+def _remove_clinical_from_blob(metadata_json: dict, object_urls: Set[str]) -> dict:
+    """Removes the clinical_data records of the files at `object_urls`, and any hanging structure"""
+    metadata_json["clinical_data"]["records"] = [
+        r
+        for r in metadata_json.get("clinical_data", {}).get("records", [])
+        if r["clinical_file"]["object_url"] not in object_urls
+    ]
+    if not len(metadata_json["clinical_data"]["records"]):
+        metadata_json.pop("clinical_data")
+    return metadata_json
+
 
-def remove_clinical(trial_id: str, target_id: str) -> None:
+def remove_clinical(
+    trial_id: str,
+    target_id: str,
+    dry_run: bool = False,
+    two_phase: bool = False,
+    delete_objects: bool = False,
+) -> None:
     """
     Removes a clinical file completely, include its downloadle_files entry
 
@@ -765,11 +1066,21 @@ def remove_clinical(trial_id: str, target_id: str) -> None:
         the object_url of the file to remove
         not including {trial_id}/clinical/
         special value * for all files for this trial
+    dry_run: bool = False
+        only print what would be removed, without locking or changing anything
+    two_phase: bool = False
+        plan the removal without locking the trial, then lock it only to check it
+        hasn't changed since and apply the plan; see `remove_data_batch`
+    delete_objects: bool = False
+        also delete the removed files from GCS once the removal is committed
+        ignored for a dry run
     """
+    paths: List[Tuple[str, ...]] = [("clinical_data",)]
     with Session.begin() as session:
         trial: TrialMetadata = get_trial_if_exists(
-            trial_id, with_for_update=True, session=session
+            trial_id, with_for_update=not (dry_run or two_phase), session=session
         )
+        version: Tuple[Any, Any] = (trial._etag, trial._updated)
 
         if target_id == "*":
             # get all of the clinical files
@@ -786,7 +1097,7 @@ def remove_clinical(trial_id: str, target_id: str) -> None:
                 )
                 .all()
             )
-        target_urls = [f.object_url for f in targets]
+        object_urls: List[str] = [t.object_url for t in targets]
 
         if not len(targets):
             if target_id == "*":
@@ -795,30 +1106,48 @@ def remove_clinical(trial_id: str, target_id: str) -> None:
                 print(f"Clinical data file {target_id} not found for trial {trial_id}")
             exit()
 
-        # remove the file(s)
-        trial.metadata_json["clinical_data"]["records"] = [
-            r
-            for r in trial.metadata_json.get("clinical_data", {}).get("records", [])
-            if r["clinical_file"]["object_url"] not in target_urls
-        ]
+        before = snapshot(trial.metadata_json, paths)
+        # remove the file(s), in place if the trial is locked
+        metadata_json: dict = _remove_clinical_from_blob(
+            trial.metadata_json
+            if not (dry_run or two_phase)
+            else _working_copy(trial.metadata_json, paths),
+            set(object_urls),
+        )
+        ops: List[PatchOp] = diff_paths(before, metadata_json)
+
+        if dry_run:
+            plan = RemovalPlan(
+                ops=ops,
+                object_urls=object_urls,
+                made=[(trial_id, "clinical_data", (target_id,))],
+                failed=[],
+                size_change=size_change(before, metadata_json),
+            )
+            num_files: int = bulk_count(
+                DownloadableFiles.object_url, object_urls, session=session
+            )
+            _print_plan(trial_id, plan, num_files)
+            return
 
-        # remove any hanging structure
-        if not len(trial.metadata_json["clinical_data"]["records"]):
-            trial.metadata_json.pop("clinical_data")
+        if not two_phase:
+            _update_trial_and_files(session, trial_id, ops, object_urls)
 
-        # update the `trial_metadata`
-        session.query(TrialMetadata).filter(TrialMetadata.trial_id == trial_id).update(
-            {
-                TrialMetadata.metadata_json: trial.metadata_json,
-                TrialMetadata._updated: datetime.now(),
-            }
-        )
+    if two_phase:
+        # lock only to check nothing has changed and apply
+        with Session.begin() as session:
+            if not _unchanged_since(session, trial_id, version):
+                print(
+                    f"Trial {trial_id} changed since its removal was planned,",
+                    "so nothing was removed; try again",
+                )
+                return
+            _update_trial_and_files(session, trial_id, ops, object_urls)
 
-        # remove the `downloadable_files`
-        for t in targets:
-            session.delete(t)
+    print(f"Updated trial {trial_id}, removing {len(targets)} clinical data files")
 
-        print(f"Updated trial {trial_id}, removing {len(targets)} clinical data files")
+    if delete_objects:
+        gcs.delete_objects(object_urls)
 
 
 def _remove_samples_from_blob(
@@ -846,7 +1175,7 @@ def _remove_samples_from_blob(
                 continue
 
             else:
-                to_remove = samples_to_remove[cimac_partic_id]
+                to_remove: Set[str] = set(samples_to_remove[cimac_partic_id])
                 metadata_json["participants"][n]["samples"] = [
                     s for s in partic["samples"] if s["cimac_id"] not in to_remove
                 ]
@@ -855,7 +1184,9 @@ def _remove_samples_from_blob(
     return metadata_json
 
 
-def remove_shipment(trial_id: str, target_id: str) -> None:
+def remove_shipment(
+    trial_id: str, target_id: str, dry_run: bool = False, two_phase: bool = False
+) -> None:
     """
     Removes a shipment completely with all of its samples, including its upload_jobs entry
     Removes a participant completely if removing all of its samples
@@ -866,11 +1197,18 @@ def remove_shipment(trial_id: str, target_id: str) -> None:
         the id of the trial to affect
     target_id: str
         the manifest_id of the shipment to remove
+    dry_run: bool = False
+        only print what would be removed, without locking or changing anything
+    two_phase: bool = False
+        plan the removal without locking the trial, then lock it only to check it
+        hasn't changed since and apply the plan; see `remove_data_batch`
     """
+    paths: List[Tuple[str, ...]] = [("participants",), ("shipments",)]
     with Session.begin() as session:
         trial: TrialMetadata = get_trial_if_exists(
-            trial_id, with_for_update=True, session=session
+            trial_id, with_for_update=not (dry_run or two_phase), session=session
         )
+        version: Tuple[Any, Any] = (trial._etag, trial._updated)
 
         # get all of the shipments
         shipments: List[UploadJobs] = get_shipments(trial_id, session=session)
@@ -897,32 +1235,58 @@ def remove_shipment(trial_id: str, target_id: str) -> None:
             print(f"Shipment {target_id} for trial {trial_id} has no samples")
             exit()
 
-        # remove the samples
-        trial.metadata_json = _remove_samples_from_blob(
-            metadata_json=trial.metadata_json,
+        before = snapshot(trial.metadata_json, paths)
+
+        # remove the samples, in place if the trial is locked
+        metadata_json: dict = _remove_samples_from_blob(
+            metadata_json=trial.metadata_json
+            if not (dry_run or two_phase)
+            else _working_copy(trial.metadata_json, paths),
             samples_to_remove=samples_to_remove,
         )
         # remove the shipment(s)
-        trial.metadata_json["shipments"] = [
-            s for s in trial.metadata_json["shipments"] if s["manifest_id"] != target_id
+        metadata_json["shipments"] = [
+            s for s in metadata_json["shipments"] if s["manifest_id"] != target_id
         ]
-
-        # update the `trial_metadata`
-        session.query(TrialMetadata).filter(TrialMetadata.trial_id == trial_id).update(
-            {
-                TrialMetadata.metadata_json: trial.metadata_json,
-                TrialMetadata._updated: datetime.now(),
-            }
-        )
-
-        # remove the `upload_jobs`
-        for t in targets:
-            session.delete(t)
+        ops: List[PatchOp] = diff_paths(before, metadata_json)
+        upload_ids: list = [t.id for t in targets]
 
         num_samples: int = sum(len(samples) for samples in samples_to_remove.values())
         num_partic: int = len(samples_to_remove)
 
-        print(
-            f"Updated trial {trial_id}, removing shipment {target_id}",
-            f"along with {num_samples} samples across {num_partic} participants",
-        )
+        if dry_run:
+            plan = RemovalPlan(
+                ops=ops,
+                object_urls=[],
+                made=[(trial_id, "shipment", (target_id,))],
+                failed=[],
+                size_change=size_change(before, metadata_json),
+            )
+            _print_plan(trial_id, plan, 0)
+            print(
+                f"  {len(upload_ids)} upload_jobs, {num_samples} samples",
+                f"across {num_partic} participants",
+            )
+            return
+
+        if not two_phase:
+            _update_trial(session, trial_id, ops)
+            # remove the `upload_jobs`
+            bulk_delete(UploadJobs.id, upload_ids, session=session)
+
+    if two_phase:
+        # lock only to check nothing has changed and apply
+        with Session.begin() as session:
+            if not _unchanged_since(session, trial_id, version):
+                print(
+                    f"Trial {trial_id} changed since its removal was planned,",
+                    "so nothing was removed; try again",
+                )
+                return
+            _update_trial(session, trial_id, ops)
+            bulk_delete(UploadJobs.id, upload_ids, session=session)
+
+    print(
+        f"Updated trial {trial_id}, removing shipment {target_id}",
+        f"along with {num_samples} samples across {num_partic} participants",
+    )
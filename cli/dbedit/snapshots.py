@@ -0,0 +1,138 @@
+"""
+Local cache of trials' metadata_json for repeated listings
+
+Each trial's metadata_json is kept as gzipped JSON text under CIDC_WORKING_DIR,
+keyed by its trial_id and version ie `_etag` and `_updated`. Before a snapshot is
+reused, the trial's current version is checked with a query that doesn't fetch
+metadata_json, so listings of an unchanged trial skip transferring it entirely.
+The least recently used snapshots are evicted to stay within MAX_CACHE_BYTES.
+"""
+import gzip
+import hashlib
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import CIDC_WORKING_DIR
+from . import core
+from .core import get_trial_versions, json_loads, Session
+
+# the most bytes of gzipped snapshots to keep, per environment
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def _cache_dir() -> str:
+    # trial_ids are the same across environments, so keep them apart
+    return os.path.join(CIDC_WORKING_DIR, "trial_snapshots", core.get_db_env())
+
+
+def _trial_prefix(trial_id: str) -> str:
+    return hashlib.sha256(trial_id.encode()).hexdigest()[:32]
+
+
+def _snapshot_path(trial_id: str, etag: Any, updated: Any) -> str:
+    version: str = hashlib.sha256(f"{etag}|{updated}".encode()).hexdigest()[:16]
+    return os.path.join(_cache_dir(), f"{_trial_prefix(trial_id)}_{version}.json.gz")
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with gzip.open(path, "rt") as snapshot:
+            text: str = snapshot.read()
+    except (OSError, EOFError):
+        # missing, or cut short by an interruption
+        return None
+
+    # mark as recently used
+    os.utime(path)
+    return text
+
+
+def _write(trial_id: str, path: str, text: str) -> None:
+    """Writes a snapshot, replacing any older ones of the same trial"""
+    cache_dir: str = _cache_dir()
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    prefix: str = _trial_prefix(trial_id)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix):
+            os.remove(os.path.join(cache_dir, name))
+
+    # write then rename so that a partial snapshot is never read
+    with gzip.open(path + ".tmp", "wt", compresslevel=6) as snapshot:
+        snapshot.write(text)
+    os.replace(path + ".tmp", path)
+    _evict(keep=path)
+
+
+def _evict(keep: str) -> None:
+    """Removes the least recently used snapshots until within MAX_CACHE_BYTES"""
+    cache_dir: str = _cache_dir()
+    paths: List[str] = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    stats: Dict[str, os.stat_result] = {path: os.stat(path) for path in paths}
+    total: int = sum(stat.st_size for stat in stats.values())
+    for path in sorted(paths, key=lambda path: stats[path].st_mtime):
+        if total <= MAX_CACHE_BYTES:
+            break
+        if path != keep:
+            os.remove(path)
+            total -= stats[path].st_size
+
+
+def get_trials_as_text(
+    trial_ids: List[str], *, session: Session
+) -> List[Tuple[str, str]]:
+    """
+    Get the trial_id and metadata_json of each of the given trials, as for
+    `core.get_trials_as_text`, reusing local snapshots of any that haven't changed
+    Only the trials without a current snapshot have their metadata_json fetched,
+    all in a single query
+
+    Parameters
+    ----------
+    trial_ids: List[str]
+        the ids of the trials to get
+    session: Session
+        a session created from `core.Session` after `core.connect()` is called
+    """
+    paths: Dict[str, str] = {
+        trial_id: _snapshot_path(trial_id, etag, updated)
+        for trial_id, etag, updated in get_trial_versions(trial_ids, session=session)
+    }
+
+    found: Dict[str, str] = dict()
+    for trial_id, path in paths.items():
+        text: Optional[str] = _read(path)
+        if text is not None:
+            found[trial_id] = text
+
+    missing: List[str] = [trial_id for trial_id in paths if trial_id not in found]
+    if missing:
+        for trial_id, text in core.get_trials_as_text(missing, session=session):
+            found[trial_id] = text
+            if trial_id in paths:
+                _write(trial_id, paths[trial_id], text)
+
+    return [
+        (trial_id, found[trial_id])
+        for trial_id in dict.fromkeys(trial_ids)
+        if trial_id in found
+    ]
+
+
+def get_trial_metadata(trial_id: str, *, session: Session) -> dict:
+    """
+    Get the metadata_json for the given trial, reusing its local snapshot if unchanged
+    Exits with message if trial does not exist
+
+    Parameters
+    ----------
+    trial_id: str
+        the id of the trial to get
+    session: Session
+        a session created from `core.Session` after `core.connect()` is called
+    """
+    found: List[Tuple[str, str]] = get_trials_as_text([trial_id], session=session)
+    if not found:
+        print(f"Trial {trial_id} cannot be found")
+        exit()
+
+    return json_loads(found[0][1])
@@ -0,0 +1,232 @@
+"""Download trial files from CIDC to a local directory"""
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import BinaryIO, Callable, List, Optional, Set, Tuple
+
+import click
+import requests
+
+from . import api
+from . import transfer
+
+# how many files to download at once
+DOWNLOAD_WORKERS = 4
+# files are downloaded in slices of this many bytes, with a range request each
+SLICE_SIZE = 16 << 20
+# how many slices of a file to download at once
+SLICE_WORKERS = 4
+# how many bytes to read from a response at a time
+READ_SIZE = 1 << 20
+
+
+def run_download(trial_id: str, facets: List[str], dest: str):
+    """
+    Download a trial's files, or those matching any of `facets`, to `dest`.
+
+    Files are saved under `dest` at their path in CIDC's data bucket. Files
+    already there with the right size and checksum are skipped, and several
+    files are downloaded at once, each in slices with concurrent range requests.
+    A download that stops part of the way through carries on from the slices
+    it finished, next time. Each file's MD5 checksum is checked before it's
+    moved into place.
+    """
+    click.secho("> listing files via the CIDC API", dim=True)
+    files = api.list_downloadable_files(trial_id, facets)
+    if not files:
+        click.echo(f"No files of {trial_id} match.")
+        return
+
+    total = len(files)
+    done, skipped, failed = 0, 0, []
+
+    def download(file: api.DownloadableFile) -> bool:
+        """Downloads `file`, returning False if it was already present"""
+        path = _local_path(dest, file.object_url)
+        if _is_present(path, file):
+            return False
+        download_file(api.get_download_url(file.id), path, file)
+        return True
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        futures = {pool.submit(download, file): file for file in files}
+        pending = set(futures)
+        while pending:
+            # a worker thread whose token expired waits on us to prompt for one
+            api.refresh_token_if_due()
+            finished, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file = futures[future]
+                try:
+                    downloaded = future.result()
+                except Exception as e:
+                    failed.append((file, e))
+                    click.secho(f"!!! download error !!! {file.object_url}", fg="red")
+                    continue
+                done += 1
+                skipped += not downloaded
+                status = "downloaded" if downloaded else "already present"
+                click.echo(f"[{done}/{total} done] {file.object_url} {status}")
+
+    if failed:
+        click.echo(f"\nFailed to download {len(failed)} of {total} files:\n")
+        for file, e in failed:
+            click.secho(f"{file.object_url}: {e}", fg="red")
+        click.echo("\nRun the same command again to carry on where they stopped.")
+        raise click.Abort()
+
+    click.echo(
+        f"Downloaded {total - skipped} files to {dest}"
+        + (f", skipping {skipped} already there." if skipped else ".")
+    )
+
+
+def _local_path(dest: str, object_url: str) -> str:
+    """Where to save the object at `object_url` under `dest`"""
+    dest = os.path.abspath(dest)
+    path = os.path.normpath(os.path.join(dest, *object_url.split("/")))
+    if not path.startswith(dest + os.sep):
+        raise ValueError(f"{object_url} isn't a path under {dest}")
+    return path
+
+
+def _md5(path: str) -> str:
+    """A file's MD5 checksum, base64 encoded as GCS reports it"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode()
+
+
+def _is_present(path: str, file: api.DownloadableFile) -> bool:
+    """Whether `file` is already downloaded to `path`, by its size and checksum"""
+    try:
+        if os.path.getsize(path) != file.file_size_bytes:
+            return False
+    except OSError:
+        return False
+    return file.md5_hash is None or _md5(path) == file.md5_hash
+
+
+def _slices(size: int) -> List[Tuple[int, int]]:
+    """The (offset, length) of each slice of a file of `size` bytes"""
+    return [
+        (offset, min(SLICE_SIZE, size - offset))
+        for offset in range(0, size, SLICE_SIZE)
+    ]
+
+
+def _finished_slices(journal_path: str, version: str) -> Set[int]:
+    """
+    The offsets of the slices a journal records as written, if it's for this
+    `version` of the file, eg not one since replaced in GCS
+    """
+    try:
+        with open(journal_path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return set()
+    if not lines or lines[0] != version:
+        return set()
+    return {int(line) for line in lines[1:] if line.isdigit()}
+
+
+def _download_slice(url: str, f: BinaryIO, offset: int, length: int) -> None:
+    """
+    Writes bytes `offset` to `offset + length` of the object at signed `url` to
+    the same place in `f`, carrying on from where it got to if the connection drops.
+    """
+    written = 0
+    for attempt in range(transfer.MAX_ATTEMPTS):
+        start = offset + written
+        response = transfer._request(
+            "GET",
+            url,
+            signed=True,
+            headers={"Range": f"bytes={start}-{offset + length - 1}"},
+            stream=True,
+        )
+        if response.status_code != 206:
+            raise transfer.TransferError(
+                f"{response.status_code} {response.reason} for a range request"
+            )
+        try:
+            for chunk in response.iter_content(READ_SIZE):
+                f.seek(offset + written)
+                f.write(chunk)
+                written += len(chunk)
+        except requests.RequestException as e:
+            error = transfer.TransferError(f"{type(e).__name__}: {e}")
+            continue
+        finally:
+            response.close()
+        if written == length:
+            return
+        error = transfer.TransferError(f"got {written} of {length} bytes")
+    raise error
+
+
+def download_file(
+    url: str,
+    path: str,
+    file: api.DownloadableFile,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> None:
+    """
+    Downloads `file` from signed `url` to `path`, SLICE_WORKERS slices at a time.
+    Slices are written into `path`.part, and recorded in `path`.part.journal
+    once written, so an interrupted download can carry on from them.
+    """
+    size = file.file_size_bytes
+    part_path = f"{path}.part"
+    journal_path = f"{path}.part.journal"
+    version = file.md5_hash or f"size {size}"
+
+    finished = _finished_slices(journal_path, version)
+    if not finished or not os.path.exists(part_path):
+        finished = set()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(journal_path, "w") as journal:
+            journal.write(f"{version}\n")
+
+    with open(part_path, "ab") as part:
+        part.truncate(size)
+    slices = [s for s in _slices(size) if s[0] not in finished]
+    journal_lock = threading.Lock()
+    done = size - sum(length for _, length in slices)
+
+    def download_slice(offset: int, length: int):
+        nonlocal done
+        # a handle per slice, as they write to different places at once
+        with open(part_path, "r+b") as part:
+            _download_slice(url, part, offset, length)
+            part.flush()
+            # only recorded once written, so never trusted half written
+            os.fsync(part.fileno())
+        with journal_lock:
+            with open(journal_path, "a") as journal:
+                journal.write(f"{offset}\n")
+            done += length
+            if on_progress:
+                on_progress(done, size)
+
+    with ThreadPoolExecutor(max_workers=SLICE_WORKERS) as pool:
+        futures = [pool.submit(download_slice, *s) for s in slices]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # don't start any more slices after one fails
+            for future in futures:
+                future.cancel()
+            raise
+
+    if file.md5_hash is not None and _md5(part_path) != file.md5_hash:
+        os.remove(part_path)
+        os.remove(journal_path)
+        raise transfer.TransferError("checksum mismatch, so it was deleted")
+    os.replace(part_path, path)
+    os.remove(journal_path)
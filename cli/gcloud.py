@@ -1,6 +1,9 @@
 """Utilities for working with a user's gcloud installation"""
 import shutil
 import subprocess
+import threading
+import time
+from typing import Optional, Tuple
 
 import click
 
@@ -25,3 +28,46 @@ def login():
     # Try to log the user in to gcloud with their CIDC email
     click.secho("$ gcloud auth login --no-launch-browser --brief", dim=True)
     subprocess.call([GCLOUD, "auth", "login", email, "--no-launch-browser", "--brief"])
+
+
+def is_logged_in() -> bool:
+    """
+    Check, without prompting, if a user is logged in to gcloud with their CIDC email
+    and their credentials can still be refreshed.
+    """
+    email = auth.get_user_email()
+
+    try:
+        check = subprocess.run(
+            [GCLOUD, "auth", "print-access-token", email, "--quiet"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return False
+    return check.returncode == 0
+
+
+# how long to reuse an access token for, well within its hour
+ACCESS_TOKEN_TTL = 45 * 60
+
+_access_token_lock = threading.Lock()
+_access_token: Optional[Tuple[str, float]] = None
+
+
+def get_access_token(refresh: bool = False) -> str:
+    """
+    Get an OAuth access token for the user's gcloud credentials, as gsutil uses,
+    reusing it for ACCESS_TOKEN_TTL seconds unless `refresh`.
+    """
+    global _access_token
+    with _access_token_lock:
+        if refresh or not _access_token or _access_token[1] < time.time():
+            token = subprocess.run(
+                [GCLOUD, "auth", "print-access-token", auth.get_user_email()],
+                capture_output=True,
+                check=True,
+                universal_newlines=True,
+            ).stdout.strip()
+            _access_token = (token, time.time() + ACCESS_TOKEN_TTL)
+        return _access_token[0]
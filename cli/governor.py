@@ -0,0 +1,190 @@
+"""
+Sharing transfer slots and bandwidth between the `cidc` processes on a host
+
+Each file transfer holds one of MAX_HOST_TRANSFERS slots, which are lock files
+under CIDC_WORKING_DIR locked with `flock`, so that at most that many transfers
+run at once across every `cidc` process on the host. Locks are released by the
+OS when a process exits, so a crashed upload never holds on to its slots.
+Every uploading process also holds a lock file of its own, so that each can
+count the others and take no more than its fair share of the slots.
+
+Multipart uploads are also paced to their process's share of MAX_HOST_BANDWIDTH_MB.
+Where `flock` isn't available, eg on Windows, neither is limited.
+"""
+import math
+import os
+import threading
+import time
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# the most file transfers to run at once across all `cidc` processes on the host
+MAX_HOST_TRANSFERS = int(os.environ.get("CIDC_MAX_HOST_TRANSFERS", 16))
+# the most megabytes per second for multipart uploads to send, 0 for no limit
+MAX_HOST_BANDWIDTH_MB = float(os.environ.get("CIDC_MAX_HOST_BANDWIDTH_MB", 0))
+# how long to reuse a count of the uploading processes, in seconds
+PROCESS_COUNT_TTL = 5.0
+
+_current: Optional["HostGovernor"] = None
+
+
+def _governor_dir() -> str:
+    # looked up when used, so it can be changed after import
+    from .config import CIDC_WORKING_DIR
+
+    return os.path.join(CIDC_WORKING_DIR, "transfers")
+
+
+def _try_lock(path: str, exclusive: bool = True, create: bool = True) -> Optional[int]:
+    """Opens and locks `path` without waiting, returning the fd if locked"""
+    try:
+        fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o600)
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Slot:
+    """A host-wide transfer slot, held until released"""
+
+    def __init__(self, governor: "HostGovernor", fd: Optional[int]):
+        self._governor = governor
+        self._fd = fd
+
+    def release(self) -> None:
+        if self in self._governor._held:
+            self._governor._held.remove(self)
+            if self._fd is not None:
+                os.close(self._fd)
+
+
+class HostGovernor:
+    """
+    Hands out this process's transfer slots. Use as a context manager around
+    the transfers, to count this process as uploading and free its slots after.
+    """
+
+    def __init__(self, max_transfers: Optional[int] = None):
+        self.max_transfers = max_transfers or MAX_HOST_TRANSFERS
+        self._held: List[Slot] = []
+        self._process_fd: Optional[int] = None
+        self._process_count = (1, 0.0)
+        self._count_lock = threading.Lock()
+        self._pacing_lock = threading.Lock()
+        self._send_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return fcntl is not None
+
+    def __enter__(self) -> "HostGovernor":
+        global _current
+        if self.enabled:
+            os.makedirs(_governor_dir(), exist_ok=True)
+            # locked before it's moved into place, so other processes never
+            # see it unlocked and take it for a stale one
+            tmp_path = os.path.join(_governor_dir(), f".tmp_process_{os.getpid()}")
+            self._process_fd = _try_lock(tmp_path)
+            if self._process_fd is not None:
+                os.replace(tmp_path, self._process_path(os.getpid()))
+        _current = self
+        return self
+
+    def __exit__(self, *exc):
+        global _current
+        if _current is self:
+            _current = None
+        for slot in list(self._held):
+            slot.release()
+        if self._process_fd is not None:
+            try:
+                os.remove(self._process_path(os.getpid()))
+            except FileNotFoundError:
+                pass
+            os.close(self._process_fd)
+            self._process_fd = None
+
+    def _process_path(self, pid: int) -> str:
+        return os.path.join(_governor_dir(), f"process_{pid}.lock")
+
+    def uploading_processes(self) -> int:
+        """How many `cidc` processes on the host are uploading, including this one"""
+        if not self.enabled:
+            return 1
+        with self._count_lock:
+            count, counted_at = self._process_count
+            if time.time() - counted_at >= PROCESS_COUNT_TTL:
+                count = self._count_processes()
+                self._process_count = (count, time.time())
+            return count
+
+    def _count_processes(self) -> int:
+        count = 0
+        for name in os.listdir(_governor_dir()):
+            if not name.startswith("process_"):
+                continue
+            path = os.path.join(_governor_dir(), name)
+            if name == f"process_{os.getpid()}.lock":
+                count += 1
+                continue
+            # a process's lock file is only unlocked once it has exited
+            fd = _try_lock(path, exclusive=False, create=False)
+            if fd is None:
+                count += os.path.exists(path)
+                continue
+            try:
+                # unless a new process with the same pid has just replaced it
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            finally:
+                os.close(fd)
+        return max(count, 1)
+
+    def fair_share(self) -> int:
+        """The most slots this process should hold, with others uploading too"""
+        return math.ceil(self.max_transfers / self.uploading_processes())
+
+    def try_acquire(self) -> Optional[Slot]:
+        """A free transfer slot, or None if there's none or this process has its share"""
+        if not self.enabled:
+            slot = Slot(self, None)
+        elif len(self._held) >= self.fair_share():
+            return None
+        else:
+            for n in range(self.max_transfers):
+                fd = _try_lock(os.path.join(_governor_dir(), f"slot_{n}.lock"))
+                if fd is not None:
+                    break
+            else:
+                return None
+            slot = Slot(self, fd)
+        self._held.append(slot)
+        return slot
+
+    def pace(self, num_bytes: int) -> None:
+        """Waits until `num_bytes` more can be sent within this process's bandwidth"""
+        if not MAX_HOST_BANDWIDTH_MB:
+            return
+        rate = MAX_HOST_BANDWIDTH_MB * 1e6 / self.uploading_processes()
+        with self._pacing_lock:
+            now = time.time()
+            send_at = max(self._send_at, now)
+            self._send_at = send_at + num_bytes / rate
+        time.sleep(send_at - now)
+
+
+def pace(num_bytes: int) -> None:
+    """Paces sending `num_bytes` to the current `HostGovernor`'s bandwidth, if any"""
+    if _current is not None:
+        _current.pace(num_bytes)
@@ -0,0 +1,313 @@
+"""
+Splitting one upload's files between worker nodes, through a shared journal
+
+The coordinator (`cidc assays upload --shards N --journal DIR`) initiates the
+upload job, then splits its files into N shards of about equal size and writes
+them to DIR/job.json. DIR must be on a file system every worker can reach,
+and the files' paths must resolve the same on every worker, eg an NFS mount.
+Each worker (`cidc assays upload-worker --journal DIR`) claims a shard by
+creating its claim file, which only one can do, uploads its files, and writes
+the shard's result, touching its claim file all the while to show it's alive.
+Once it's done, it claims another shard, if there's one left: one nobody has
+claimed, one that failed, or one whose worker stopped touching its claim.
+Once every shard has succeeded, the coordinator completes the upload job.
+The job fails if a shard fails MAX_SHARD_ATTEMPTS times, or if nobody works
+on one for SHARD_TIMEOUT.
+"""
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+JOB_FILE = "job.json"
+# how often the coordinator checks for shards' results, in seconds
+POLL_INTERVAL = 5.0
+# how often a worker touches its claim, to show it's still uploading, in seconds
+HEARTBEAT_INTERVAL = 30.0
+# a claim untouched for this long, without a result, is from a worker that stopped
+STALE_CLAIM_AGE = 5 * 60.0
+# how many times to try each shard, across workers, before failing the upload
+MAX_SHARD_ATTEMPTS = 3
+# how long to wait for a worker to upload a shard nobody is uploading, in seconds
+SHARD_TIMEOUT = 60 * 60.0
+
+
+class ShardResult(NamedTuple):
+    """What a worker reports once it's done with its shard"""
+
+    shard: int
+    worker: str
+    uploaded: List[str]
+    error: Optional[str]
+
+
+def _path(journal_dir: str, name: str) -> str:
+    return os.path.join(journal_dir, name)
+
+
+def _write_json(path: str, data: dict) -> None:
+    # written whole then renamed, so readers never see part of it,
+    # and only readable by this user, as it can hold signed URLs
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def split(upload_pairs: List[List[str]], num_shards: int) -> List[List[List[str]]]:
+    """
+    Splits (source, destination) pairs into `num_shards` lists of about equal
+    total size, largest files first, each to the smallest shard so far.
+    Files in GCS already count as empty, and are spread by number instead.
+    """
+
+    def size(src: str) -> int:
+        return 0 if src.startswith("gs://") else os.path.getsize(src)
+
+    shards = [[] for _ in range(num_shards)]
+    totals = [0] * num_shards
+    for pair in sorted(upload_pairs, key=lambda pair: -size(pair[0])):
+        smallest = min(range(num_shards), key=lambda n: (totals[n], len(shards[n])))
+        shards[smallest].append(pair)
+        totals[smallest] += size(pair[0])
+    return shards
+
+
+def write_job(
+    journal_dir: str,
+    job_id: int,
+    shards: List[List[List[str]]],
+    optional_files: list,
+    signed_urls: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    Starts a journal for upload job `job_id`, whose files are split into `shards`.
+    Any `signed_urls` for the job are written to it too, readable only by this user.
+    """
+    os.makedirs(journal_dir, exist_ok=True)
+    _write_json(
+        _path(journal_dir, JOB_FILE),
+        {
+            "job_id": job_id,
+            "shards": shards,
+            "optional_files": optional_files,
+            "signed_urls": signed_urls,
+        },
+    )
+
+
+def read_job(journal_dir: str) -> dict:
+    """The job written by `write_job`"""
+    with open(_path(journal_dir, JOB_FILE)) as f:
+        return json.load(f)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim_path(journal_dir: str, shard: int) -> str:
+    return _path(journal_dir, f"shard_{shard}.claim")
+
+
+def _result_path(journal_dir: str, shard: int) -> str:
+    return _path(journal_dir, f"shard_{shard}.json")
+
+
+def _fs_now(journal_dir: str) -> float:
+    """
+    The time on the journal's file system, to compare claims' modification times
+    with, as other nodes' clocks may not agree with this one's
+    """
+    clock = _path(journal_dir, f".clock.{socket.gethostname()}.{os.getpid()}")
+    try:
+        with open(clock, "w"):
+            pass
+        return os.stat(clock).st_mtime
+    finally:
+        # so the journal doesn't collect one for every process that used it
+        try:
+            os.remove(clock)
+        except FileNotFoundError:
+            pass
+
+
+def attempts(journal_dir: str, shard: int) -> int:
+    """How many times a shard has been claimed"""
+    retired = glob.glob(glob.escape(_claim_path(journal_dir, shard)) + ".*")
+    return len(retired) + os.path.exists(_claim_path(journal_dir, shard))
+
+
+def read_result(journal_dir: str, shard: int) -> Optional[ShardResult]:
+    """A shard's result, if its worker has reported one"""
+    try:
+        with open(_result_path(journal_dir, shard)) as f:
+            return ShardResult(**json.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def _is_stale(journal_dir: str, shard: int, now: float) -> bool:
+    """Whether a shard's claim is from a worker that stopped without a result"""
+    try:
+        touched = os.stat(_claim_path(journal_dir, shard)).st_mtime
+    except FileNotFoundError:
+        return False
+    return now - touched > STALE_CLAIM_AGE and read_result(journal_dir, shard) is None
+
+
+def _retryable(journal_dir: str, shard: int, now: float) -> bool:
+    """Whether a claimed shard failed or was abandoned, and can be tried again"""
+    if attempts(journal_dir, shard) >= MAX_SHARD_ATTEMPTS:
+        return False
+    result = read_result(journal_dir, shard)
+    return (result is not None and result.error is not None) or _is_stale(
+        journal_dir, shard, now
+    )
+
+
+def _create_claim(journal_dir: str, shard: int) -> bool:
+    try:
+        fd = os.open(
+            _claim_path(journal_dir, shard), os.O_WRONLY | os.O_CREAT | os.O_EXCL
+        )
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(worker_name())
+    return True
+
+
+def _take_over(journal_dir: str, shard: int) -> bool:
+    """
+    Claims a shard that's been claimed before, unless another worker beats us to
+    it. Two workers may still both end up uploading a shard if one takes it over
+    just as the other does, which only costs time, as they write the same objects.
+    """
+    claim_path = _claim_path(journal_dir, shard)
+    try:
+        # only one worker can move the old claim out of the way
+        os.rename(claim_path, f"{claim_path}.{attempts(journal_dir, shard)}")
+    except FileNotFoundError:
+        return False
+    try:
+        os.remove(_result_path(journal_dir, shard))
+    except FileNotFoundError:
+        pass
+    return _create_claim(journal_dir, shard)
+
+
+def claim_shard(
+    journal_dir: str, num_shards: int, shard: Optional[int] = None
+) -> Optional[int]:
+    """
+    Claims the first shard no other worker has, or else one that failed or was
+    abandoned, returning None if there's none. Claims `shard`, if given, whatever
+    state it's in.
+    """
+    if shard is not None:
+        if _create_claim(journal_dir, shard) or _take_over(journal_dir, shard):
+            return shard
+        return None
+
+    for shard in range(num_shards):
+        if _create_claim(journal_dir, shard):
+            return shard
+    now = _fs_now(journal_dir)
+    for shard in range(num_shards):
+        if _retryable(journal_dir, shard, now) and _take_over(journal_dir, shard):
+            return shard
+    return None
+
+
+class Heartbeat:
+    """Touches a shard's claim every HEARTBEAT_INTERVAL while used as a context manager"""
+
+    def __init__(self, journal_dir: str, shard: int):
+        self._path = _claim_path(journal_dir, shard)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                os.utime(self._path)
+            except FileNotFoundError:
+                # another worker took it over
+                return
+
+
+def report(
+    journal_dir: str, shard: int, uploaded: List[str], error: Optional[str] = None
+) -> None:
+    """Records a shard's uploaded destinations, or the error that stopped it"""
+    _write_json(
+        _result_path(journal_dir, shard),
+        ShardResult(shard, worker_name(), uploaded, error)._asdict(),
+    )
+
+
+def wait_for_shards(
+    journal_dir: str,
+    num_shards: int,
+    on_result: Optional[Callable[[ShardResult], None]] = None,
+    timeout: float = SHARD_TIMEOUT,
+) -> List[ShardResult]:
+    """
+    Waits for every shard to succeed, calling `on_result` with each result as it
+    comes, including failures that workers will try again.
+    Returns as soon as a shard has failed for good, with the results so far:
+    if it failed MAX_SHARD_ATTEMPTS times, or no worker uploaded it for `timeout`.
+    """
+    seen = set()
+    # since when each shard has had nobody uploading it
+    idle_since = {}
+    while True:
+        results = {}
+        now = _fs_now(journal_dir)
+        for shard in range(num_shards):
+            result = read_result(journal_dir, shard)
+            if result is not None:
+                results[shard] = result
+                key = (result.shard, result.worker, result.error)
+                if key not in seen:
+                    seen.add(key)
+                    if on_result:
+                        on_result(result)
+                if result.error is None:
+                    continue
+                if attempts(journal_dir, shard) >= MAX_SHARD_ATTEMPTS:
+                    return list(results.values())
+            uploading = (
+                os.path.exists(_claim_path(journal_dir, shard))
+                and result is None
+                and not _is_stale(journal_dir, shard, now)
+            )
+            if uploading:
+                idle_since.pop(shard, None)
+            elif time.time() - idle_since.setdefault(shard, time.time()) > timeout:
+                results[shard] = ShardResult(
+                    shard,
+                    "",
+                    [],
+                    f"no worker uploaded it for {timeout / 60:.0f} minutes",
+                )
+                return list(results.values())
+
+        if len(results) == num_shards and all(
+            result.error is None for result in results.values()
+        ):
+            return [results[shard] for shard in range(num_shards)]
+        time.sleep(POLL_INTERVAL)
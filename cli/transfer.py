@@ -0,0 +1,525 @@
+"""
+Uploads of large local files to GCS in parts, without composite objects
+
+Files of at least MULTIPART_THRESHOLD bytes are uploaded through the XML API's
+multipart uploads: the file is split into parts that are uploaded concurrently,
+each retried on its own, then joined by GCS into an ordinary object. Unlike
+gsutil's parallel composite uploads, the result isn't a composite object, so it
+downloads like any other.
+
+Uses the user's gcloud credentials, as gsutil does.
+If STORAGE_EMULATOR_HOST is set, requests go there without credentials instead.
+
+When the API signs upload URLs for a job, local files are instead uploaded with
+resumable uploads started from those URLs, which need no credentials, and so
+no gcloud at all.
+"""
+import base64
+import hashlib
+import math
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote
+from xml.etree import ElementTree
+
+import requests
+
+from . import gcloud, governor
+
+# files at least this many bytes are uploaded in parts, 0 to never
+MULTIPART_THRESHOLD = int(os.environ.get("CIDC_MULTIPART_THRESHOLD_MB", 1024)) << 20
+# the size of each part, raised if needed to stay within MAX_PARTS
+PART_SIZE = 32 << 20
+MAX_PARTS = 10_000
+# how many parts of a file to upload at once
+PART_WORKERS = 4
+# how many parts of a file to read ahead of those being uploaded
+READ_AHEAD_PARTS = 2
+# how many parts to hold in memory at once, across all files
+MAX_PARTS_IN_FLIGHT = 16
+# how many times to try each request, waiting up to RETRY_BACKOFF * 2 ** attempt between
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 1.0
+RETRY_STATUSES = {401, 408, 429, 500, 502, 503, 504}
+# how much of a file to send in each request of a resumable upload,
+# a multiple of the 256 KiB GCS requires
+RESUMABLE_CHUNK_SIZE = 32 << 20
+
+GCS_HOST = "https://storage.googleapis.com"
+
+_local = threading.local()
+_parts_in_flight = threading.BoundedSemaphore(MAX_PARTS_IN_FLIGHT)
+
+
+class TransferError(Exception):
+    pass
+
+
+def _host() -> str:
+    return os.environ.get("STORAGE_EMULATOR_HOST", GCS_HOST).rstrip("/")
+
+
+def _session() -> requests.Session:
+    if getattr(_local, "session", None) is None:
+        _local.session = requests.Session()
+    return _local.session
+
+
+def _auth_headers(refresh: bool = False) -> dict:
+    if "STORAGE_EMULATOR_HOST" in os.environ:
+        return {}
+    return {"Authorization": f"Bearer {gcloud.get_access_token(refresh)}"}
+
+
+def _object_url(gs_uri: str) -> str:
+    bucket, name = gs_uri[len("gs://") :].split("/", 1)
+    return f"{_host()}/{bucket}/{quote(name, safe='/')}"
+
+
+def _request(
+    method: str, url: str, signed: bool = False, **kwargs
+) -> requests.Response:
+    """
+    Makes an XML API request, retrying throttled / failed ones with backoff.
+    `signed` URLs carry their own authorization, so are sent without credentials.
+    """
+    headers = kwargs.pop("headers", {})
+    if signed:
+        # a resumable upload's 308s aren't redirects
+        kwargs.setdefault("allow_redirects", False)
+    refresh_token = False
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
+        try:
+            response = _session().request(
+                method,
+                url,
+                headers={
+                    **headers,
+                    **({} if signed else _auth_headers(refresh_token)),
+                },
+                **kwargs,
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = TransferError(f"{type(e).__name__}: {e}")
+            continue
+        if response.ok:
+            return response
+        error = TransferError(f"{response.status_code} {response.reason}")
+        if response.status_code not in RETRY_STATUSES or (
+            signed and response.status_code == 401
+        ):
+            break
+        # the access token may have expired
+        refresh_token = response.status_code == 401
+    raise error
+
+
+def should_upload_in_parts(src: str) -> bool:
+    """Whether `src` is a local file big enough to upload in parts"""
+    return (
+        MULTIPART_THRESHOLD > 0
+        and not src.startswith("gs://")
+        and os.path.getsize(src) >= MULTIPART_THRESHOLD
+    )
+
+
+def _parts(size: int) -> List[Tuple[int, int, int]]:
+    """The (part number, offset, length) of each part of a file of `size` bytes"""
+    part_size = max(PART_SIZE, math.ceil(size / MAX_PARTS))
+    return [
+        (n + 1, offset, min(part_size, size - offset))
+        for n, offset in enumerate(range(0, max(size, 1), part_size))
+    ]
+
+
+def _fadvise(fd: int, offset: int, length: int, advice: str) -> None:
+    """Advise the kernel how a file will be read, where supported"""
+    if hasattr(os, "posix_fadvise") and hasattr(os, advice):
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+
+
+class _PartReader:
+    """
+    Reads a file's parts in order on a dedicated I/O thread, up to READ_AHEAD_PARTS
+    ahead of the threads sending them, so that disk reads and network sends overlap.
+    Parts start at multiples of the part size, so reads are large and page aligned,
+    and each is dropped from the page cache once read, as it won't be read again.
+    Every part taken with `get` holds a slot of `_parts_in_flight` until `release`d.
+    """
+
+    def __init__(self, src: str, parts: List[Tuple[int, int, int]]):
+        self.error: Optional[Exception] = None
+        self._parts = parts
+        self._src = src
+        self._queue = queue.Queue(maxsize=READ_AHEAD_PARTS)
+        self._done = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with open(self._src, "rb", buffering=0) as f:
+                fd = f.fileno()
+                _fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+                for part in self._parts:
+                    _, offset, length = part
+                    _parts_in_flight.acquire()
+                    try:
+                        f.seek(offset)
+                        chunks, remaining = [], length
+                        while remaining:
+                            chunk = f.read(remaining)
+                            if not chunk:
+                                raise TransferError(
+                                    f"{self._src} changed while reading"
+                                )
+                            chunks.append(chunk)
+                            remaining -= len(chunk)
+                        data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+                        _fadvise(fd, offset, length, "POSIX_FADV_DONTNEED")
+                        while not self._stopped.is_set():
+                            try:
+                                self._queue.put((part, data), timeout=0.1)
+                                break
+                            except queue.Full:
+                                pass
+                        else:
+                            _parts_in_flight.release()
+                            return
+                    except BaseException:
+                        _parts_in_flight.release()
+                        raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def get(self) -> Optional[Tuple[Tuple[int, int, int], bytes]]:
+        """The next part and its data, or None once all are read or it's stopped"""
+        while not self._stopped.is_set():
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._done.is_set() and self._queue.empty():
+                    return None
+        return None
+
+    def release(self) -> None:
+        """Frees the slot of a part from `get` once sent"""
+        _parts_in_flight.release()
+
+    def stop(self) -> None:
+        """Stops reading, freeing the slots of any parts not yet taken"""
+        self._stopped.set()
+        self._thread.join()
+        while not self._queue.empty():
+            self._queue.get()
+            _parts_in_flight.release()
+
+
+def _upload_part(
+    url: str, upload_id: str, part: Tuple[int, int, int], data: bytes
+) -> str:
+    """Uploads a part, returning its ETag"""
+    part_number, _, _ = part
+    md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+    governor.pace(len(data))
+    try:
+        response = _request(
+            "PUT",
+            url,
+            params={"partNumber": part_number, "uploadId": upload_id},
+            headers={"Content-MD5": md5},
+            data=data,
+        )
+    except TransferError as e:
+        raise TransferError(f"{e} uploading part {part_number}") from e
+    return response.headers["ETag"]
+
+
+def upload_in_parts(
+    src: str,
+    dst: str,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[threading.Event] = None,
+) -> None:
+    """
+    Uploads local file `src` to `gs://bucket/object` URI `dst` with a multipart
+    upload, PART_WORKERS parts at a time as they're read ahead by a `_PartReader`,
+    calling `on_progress(bytes done, total)` as parts finish.
+    Aborts the upload if any part fails or `cancelled` is set.
+    """
+    url = _object_url(dst)
+    size = os.path.getsize(src)
+    parts = _parts(size)
+    cancelled = cancelled or threading.Event()
+
+    response = _request("POST", url + "?uploads", data=b"")
+    upload_id = next(
+        el.text
+        for el in ElementTree.fromstring(response.content).iter()
+        if el.tag.endswith("UploadId")
+    )
+
+    etags = [None] * len(parts)
+    progress_lock = threading.Lock()
+    done = 0
+
+    def send_parts(reader: _PartReader):
+        nonlocal done
+        while not cancelled.is_set():
+            item = reader.get()
+            if item is None:
+                return
+            part, data = item
+            try:
+                etags[part[0] - 1] = _upload_part(url, upload_id, part, data)
+            finally:
+                reader.release()
+            with progress_lock:
+                done += part[2]
+                if on_progress:
+                    on_progress(done, size)
+
+    reader = _PartReader(src, parts)
+    try:
+        with ThreadPoolExecutor(max_workers=PART_WORKERS) as pool:
+            senders = [pool.submit(send_parts, reader) for _ in range(PART_WORKERS)]
+            finished, _ = wait(senders, return_when=FIRST_EXCEPTION)
+            for sender in finished:
+                # stop the other senders on the first failure
+                if sender.exception():
+                    cancelled.set()
+                    raise sender.exception()
+        reader.stop()
+        if reader.error:
+            raise reader.error
+        if cancelled.is_set():
+            raise TransferError("upload cancelled")
+
+        parts_xml = "".join(
+            f"<Part><PartNumber>{n}</PartNumber><ETag>{etag}</ETag></Part>"
+            for n, etag in enumerate(etags, start=1)
+        )
+        _request(
+            "POST",
+            url,
+            params={"uploadId": upload_id},
+            data=f"<CompleteMultipartUpload>{parts_xml}</CompleteMultipartUpload>",
+        )
+    except BaseException:
+        reader.stop()
+        try:
+            _request("DELETE", url, params={"uploadId": upload_id})
+        except TransferError:
+            pass
+        raise
+
+
+def _resumable_offset(response: requests.Response) -> int:
+    """How many bytes a resumable upload has persisted, from a 308's Range header"""
+    persisted = response.headers.get("Range")
+    return int(persisted.rsplit("-", 1)[1]) + 1 if persisted else 0
+
+
+def upload_resumable(
+    src: str,
+    signed_url: str,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[threading.Event] = None,
+) -> None:
+    """
+    Uploads local file `src` with a resumable upload started from `signed_url`,
+    sending RESUMABLE_CHUNK_SIZE bytes at a time and calling
+    `on_progress(bytes done, total)` after each. After a failed chunk, asks GCS
+    how much it has persisted and carries on from there.
+    Cancels the upload if a chunk keeps failing or `cancelled` is set.
+    """
+    size = os.path.getsize(src)
+    cancelled = cancelled or threading.Event()
+
+    response = _request(
+        "POST", signed_url, signed=True, headers={"x-goog-resumable": "start"}
+    )
+    # the session URI is its own authorization, valid for a week
+    session_url = response.headers["Location"]
+
+    offset = 0
+    try:
+        with open(src, "rb") as f:
+            _fadvise(f.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+            while True:
+                if cancelled.is_set():
+                    raise TransferError("upload cancelled")
+                f.seek(offset)
+                data = f.read(RESUMABLE_CHUNK_SIZE)
+                if offset + len(data) < size and len(data) < RESUMABLE_CHUNK_SIZE:
+                    raise TransferError(f"{src} changed while reading")
+                content_range = (
+                    f"bytes {offset}-{offset + len(data) - 1}/{size}"
+                    if data
+                    else f"bytes */{size}"
+                )
+                governor.pace(len(data))
+                try:
+                    response = _request(
+                        "PUT",
+                        session_url,
+                        signed=True,
+                        headers={"Content-Range": content_range},
+                        data=data,
+                    )
+                except TransferError as e:
+                    # find out how much got through, then try from there
+                    response = _request(
+                        "PUT",
+                        session_url,
+                        signed=True,
+                        headers={"Content-Range": f"bytes */{size}"},
+                    )
+                    if (
+                        response.status_code == 308
+                        and _resumable_offset(response) <= offset
+                    ):
+                        raise e
+                if response.status_code != 308:
+                    break
+                persisted = _resumable_offset(response)
+                if persisted <= offset and data:
+                    raise TransferError(
+                        f"no progress uploading bytes {content_range[6:]}"
+                    )
+                offset = persisted
+                if on_progress:
+                    on_progress(offset, size)
+    except BaseException:
+        try:
+            _request("DELETE", session_url, signed=True)
+        except TransferError:
+            pass
+        raise
+    if on_progress:
+        on_progress(size, size)
+
+
+def _human_size(num_bytes: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TiB"
+
+
+class _Lines:
+    """Stands in for a subprocess's stderr pipe, written to by another thread"""
+
+    # how long readline waits for a line, so callers can check on other uploads
+    READLINE_TIMEOUT = 1.0
+
+    def __init__(self):
+        self._lines = queue.Queue()
+
+    def write(self, line: str) -> None:
+        self._lines.put(line)
+
+    def readline(self) -> str:
+        try:
+            return self._lines.get(timeout=self.READLINE_TIMEOUT)
+        except queue.Empty:
+            return ""
+
+    def close(self) -> None:
+        pass
+
+
+class _BackgroundUpload:
+    """
+    Runs `upload(on_progress, cancelled)` in a background thread, looking like the
+    `gsutil cp` subprocess.Popen that `upload._wait_for_upload` watches: progress
+    is written to `stderr` in gsutil's format, and errors as its last line.
+    """
+
+    def __init__(
+        self,
+        command: str,
+        src: str,
+        dst: str,
+        upload: Callable[[Callable[[int, int], None], threading.Event], None],
+    ):
+        self.args = [command, src, dst]
+        self.returncode = None
+        # set by the thread, and only read once it's joined
+        self._result: Optional[int] = None
+        self.stderr = _Lines()
+        self._upload = upload
+        self._cancelled = threading.Event()
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _progress(self, done: int, total: int) -> None:
+        rate = done / max(time.time() - self._started, 1e-3)
+        self.stderr.write(
+            f"[0/1 files][{_human_size(done)}/{_human_size(total)}] "
+            f"{100 * done / max(total, 1):3.0f}% Done {_human_size(rate)}/s\n"
+        )
+
+    def _run(self):
+        try:
+            self._upload(self._progress, self._cancelled)
+        except Exception as e:
+            self.stderr.write(f"{type(self).__name__}Exception: {e}\n")
+            self._result = 1
+        else:
+            self._result = 0
+
+    def poll(self) -> Optional[int]:
+        # like Popen, only sets returncode once the upload is over, after joining
+        # the thread, so an error just as it finishes isn't read as a success
+        if self.returncode is None and not self._thread.is_alive():
+            self.wait()
+        return self.returncode
+
+    def wait(self) -> int:
+        self._thread.join()
+        self.returncode = self._result
+        return self.returncode
+
+    def kill(self) -> None:
+        self._cancelled.set()
+
+
+class MultipartUpload(_BackgroundUpload):
+    """Uploads local file `src` to `dst` in parts with `upload_in_parts`"""
+
+    def __init__(self, src: str, dst: str):
+        super().__init__(
+            "upload_in_parts",
+            src,
+            dst,
+            lambda on_progress, cancelled: upload_in_parts(
+                src, dst, on_progress, cancelled
+            ),
+        )
+
+
+class SignedUrlUpload(_BackgroundUpload):
+    """Uploads local file `src` to `dst` with `upload_resumable` from `signed_url`"""
+
+    def __init__(self, src: str, dst: str, signed_url: str):
+        super().__init__(
+            "upload_resumable",
+            src,
+            dst,
+            lambda on_progress, cancelled: upload_resumable(
+                src, signed_url, on_progress, cancelled
+            ),
+        )
@@ -1,80 +1,256 @@
 """Upload local files to CIDC's upload bucket"""
 import os
+import random
+import re
 import time
 import subprocess
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime
-from typing import BinaryIO, Dict, Generator, List, Optional, Tuple
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from xml.etree import ElementTree
 
 import click
 
 from . import api
 from . import gcloud
+from . import governor
+from . import shards
+from . import transfer
 
 
-def run_upload(upload_type: str, xlsx_path: str, is_analysis: bool = False):
+def run_upload(
+    upload_type: str,
+    xlsx_path: str,
+    is_analysis: bool = False,
+    journal_dir: Optional[str] = None,
+    num_shards: int = 1,
+):
     """
     Upload data.
 
     Orchestrator execution flow:
-    1. Log in to gcloud. The CLI user must be authenticated with
-       gcloud to be able to upload to GCS.
-    2. Make an initiate_upload request to the API. The API adds a
+    1. Make an initiate_upload request to the API. The API adds a
        record to the database tracking that the CLI user started an
        upload job, grants the CLI user write permissions to the CIDC
        upload bucket in GCS, and returns information needed to
        carry out the gsutil upload (like a mapping from local file paths
        to GCS URIs).
-    3. Carry out the gsutil upload using the returned upload info.
+       While that request is in flight, check in the background whether
+       the CLI user is logged in to gcloud and which of the paths in the
+       .xlsx file are local files.
+    2. Log in to gcloud, if not already. The CLI user must be authenticated
+       with gcloud to be able to upload to GCS with gsutil, unless the API
+       signed upload URLs for all the local files and there are no GCS ones.
+    3. Carry out the gsutil upload using the returned upload info,
+       skipping the checks for files already found in step 1.
+       With a `journal_dir`, split the files into `num_shards` shards there
+       instead, and wait for workers (see `run_upload_worker`) to upload them.
     4. If the gsutil upload fails, alert the api that the job failed.
        Else, if the upload succeeds, alert the api that the job was
        successful.
+    Throughout, the CLI user is asked in the background for a fresh ID token
+    shortly before theirs expires, so the API calls in steps 3 and 4 don't stop
+    the upload to prompt for one.
     """
-    # Log in to gcloud (required for gsutil to work)
-    gcloud.login()
+    # Ask for a fresh ID token ahead of its expiry, without stopping transfers
+    with api.TokenRefresher():
+        # Local checks don't need the API, so overlap them with its request
+        preflight_pool = ThreadPoolExecutor(max_workers=2)
+        logged_in = preflight_pool.submit(gcloud.is_logged_in)
+        local_files = preflight_pool.submit(_preflight, xlsx_path)
+        preflight_pool.shutdown(wait=False)
+
+        try:
+            click.secho("> preparing upload job via the CIDC API", dim=True)
+            # Read the .xlsx file and make the API call
+            # that initiates the upload job and grants object-level GCS access.
+            with open(xlsx_path, "rb") as xlsx_file:
+                upload_info = api.initiate_upload(upload_type, xlsx_file, is_analysis)
+
+            # Log in to gcloud (required for gsutil to work)
+            if _needs_gcloud(upload_info.url_mapping.items(), upload_info.signed_urls):
+                gcloud.check_installed()
+                if not logged_in.result():
+                    gcloud.login()
+
+        except (Exception, KeyboardInterrupt) as e:
+            _handle_upload_exc(e)
+
+        try:
+            # Insert extra metadata for the upload, if any
+            if upload_info.extra_metadata:
+                click.secho(
+                    f"> pulling additional metadata from files staged for upload",
+                    dim=True,
+                )
+                with _open_file_mapping(
+                    upload_info.extra_metadata, xlsx_path
+                ) as open_files:
+                    api.insert_extra_metadata(upload_info.job_id, open_files)
+
+            # Actually upload the assay data
+            click.secho(f"> initiating GCS upload", dim=True)
+            if journal_dir:
+                gcs_file_map = _sharded_upload(
+                    upload_info,
+                    xlsx_path,
+                    journal_dir,
+                    num_shards,
+                    local_files.result(),
+                )
+            else:
+                gcs_file_map = _gsutil_assay_upload(
+                    upload_info, xlsx_path, local_files.result()
+                )
+        except (Exception, KeyboardInterrupt) as e:
+            # we need to notify api of a failed upload
+            api.upload_failed(
+                upload_info.job_id,
+                upload_info.token,
+                upload_info.job_etag,
+                upload_info.gcs_file_map,
+            )
+            _handle_upload_exc(e)
+            # _handle_upload_exc should raise, but raise for good measure
+            raise
+        else:
+            api.upload_succeeded(
+                upload_info.job_id,
+                upload_info.token,
+                upload_info.job_etag,
+                gcs_file_map,
+            )
 
+        click.secho("> finalizing upload via the CIDC API", dim=True)
+        _poll_for_upload_completion(upload_info.job_id, upload_info.token)
+
+
+# how many local directories to check at once
+FILE_CHECK_WORKERS = 16
+# directories with fewer paths to check than this are checked path by path,
+# rather than listing what could be a very large directory
+SCANDIR_MIN_PATHS = 4
+
+
+def _manifest_strings(xlsx_path: str) -> List[str]:
+    """
+    The text of every string cell in an .xlsx file, read from its shared strings
+    without parsing the workbook. Empty if it can't be read as an .xlsx file.
+    """
+    strings = []
     try:
-        click.secho("> preparing upload job via the CIDC API", dim=True)
-        # Read the .xlsx file and make the API call
-        # that initiates the upload job and grants object-level GCS access.
-        with open(xlsx_path, "rb") as xlsx_file:
-            upload_info = api.initiate_upload(upload_type, xlsx_file, is_analysis)
+        with zipfile.ZipFile(xlsx_path) as xlsx:
+            with xlsx.open("xl/sharedStrings.xml") as shared_strings:
+                for _, el in ElementTree.iterparse(shared_strings):
+                    # a string is an <si>, of one <t> or several rich text runs
+                    if el.tag.endswith("}si"):
+                        text = "".join(
+                            t.text or "" for t in el.iter() if t.tag.endswith("}t")
+                        )
+                        strings.append(text)
+                        el.clear()
+    except (KeyError, OSError, zipfile.BadZipFile, ElementTree.ParseError):
+        return []
+    return strings
+
+
+# a file name ending in an extension, eg .bam or .fastq.gz, but not .00 as in a cimac_id
+_FILE_NAME = re.compile(r".*\.[A-Za-z][A-Za-z0-9]*")
+
+
+def _is_local_path(s: str) -> bool:
+    """
+    Whether a manifest string looks like the path of a local file to upload,
+    rather than a GCS or other URI, or any other value like an id or a date
+    """
+    return (
+        "://" not in s
+        and not any(c in s for c in "\n\r\t")
+        and _FILE_NAME.fullmatch(os.path.basename(s)) is not None
+    )
+
+
+def _preflight(xlsx_path: str) -> Set[str]:
+    """
+    Returns the strings in an .xlsx file that are paths to local files, resolved
+    against the .xlsx file's directory as in `_compose_file_mapping`.
+    Only strings that look like local file paths are checked, so ids, dates,
+    free text and gs:// URIs don't cost a file system call each.
+    This doesn't need the API, so it runs while the initiate_upload request is
+    in flight, and `_compose_file_mapping` only checks paths not found here.
+    """
+    xlsx_dir = os.path.abspath(os.path.dirname(xlsx_path))
+    return _find_local_files(
+        os.path.join(xlsx_dir, s)
+        for s in _manifest_strings(xlsx_path)
+        if _is_local_path(s)
+    )
 
-    except (Exception, KeyboardInterrupt) as e:
-        _handle_upload_exc(e)
 
+def _find_files_in_dir(directory: str, paths: List[str]) -> List[str]:
+    """
+    Which of `paths`, all in `directory`, are files. Paths not in the directory's
+    listing aren't files, and are reported missing with their names as listed,
+    so they have to match case even on case-insensitive file systems.
+    """
+    if len(paths) < SCANDIR_MIN_PATHS:
+        return [path for path in paths if os.path.isfile(path)]
     try:
-        # Insert extra metadata for the upload, if any
-        if upload_info.extra_metadata:
-            click.secho(
-                f"> pulling additional metadata from files staged for upload", dim=True
-            )
-            with _open_file_mapping(
-                upload_info.extra_metadata, xlsx_path
-            ) as open_files:
-                api.insert_extra_metadata(upload_info.job_id, open_files)
-
-        # Actually upload the assay data
-        click.secho(f"> initiating GCS upload", dim=True)
-        gcs_file_map = _gsutil_assay_upload(upload_info, xlsx_path)
-    except (Exception, KeyboardInterrupt) as e:
-        # we need to notify api of a failed upload
-        api.upload_failed(
-            upload_info.job_id,
-            upload_info.token,
-            upload_info.job_etag,
-            upload_info.gcs_file_map,
-        )
-        _handle_upload_exc(e)
-        # _handle_upload_exc should raise, but raise for good measure
-        raise
-    else:
-        api.upload_succeeded(
-            upload_info.job_id, upload_info.token, upload_info.job_etag, gcs_file_map
+        # one listing instead of a metadata round trip per path,
+        # which is slow on network file systems
+        with os.scandir(directory) as entries:
+            names = {entry.name for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return []
+    except OSError:
+        # eg not allowed to list it, but maybe to read its files
+        return [path for path in paths if os.path.isfile(path)]
+    return [path for path in paths if os.path.basename(path) in names]
+
+
+def _find_local_files(paths: Iterable[str]) -> Set[str]:
+    """
+    Returns which of `paths` are files, checking each directory once
+    and several directories at a time.
+    """
+    by_dir = defaultdict(list)
+    for path in set(paths):
+        by_dir[os.path.dirname(path)].append(path)
+
+    with ThreadPoolExecutor(max_workers=FILE_CHECK_WORKERS) as pool:
+        found = pool.map(lambda item: _find_files_in_dir(*item), by_dir.items())
+        return {path for dir_found in found for path in dir_found}
+
+
+def _suffix_matcher(suffixes: Iterable[str]) -> Callable[[str], bool]:
+    """
+    Returns a function checking if a path ends with any of `suffixes`,
+    with a lookup per distinct suffix length rather than per suffix.
+    """
+    suffixes = set(suffixes)
+    lengths = {len(suffix) for suffix in suffixes}
+
+    def matches(path: str) -> bool:
+        return any(
+            path[len(path) - length :] in suffixes
+            for length in lengths
+            if length <= len(path)
         )
 
-    click.secho("> finalizing upload via the CIDC API", dim=True)
-    _poll_for_upload_completion(upload_info.job_id, upload_info.token)
+    return matches
 
 
 @contextmanager
@@ -113,6 +289,7 @@ def _open_file_mapping(extra_metadata: dict, base_path: str) -> Dict[str, Binary
 # We don't want them to see that or enable `parallel_composite_upload_threshold`
 # because composite files are problematic to download - see:
 # https://cloud.google.com/storage/docs/gsutil/commands/cp#parallel-composite-uploads
+# Large files are instead uploaded in parts by `transfer.MultipartUpload`.
 _IGNORED_WARN_LINES = set(
     map(
         str.strip,
@@ -133,9 +310,33 @@ so slow that gsutil disables downloads of composite objects.""".split(
 )
 
 
-def _start_procs(src_dst_pairs: list) -> Generator[subprocess.Popen, None, None]:
+def _object_name(gcs_uri: str) -> str:
+    """The object name of a gs://bucket/object URI"""
+    return gcs_uri.split("/", 3)[3]
+
+
+def _needs_gcloud(
+    sources: Iterable[Tuple[str, str]], signed_urls: Optional[Dict[str, str]]
+) -> bool:
     """
-    Starts multiple "gsutil cp" subprocesses.
+    Whether any of (source, object name) `sources` will be uploaded with gsutil:
+    files already in GCS, and local files without a signed URL
+    """
+    if signed_urls is None:
+        return True
+    return any(
+        src.startswith("gs://") or name not in signed_urls for src, name in sources
+    )
+
+
+def _start_procs(
+    src_dst_pairs: list, signed_urls: Optional[Dict[str, str]] = None
+) -> Generator[subprocess.Popen, None, None]:
+    """
+    Starts multiple "gsutil cp" subprocesses, or for local files with a URL in
+    `signed_urls`, by object name, `transfer.SignedUrlUpload`s, and for other
+    local files of at least `transfer.MULTIPART_THRESHOLD` bytes,
+    `transfer.MultipartUpload`s.
 
     src_dst_pairs: a list of tuples (local file path, target GCS path)
 
@@ -155,14 +356,21 @@ def _start_procs(src_dst_pairs: list) -> Generator[subprocess.Popen, None, None]
         gsutil_args = ["gsutil", "cp", src, dst]
 
         try:
-            # Run the upload command
-            p = subprocess.Popen(
-                gsutil_args,
-                universal_newlines=True,
-                bufsize=1,  # line buffered so we can read output line by line
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-            )
+            # Run the upload command, or upload a file from its signed URL,
+            # or upload a big file in parts
+            signed_url = (signed_urls or {}).get(_object_name(dst))
+            if signed_url and not src.startswith("gs://"):
+                p = transfer.SignedUrlUpload(src, dst, signed_url)
+            elif transfer.should_upload_in_parts(src):
+                p = transfer.MultipartUpload(src, dst)
+            else:
+                p = subprocess.Popen(
+                    gsutil_args,
+                    universal_newlines=True,
+                    bufsize=1,  # line buffered so we can read output line by line
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                )
             procs.append(p)
             yield p
 
@@ -180,30 +388,39 @@ def _start_procs(src_dst_pairs: list) -> Generator[subprocess.Popen, None, None]
 
 
 def _wait_for_upload(
-    procs: list, total: int, optional_files: List[str]
-) -> Optional[str]:
+    procs: list, total: int, optional_files: List[str], until: Optional[float] = None
+) -> Dict[int, str]:
     """
     Waits for all subprocesses and click.echos their stderr streams.
-    Returns Optional[str] - an error message if an error has occurred during any if uploads
+    Returns Dict[int, str] - the error message of each upload that failed, by its
+    index in `procs`, as soon as any have failed. Empty once all have succeeded,
+    or if it's `until` (a `time.time()`) before then.
+    `procs` has None for uploads waiting to be retried, which are skipped.
     """
 
     # First we account all already successfully finished procs
-    finished = set([i for i, p in enumerate(procs) if p.poll() == 0])
+    finished = set([i for i, p in enumerate(procs) if p is None or p.poll() == 0])
+    done = len([p for p in procs if p is not None and p.poll() == 0])
 
-    error = None
+    errors = {}
 
     # GCS upload errors are generally spread across two lines.
     # Since we consume stderr one line at a time will polling upload processes,
     # we need to save the previous stderr line for each process in order
     # to reconstruct a full GCS upload error.
     prev_errlines = {}
-    while len(finished) != len(procs) and not error:
+    while len(finished) != len(procs) and not errors:
+        if until is not None and time.time() >= until:
+            break
+        # prompting here, if need be, as threads can't
+        api.refresh_token_if_due()
+
         for i, p in enumerate(procs):
             if i in finished:
                 continue
 
             # start building user feedback for this process
-            message = f"[{len(finished)}/{total} done] "
+            message = f"[{done}/{total} done] "
             message += click.style(f"(file {i + 1}) ", fg="bright_blue")
 
             # read stderr for this process
@@ -218,8 +435,9 @@ def _wait_for_upload(
                     message += p.args[-2]
                     click.echo(message)
                     # Reconstruct multiline GCS error message
-                    error = f"{prev_errlines.get(i, '')}{errline}"
+                    errors[i] = f"{prev_errlines.get(i, '')}{errline}"
                     break
+                done += 1
 
             # skipping "large file" warnings
             if errline.strip() in _IGNORED_WARN_LINES:
@@ -240,58 +458,125 @@ def _wait_for_upload(
                 # so save it.
                 prev_errlines[i] = errline
 
-    return error
+    return errors
 
 
 # default from `gsutil -m` but maybe better to load from env
 MAX_GSUTIL_PARALLEL_PROCESS = 12
 
+# how often to check for a free host-wide transfer slot, in seconds
+SLOT_POLL_INTERVAL = 5.0
+
+# how many times to try each file's upload before failing the job
+MAX_UPLOAD_ATTEMPTS = 5
+# the delay before the first retry in seconds, doubling for each after
+UPLOAD_RETRY_BACKOFF = 2.0
+UPLOAD_RETRY_MAX_BACKOFF = 60.0
+
+# gsutil errors that trying again won't fix, when they don't give an HTTP status
+_PERMANENT_ERRORS = (
+    "AccessDeniedException",
+    "NotFoundException",
+    "CommandException",
+    "No such file or directory",
+)
+
+
+def _is_retryable(error: str) -> bool:
+    """Whether a failed upload's error message is likely to be transient"""
+    status = re.search(r"\b([45]\d\d)\b", error)
+    if status:
+        code = int(status.group(1))
+        return code in (408, 429) or code >= 500
+    return not any(permanent in error for permanent in _PERMANENT_ERRORS)
+
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter before retrying after `attempt` tries"""
+    backoff = min(UPLOAD_RETRY_MAX_BACKOFF, UPLOAD_RETRY_BACKOFF * 2 ** (attempt - 1))
+    return random.uniform(0, backoff)
+
 
-def _gsutil_assay_upload(upload_info: api.UploadInfo, xlsx: str) -> Dict[str, str]:
+def _gsutil_assay_upload(
+    upload_info: api.UploadInfo, xlsx: str, local_files: Optional[Set[str]] = None
+) -> Dict[str, str]:
     """
     Upload local assay data to GCS using gsutil.
     Return modified GCS file map with missing files removed
+    `local_files` are paths already known to be files, eg from `_preflight`
     """
 
-    upload_pairs, skipping = _compose_file_mapping(upload_info, xlsx)
-    file_count = len(upload_pairs)
+    upload_pairs, skipping = _compose_file_mapping(upload_info, xlsx, local_files)
     for s in skipping:
         upload_info.gcs_file_map.pop(s, "")
 
-    proc_iter = _start_procs(upload_pairs)
-    procs = []
-    all_uploads_have_run = False
-    while not all_uploads_have_run:
+    _upload_files(upload_pairs, upload_info.optional_files, upload_info.signed_urls)
 
-        # Here we start with just 1 parallel process and gradually
-        # increase that to MAX_GSUTIL_PARALLEL_PROCESS doubling the number every time.
-        try:
-            current_count = len(procs) or 1  # 1 is for starters
-            how_many_to_add = min(current_count, MAX_GSUTIL_PARALLEL_PROCESS)
-            for _ in range(how_many_to_add):
-                procs.append(next(proc_iter))
-        except StopIteration:
-            all_uploads_have_run = True
+    file_count = len(upload_pairs)
+    click.echo(
+        f"[{file_count}/{file_count} done] All files uploaded to GCS and staged for ingestion."
+    )
 
-        err = _wait_for_upload(procs, file_count, upload_info.optional_files)
+    return upload_info.gcs_file_map
 
-        if err:
-            for p in procs:
 
-                if p.poll() != 0:
+def _sharded_upload(
+    upload_info: api.UploadInfo,
+    xlsx: str,
+    journal_dir: str,
+    num_shards: int,
+    local_files: Optional[Set[str]] = None,
+) -> Dict[str, str]:
+    """
+    Splits the upload's files into `num_shards` shards in `journal_dir`, and waits
+    for workers to upload them all. Returns the GCS file map, as `_gsutil_assay_upload`.
+    """
+    upload_pairs, skipping = _compose_file_mapping(upload_info, xlsx, local_files)
+    for s in skipping:
+        upload_info.gcs_file_map.pop(s, "")
 
-                    # stopping all other processes
-                    for other_p in procs:
-                        if p != other_p:
-                            other_p.kill()
+    shards.write_job(
+        journal_dir,
+        upload_info.job_id,
+        shards.split(upload_pairs, num_shards),
+        upload_info.optional_files,
+        upload_info.signed_urls,
+    )
+    click.echo(
+        f"Split {len(upload_pairs)} files into {num_shards} shards. To upload them, "
+        f"run this on up to {num_shards} nodes that can reach the files:\n"
+        f"  cidc [assays|analyses] upload-worker --journal {os.path.abspath(journal_dir)}"
+    )
 
-                    click.echo(
-                        f"\nGCS upload failed on {p.args[-2]} with the following message:\n"
-                    )
-                    click.secho(f"{err}", fg="red")
+    def on_result(result: shards.ShardResult):
+        if result.error is None:
+            click.echo(
+                f"Shard {result.shard} uploaded {len(result.uploaded)} files "
+                f"on {result.worker}"
+            )
+        else:
+            click.secho(
+                f"Shard {result.shard} failed on {result.worker}, "
+                f"to be retried by a worker: {result.error}",
+                fg="yellow",
+            )
 
-                    raise click.Abort()
+    results = shards.wait_for_shards(journal_dir, num_shards, on_result)
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        for result in failed:
+            click.secho(
+                f"Shard {result.shard} failed for good: {result.error}", fg="red"
+            )
+        raise click.Abort()
 
+    # every file must have been uploaded by one worker or another
+    uploaded = {dst for result in results for dst in result.uploaded}
+    missing = [src for src, dst in upload_pairs if dst not in uploaded]
+    if missing:
+        raise Exception(f"Workers didn't upload these files:\n{', '.join(missing)}")
+
+    file_count = len(upload_pairs)
     click.echo(
         f"[{file_count}/{file_count} done] All files uploaded to GCS and staged for ingestion."
     )
@@ -299,6 +584,157 @@ def _gsutil_assay_upload(upload_info: api.UploadInfo, xlsx: str) -> Dict[str, st
     return upload_info.gcs_file_map
 
 
+def run_upload_worker(journal_dir: str, shard: Optional[int] = None):
+    """
+    Upload shards of a sharded upload's files, as a worker for the
+    `run_upload` coordinating it through `journal_dir`.
+    Claims shards until there are none left (see `shards.claim_shard`),
+    unless given one to (re)upload.
+    """
+    job = shards.read_job(journal_dir)
+    num_shards = len(job["shards"])
+    if shard is not None and not 0 <= shard < num_shards:
+        raise click.BadParameter(f"this upload has shards 0 to {num_shards - 1}")
+
+    uploaded_any = False
+    while True:
+        claimed = shards.claim_shard(journal_dir, num_shards, shard)
+        if claimed is None:
+            break
+        _upload_shard(journal_dir, job, claimed)
+        uploaded_any = True
+        if shard is not None:
+            break
+
+    if not uploaded_any:
+        click.echo(f"All {num_shards} shards of this upload are already claimed.")
+
+
+def _upload_shard(journal_dir: str, job: dict, shard: int):
+    """Uploads a claimed shard's files, and reports how it went"""
+    upload_pairs = job["shards"][shard]
+    click.secho(
+        f"> uploading shard {shard} of {len(job['shards'])} for upload job "
+        f"{job['job_id']}: {len(upload_pairs)} files",
+        dim=True,
+    )
+    try:
+        with shards.Heartbeat(journal_dir, shard):
+            # Log in to gcloud (required for gsutil to work)
+            sources = [(src, _object_name(dst)) for src, dst in upload_pairs]
+            if _needs_gcloud(sources, job["signed_urls"]) and not gcloud.is_logged_in():
+                gcloud.check_installed()
+                gcloud.login()
+            _upload_files(upload_pairs, job["optional_files"], job["signed_urls"])
+    except (Exception, KeyboardInterrupt) as e:
+        shards.report(journal_dir, shard, [], str(e) or type(e).__name__)
+        raise
+    shards.report(journal_dir, shard, [dst for _, dst in upload_pairs])
+    click.echo(f"Shard {shard} uploaded.")
+
+
+def _upload_files(
+    upload_pairs: List[List[str]],
+    optional_files: List[str],
+    signed_urls: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    Uploads (source, destination) pairs, raising click.Abort if any fails
+    Local files with a URL in `signed_urls` are uploaded without gsutil
+    A failed file upload is retried with backoff if the error looks transient,
+    while the others carry on, up to MAX_UPLOAD_ATTEMPTS times
+    Each upload holds a `governor.HostGovernor` slot, shared fairly among all
+    `cidc` processes uploading from this host
+    """
+    file_count = len(upload_pairs)
+    proc_iter = _start_procs(upload_pairs, signed_urls)
+    procs = []
+    # the host-wide transfer slot of each running upload, by its index in procs
+    slots: Dict[int, governor.Slot] = {}
+    # for uploads that have failed, by their index in procs
+    attempts: Dict[int, int] = {}
+    retries: Dict[int, Tuple[float, List[str]]] = {}
+    all_uploads_have_run = False
+    with governor.HostGovernor() as host:
+        while True:
+            for i, p in enumerate(procs):
+                if i in slots and (p is None or p.poll() is not None):
+                    slots.pop(i).release()
+            if all_uploads_have_run and not retries and not slots:
+                break
+
+            # Here we start with just 1 parallel process and gradually
+            # increase that to MAX_GSUTIL_PARALLEL_PROCESS doubling the number every time,
+            # as long as there are free slots among all uploads on this host.
+            waiting_for_slot = False
+            if not all_uploads_have_run:
+                current_count = len(procs) or 1  # 1 is for starters
+                how_many_to_add = min(current_count, MAX_GSUTIL_PARALLEL_PROCESS)
+                for _ in range(how_many_to_add - len(slots)):
+                    slot = host.try_acquire()
+                    if slot is None:
+                        waiting_for_slot = True
+                        break
+                    try:
+                        procs.append(next(proc_iter))
+                    except StopIteration:
+                        slot.release()
+                        all_uploads_have_run = True
+                        break
+                    slots[len(procs) - 1] = slot
+
+            # restart failed uploads once their backoff is over
+            for i, (retry_at, src_dst) in list(retries.items()):
+                if retry_at <= time.time():
+                    slot = host.try_acquire()
+                    if slot is None:
+                        retries[i] = (time.time() + SLOT_POLL_INTERVAL, src_dst)
+                        continue
+                    del retries[i]
+                    procs[i] = next(_start_procs([src_dst], signed_urls))
+                    slots[i] = slot
+
+            # check back for the next retry, or for a free slot
+            wake_at = [at for at, _ in retries.values()]
+            if waiting_for_slot:
+                wake_at.append(time.time() + SLOT_POLL_INTERVAL)
+            until = min(wake_at, default=None)
+            if until and all(p is None or p.poll() is not None for p in procs):
+                # nothing else to wait on
+                time.sleep(max(0, until - time.time()))
+                continue
+
+            errors = _wait_for_upload(procs, file_count, optional_files, until=until)
+
+            for i, err in errors.items():
+                p = procs[i]
+                attempts[i] = attempts.get(i, 1)
+                if _is_retryable(err) and attempts[i] < MAX_UPLOAD_ATTEMPTS:
+                    delay = _retry_delay(attempts[i])
+                    attempts[i] += 1
+                    click.secho(
+                        f"Retrying {p.args[-2]} in {delay:.1f}s "
+                        f"(attempt {attempts[i]} of {MAX_UPLOAD_ATTEMPTS}): {err.strip()}",
+                        fg="yellow",
+                    )
+                    retries[i] = (time.time() + delay, p.args[-2:])
+                    procs[i] = None
+                    continue
+
+                # stopping all other processes
+                for other_p in procs:
+                    if other_p is not None and p != other_p:
+                        other_p.kill()
+
+                click.echo(
+                    f"\nGCS upload failed on {p.args[-2]} after {attempts[i]} "
+                    f"attempt{'s' if attempts[i] > 1 else ''} with the following message:\n"
+                )
+                click.secho(f"{err}", fg="red")
+
+                raise click.Abort()
+
+
 def _check_for_gs_files(
     gs_uris_to_check: Dict[str, Dict[str, str]],
     optional_files: List[str],
@@ -306,6 +742,7 @@ def _check_for_gs_files(
 ):
     """Smart checking of gs:// URIs to ensure that files exist"""
     res, missing_required_files, missing_optional_files = [], [], []
+    optional_files = set(optional_files)
 
     # separate by bucket, to do single ls per bucket
     # then check in the return for all the files
@@ -356,34 +793,29 @@ def _check_for_gs_files(
 
 
 def _compose_file_mapping(
-    upload_info: api.UploadInfo, xlsx: str
+    upload_info: api.UploadInfo, xlsx: str, local_files: Optional[Set[str]] = None
 ) -> Tuple[Dict[str, str], List[str]]:
     """
     Returns a list of (source_path, target uri) pairs for all
     the files from the upload info relative to the `work dir`
     that is xlsx file locaction. If s source_path is a GCS uri,
     it will return it w/o change.
+    Paths in `local_files` are known to be files, so aren't checked again.
     """
+    local_files = local_files or set()
     res = []
     missing_optional_files = []
     missing_required_files = []
     xlsx_dir = os.path.abspath(os.path.dirname(xlsx))
 
     gs_uris_to_check = {}
+    local_paths = []
     for source_path, gcs_uri in upload_info.url_mapping.items():
 
         # if we're not copying from GCS to GCS, then
         # resolve local path against .xslx file dir
         if not source_path.startswith("gs://"):
-            source_path = os.path.join(xlsx_dir, source_path)
-
-            if not os.path.isfile(source_path):
-                if any(source_path.endswith(f) for f in upload_info.optional_files):
-                    missing_optional_files.append(gcs_uri)
-                    continue
-                else:
-                    missing_required_files.append(source_path)
-            res.append([source_path, f"gs://{upload_info.gcs_bucket}/{gcs_uri}"])
+            local_paths.append((os.path.join(xlsx_dir, source_path), gcs_uri))
 
         else:
             # separate by bucket, to do single ls per bucket
@@ -395,6 +827,19 @@ def _compose_file_mapping(
                 gs_uris_to_check[bucket] = {}
             gs_uris_to_check[bucket][source_path] = gcs_uri
 
+    found = local_files | _find_local_files(
+        source_path for source_path, _ in local_paths if source_path not in local_files
+    )
+    is_optional = _suffix_matcher(upload_info.optional_files)
+    for source_path, gcs_uri in local_paths:
+        if source_path not in found:
+            if is_optional(source_path):
+                missing_optional_files.append(gcs_uri)
+                continue
+            else:
+                missing_required_files.append(source_path)
+        res.append([source_path, f"gs://{upload_info.gcs_bucket}/{gcs_uri}"])
+
     gs_res, missing_required_gs_files, missing_optional_gs_files = _check_for_gs_files(
         gs_uris_to_check, upload_info.optional_files, upload_info.gcs_bucket
     )
@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock
+
+import pytest
+from click.testing import CliRunner
+
+from cli.dbedit import cli as dbedit_cli
+
+
+@pytest.fixture
+def remove(monkeypatch):
+    monkeypatch.setattr(dbedit_cli.core, "connect", MagicMock())
+    remove = MagicMock()
+    monkeypatch.setattr(dbedit_cli, "remove", remove)
+    return remove
+
+
+@pytest.mark.parametrize(
+    "flags,dry_run,two_phase",
+    [([], False, False), (["--dry-run"], True, False), (["--two-phase"], False, True)],
+)
+def test_remove_commands(remove, flags, dry_run, two_phase):
+    runner = CliRunner()
+
+    result = runner.invoke(dbedit_cli.remove_assay, ["t", "elisa", "batch"] + flags)
+    assert result.exit_code == 0, result.output
+    remove.remove_data.assert_called_once_with(
+        trial_id="t",
+        assay_or_analysis="elisa",
+        target_id=("batch",),
+        dry_run=dry_run,
+        two_phase=two_phase,
+        delete_objects=False,
+    )
+
+    result = runner.invoke(dbedit_cli.remove_clinical, ["t", "file.csv"] + flags)
+    assert result.exit_code == 0, result.output
+    remove.remove_clinical.assert_called_once_with(
+        trial_id="t",
+        target_id="file.csv",
+        dry_run=dry_run,
+        two_phase=two_phase,
+        delete_objects=False,
+    )
+
+    result = runner.invoke(dbedit_cli.remove_shipment, ["t", "manifest"] + flags)
+    assert result.exit_code == 0, result.output
+    remove.remove_shipment.assert_called_once_with(
+        trial_id="t", target_id="manifest", dry_run=dry_run, two_phase=two_phase
+    )
+
+
+def test_remove_commands_reject_both_flags(remove):
+    runner = CliRunner()
+    both = ["--dry-run", "--two-phase"]
+    for command, args in [
+        (dbedit_cli.remove_assay, ["t", "elisa", "batch"]),
+        (dbedit_cli.remove_clinical, ["t", "file.csv"]),
+        (dbedit_cli.remove_shipment, ["t", "manifest"]),
+    ]:
+        result = runner.invoke(command, args + both)
+        assert result.exit_code == 2, result.output
+        assert "Give at most one of --dry-run and --two-phase" in result.output
+    assert not remove.mock_calls
@@ -1,5 +1,10 @@
+import gc
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import call, MagicMock
+
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import declarative_base
 
 from cli.dbedit import core
 from cli.config import set_env
@@ -74,8 +79,9 @@ def test_connect(monkeypatch):
     mocks.Connector.assert_called_once_with()
     mocks.automap_base.assert_called_once_with()
     mocks.sqlalchemy.create_engine.assert_called_once()
-    args, _ = mocks.sqlalchemy.create_engine.call_args
+    args, kwargs = mocks.sqlalchemy.create_engine.call_args
     assert args == ("postgresql+pg8000://",)
+    assert kwargs["json_deserializer"] is core.json_loads_exact
 
     mocks.Connector_instance.connect.assert_called_once_with(
         "cidc-dfci:us-east1:cidc-postgresql-prod",
@@ -128,6 +134,95 @@ def test_connect(monkeypatch):
     )
 
 
+def test_connect_read_only(monkeypatch):
+    monkeypatch.setattr(core, "get_env", lambda: "prod")
+    monkeypatch.setattr(core, "get_username", lambda: TEST_USER)
+    replicas = {"prod": "cidc-dfci:us-east1:cidc-postgresql-prod-replica"}
+    monkeypatch.setattr(core, "get_replica", replicas.get)
+    mocks = Mocker(monkeypatch)
+
+    # uses the replica, with read only transactions
+    core.connect(MagicMock(), read_only=True)
+    mocks.Connector_instance.connect.assert_called_once_with(
+        "cidc-dfci:us-east1:cidc-postgresql-prod-replica",
+        "pg8000",
+        user=TEST_USER,
+        password=TEST_PASSWORD,
+        db="cidc-prod",
+    )
+    mocks.sqlalchemy.event.listen.assert_called_once_with(
+        mocks.create_engine_result, "begin", core._set_read_only
+    )
+    _, kwargs = mocks.sqlalchemy.create_engine.call_args
+    assert kwargs["json_deserializer"] is core.json_loads
+
+    # falls back to the primary without one
+    mocks.reset_mocks()
+    mocks.Connector_instance.reset_mock()
+    replicas.clear()
+    core.connect(MagicMock(), read_only=True, log_queries=True)
+    args, _ = mocks.Connector_instance.connect.call_args
+    assert args[0] == "cidc-dfci:us-east1:cidc-postgresql-prod"
+    assert mocks.sqlalchemy.event.listen.call_args_list == [
+        call(mocks.create_engine_result, "begin", core._set_read_only),
+        call(
+            mocks.create_engine_result,
+            "before_cursor_execute",
+            core._before_cursor_execute,
+        ),
+        call(
+            mocks.create_engine_result,
+            "after_cursor_execute",
+            core._after_cursor_execute,
+        ),
+    ]
+
+    # and never uses it for writing
+    mocks.reset_mocks()
+    mocks.Connector_instance.reset_mock()
+    replicas["prod"] = "replica"
+    core.connect(MagicMock())
+    args, _ = mocks.Connector_instance.connect.call_args
+    assert args[0] == "cidc-dfci:us-east1:cidc-postgresql-prod"
+    mocks.sqlalchemy.event.listen.assert_not_called()
+
+
+def test_query_listeners(capsys):
+    conn = MagicMock()
+    conn.info = {}
+    core._set_read_only(conn)
+    conn.exec_driver_sql.assert_called_once_with("SET TRANSACTION READ ONLY")
+
+    statement = "SELECT *\n    FROM trial_metadata"
+    core._before_cursor_execute(conn, None, statement, None, None, False)
+    core._after_cursor_execute(conn, None, statement, None, None, False)
+    assert conn.info["query_start"] == []
+    err = capsys.readouterr().err
+    assert err.endswith(" ms: SELECT * FROM trial_metadata\n")
+
+
+def test_json_loads(monkeypatch):
+    text = '{"a": [1, 2.5, "b", null, true], "c": {"d": "\\u00e9"}}'
+    expected = {"a": [1, 2.5, "b", None, True], "c": {"d": "\u00e9"}}
+    assert core.json_loads(text) == expected
+    assert core.json_loads(text.encode()) == expected
+
+    # without orjson
+    monkeypatch.setattr(core, "orjson", None)
+    assert core.json_loads(text) == expected
+
+    # exactly, with garbage collection restored afterwards
+    big = "123456789012345678901234567890"
+    assert core.json_loads_exact(big) == int(big)
+    assert gc.isenabled()
+    gc.disable()
+    try:
+        assert core.json_loads_exact(text) == expected
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+
+
 def test_get_clinical_downloadable_files(monkeypatch):
     monkeypatch.setattr(core, "get_env", lambda: "dev")
     DownloadableFiles = MagicMock()
@@ -313,3 +408,56 @@ def test_get_trial_if_exists(monkeypatch):
         )
         assert pytest_wrapped_e.type == SystemExit
         assert pytest_wrapped_e.value.code == 0
+
+
+def test_bulk_delete(monkeypatch):
+    class DownloadableFiles(declarative_base()):
+        __tablename__ = "downloadable_files"
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+        object_url = sqlalchemy.Column(sqlalchemy.String)
+
+    session = MagicMock()
+    filter_query = session.query.return_value.filter.return_value
+    filter_query.delete.side_effect = [2, 1]
+    filter_query.count.side_effect = [2, 1]
+    mock_print = MagicMock()
+    monkeypatch.setattr("builtins.print", mock_print)
+
+    # keys are deduplicated, then matched in chunks with a single array parameter each
+    keys = ["a", "b", "a", "c"]
+    assert (
+        core.bulk_count(
+            DownloadableFiles.object_url, keys, chunk_size=2, session=session
+        )
+        == 3
+    )
+    mock_print.assert_not_called()
+
+    session.reset_mock()
+    num_deleted = core.bulk_delete(
+        DownloadableFiles.object_url, keys, chunk_size=2, session=session
+    )
+    assert num_deleted == 3
+    session.query.assert_called_with(DownloadableFiles)
+    filter_query.delete.assert_called_with(synchronize_session=False)
+
+    clauses = [args[0] for args, _ in session.query.return_value.filter.call_args_list]
+    compiled = [c.compile(dialect=postgresql.dialect()) for c in clauses]
+    assert str(compiled[0]) == (
+        "downloadable_files.object_url = ANY (%(param_1)s::VARCHAR[])"
+    )
+    assert [c.params for c in compiled] == [
+        {"param_1": ["a", "b"]},
+        {"param_1": ["c"]},
+    ]
+    assert mock_print.call_args_list == [
+        call("Deleted 2 downloadable_files rows", "matching 2 of 3 keys"),
+        call("Deleted 3 downloadable_files rows", "matching 3 of 3 keys"),
+    ]
+
+    # a single chunk doesn't print progress
+    mock_print.reset_mock()
+    filter_query.delete.side_effect = None
+    filter_query.delete.return_value = 3
+    assert core.bulk_delete(DownloadableFiles.object_url, keys, session=session) == 3
+    mock_print.assert_not_called()
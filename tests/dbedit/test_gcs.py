@@ -0,0 +1,137 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from unittest.mock import MagicMock
+from urllib.parse import unquote
+
+import pytest
+
+from cli.dbedit import gcs
+
+BUCKET = "test-bucket"
+
+
+class FakeGCS:
+    """A local stand-in for the JSON API's batch endpoint, for STORAGE_EMULATOR_HOST"""
+
+    def __init__(self, objects: List[str]):
+        self.objects = set(objects)
+        # names to fail with a 503 the next this many times
+        self.flaky: Dict[str, int] = dict()
+        self.num_requests = 0
+        self.batch_sizes: List[int] = []
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                assert self.path == "/batch/storage/v1"
+                boundary = re.search(
+                    r"boundary=(\S+)", self.headers["Content-Type"]
+                ).group(1)
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/mixed; boundary=response")
+                response = fake.handle(body, boundary).encode()
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def handle(self, body: str, boundary: str) -> str:
+        self.num_requests += 1
+        parts = []
+        for part in body.split(f"--{boundary}")[1:-1]:
+            n = re.search(r"Content-ID: <item-(\d+)>", part).group(1)
+            bucket, name = re.search(
+                r"DELETE /storage/v1/b/(.+)/o/(\S+) ", part
+            ).groups()
+            assert bucket == BUCKET
+            name = unquote(name)
+
+            if self.flaky.get(name):
+                self.flaky[name] -= 1
+                status = "503 Service Unavailable"
+            elif name in self.objects:
+                self.objects.remove(name)
+                status = "204 No Content"
+            else:
+                status = "404 Not Found"
+            parts.append(
+                "--response\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-item-{n}>\r\n\r\nHTTP/1.1 {status}\r\n\r\n"
+            )
+        self.batch_sizes.append(len(parts))
+        return "".join(parts) + "--response--\r\n"
+
+
+@pytest.fixture
+def fake_gcs(monkeypatch, tmp_path):
+    objects = [f"trial/wes/CTTTPP{n:03}.00/reads #{n}.bam" for n in range(250)]
+    fake = FakeGCS(objects)
+    fake.thread.start()
+    monkeypatch.setenv("STORAGE_EMULATOR_HOST", fake.host)
+    monkeypatch.setattr(gcs, "CIDC_WORKING_DIR", str(tmp_path))
+    monkeypatch.setattr(gcs, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(gcs, "_local", threading.local())
+    monkeypatch.setattr("builtins.print", MagicMock())
+    yield fake, objects
+    fake.server.shutdown()
+
+
+def test_delete_objects(fake_gcs):
+    fake, objects = fake_gcs
+
+    # deletes in parallel batches, counting already missing objects as deleted
+    failed = gcs.delete_objects(objects + objects[:10] + ["missing"], BUCKET)
+    assert failed == []
+    assert fake.objects == set()
+    assert sorted(fake.batch_sizes) == [51, 100, 100]
+    assert gcs.pending_deletions(BUCKET) == []
+
+    # retries throttled calls
+    fake.objects = set(objects[:3])
+    fake.flaky = {objects[0]: 2}
+    fake.num_requests = 0
+    assert gcs.delete_objects(objects[:3], BUCKET) == []
+    assert fake.objects == set()
+    assert fake.num_requests == 3
+
+
+def test_resume_deletions(fake_gcs, monkeypatch):
+    fake, objects = fake_gcs
+    monkeypatch.setattr(gcs, "MAX_ATTEMPTS", 2)
+
+    # those that keep failing are left in the journal
+    fake.flaky = {objects[1]: 2, objects[200]: 1}
+    failed = gcs.delete_objects(objects, BUCKET)
+    assert failed == [objects[1]]
+    assert gcs.pending_deletions(BUCKET) == [objects[1]]
+    assert fake.objects == {objects[1]}
+
+    # and are deleted on resuming
+    assert gcs.resume_deletions(BUCKET) == []
+    assert fake.objects == set()
+    assert gcs.pending_deletions(BUCKET) == []
+    assert gcs.resume_deletions(BUCKET) == []
+
+
+def test_pending_deletions(monkeypatch, tmp_path):
+    monkeypatch.setattr(gcs, "CIDC_WORKING_DIR", str(tmp_path))
+    assert gcs.pending_deletions(BUCKET) == []
+
+    # an interrupted run leaves everything not yet done, ignoring a cut off line
+    (tmp_path / f"gcs_deletions_{BUCKET}.jsonl").write_text(
+        '{"delete": "a"}\n{"delete": "b"}\n{"delete": "c"}\n{"done": "b"}\n{"done'
+    )
+    assert gcs.pending_deletions(BUCKET) == ["a", "c"]
@@ -0,0 +1,48 @@
+from cli.dbedit import layouts
+
+
+def test_every_supported_assay_has_a_layout():
+    assert set(layouts.LAYOUTS) == layouts.SUPPORTED_ASSAYS_AND_ANALYSES
+    for name, layout in layouts.LAYOUTS.items():
+        assert layout.name == name
+        assert layout.section in ("assays", "analysis", "clinical_data")
+        assert len(layout.batch_lists) == len(layout.keys)
+
+
+def test_compile_getter():
+    get = layouts._compile_getter(("a", "b", "c"))
+    assert get({"a": {"b": {"c": 1}}}) == 1
+    assert get({"a": {"b": {}}}) is None
+    assert get({"a": {}}) is None
+    assert get({}) is None
+
+    assert layouts._compile_getter(("a",))({"a": 2}) == 2
+    assert layouts._compile_getter(())({"a": 2}) is None
+
+
+def test_layout_accessors():
+    olink = layouts.LAYOUTS["olink"]
+    assert olink.usage == "batch_id [file]"
+    assert olink.batches({}) == []
+
+    batches = [{"batch_id": "foo", "records": []}]
+    metadata_json = {"assays": {"olink": {"batches": batches}}}
+    assert olink.batches(metadata_json) is batches
+    assert olink.get_batch_id(batches[0]) == "foo"
+    assert olink.pop_root(metadata_json) == {"batches": batches}
+    assert metadata_json == {"assays": {}}
+
+    wes = layouts.LAYOUTS["wes_analysis"]
+    assert wes.usage == "run_id"
+    metadata_json = {"analysis": {"wes_analysis_old": {"pair_runs": []}}}
+    assert list(wes.iter_batch_lists(metadata_json)) == [("wes_analysis_old", [])]
+    assert layouts.LAYOUTS["wes_tumor_only_analysis"].get_batch_id(
+        {"tumor": {"cimac_id": "CTTTPP101.00"}}
+    ) == ("CTTTPP101.00")
+
+    # unlisted assays are generic: top-level list of batches, found by id or index
+    ihc = layouts.LAYOUTS["ihc"]
+    assert (ihc.kind, ihc.section, ihc.positional) == ("batched", "assays", True)
+    assert ihc.usage == "batch_id [cimac_id]"
+    assert layouts.LAYOUTS["tcr_analysis"].section == "analysis"
+    assert not layouts.LAYOUTS["tcr_analysis"].positional
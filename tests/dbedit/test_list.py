@@ -1,4 +1,5 @@
 from datetime import datetime
+import json
 import pandas as pd
 from _pytest.monkeypatch import MonkeyPatch
 from unittest.mock import MagicMock
@@ -21,10 +22,8 @@ def test_list_clinical(monkeypatch):
     begin.__enter__.return_value = session
     Session.begin.return_value = begin
 
-    mock_trial = MagicMock()
-    mock_trial.metadata_json = TEST_METADATA_JSON
-    get_trial_if_exists = MagicMock()
-    get_trial_if_exists.return_value = mock_trial
+    get_trial_metadata = MagicMock()
+    get_trial_metadata.return_value = TEST_METADATA_JSON
 
     file1, file2 = MagicMock(), MagicMock()
     file1.object_url = f"{TEST_TRIAL_ID}/clinical/{TEST_CLINICAL_URL_XLSX}"
@@ -38,7 +37,7 @@ def test_list_clinical(monkeypatch):
     mock_print = MagicMock()
 
     monkeypatch.setattr(dbedit_list, "Session", Session)
-    monkeypatch.setattr(dbedit_list, "get_trial_if_exists", get_trial_if_exists)
+    monkeypatch.setattr(dbedit_list, "get_trial_metadata", get_trial_metadata)
     monkeypatch.setattr(
         dbedit_list, "get_clinical_downloadable_files", get_clinical_downloadable_files
     )
@@ -95,10 +94,8 @@ def test_list_misc_data(monkeypatch):
     begin.__enter__.return_value = session
     Session.begin.return_value = begin
 
-    mock_trial = MagicMock()
-    mock_trial.metadata_json = TEST_METADATA_JSON
-    get_trial_if_exists = MagicMock()
-    get_trial_if_exists.return_value = mock_trial
+    get_trial_metadata = MagicMock()
+    get_trial_metadata.return_value = TEST_METADATA_JSON
 
     file1, file2 = MagicMock(), MagicMock()
     file1.object_url = f"{TEST_TRIAL_ID}/misc_data/{TEST_MISC_DATA_URL1}"
@@ -112,7 +109,7 @@ def test_list_misc_data(monkeypatch):
     mock_print = MagicMock()
 
     monkeypatch.setattr(dbedit_list, "Session", Session)
-    monkeypatch.setattr(dbedit_list, "get_trial_if_exists", get_trial_if_exists)
+    monkeypatch.setattr(dbedit_list, "get_trial_metadata", get_trial_metadata)
     monkeypatch.setattr(dbedit_list, "get_misc_data_files", get_misc_data_files)
     monkeypatch.setattr("builtins.print", mock_print)
 
@@ -226,11 +223,8 @@ class Test_list_data_cimac_ids:
         self.begin.__enter__.return_value = self.session
         self.Session.begin.return_value = self.begin
 
-        self.mock_trial = MagicMock()
-        self.mock_trial.metadata_json = TEST_METADATA_JSON
-
-        self.get_trial_if_exists = MagicMock()
-        self.get_trial_if_exists.return_value = self.mock_trial
+        self.get_trial_metadata = MagicMock()
+        self.get_trial_metadata.return_value = TEST_METADATA_JSON
 
         self.mock_list_clinical = MagicMock()
         self.mock_list_misc_data = MagicMock()
@@ -241,7 +235,7 @@ class Test_list_data_cimac_ids:
         self.monkeypatch = MonkeyPatch()
         self.monkeypatch.setattr(dbedit_list, "Session", self.Session)
         self.monkeypatch.setattr(
-            dbedit_list, "get_trial_if_exists", self.get_trial_if_exists
+            dbedit_list, "get_trial_metadata", self.get_trial_metadata
         )
         self.monkeypatch.setattr(dbedit_list, "list_clinical", self.mock_list_clinical)
         self.monkeypatch.setattr(
@@ -260,12 +254,16 @@ class Test_list_data_cimac_ids:
             trial_id="foo", assay_or_analysis="clinical_data"
         )
         self.mock_print.assert_not_called()
-        self.mock_list_clinical.assert_called_once_with("foo")
+        self.mock_list_clinical.assert_called_once_with(
+            "foo", output_format="table", output_file=None
+        )
 
         self.mock_print.reset_mock()
         dbedit_list.list_data_cimac_ids(trial_id="foo", assay_or_analysis="misc_data")
         self.mock_print.assert_not_called()
-        self.mock_list_misc_data.assert_called_once_with("foo")
+        self.mock_list_misc_data.assert_called_once_with(
+            "foo", output_format="table", output_file=None
+        )
 
     def _get_and_assert_df(self) -> pd.DataFrame:
         self.mock_print.assert_called_once()
@@ -558,3 +556,136 @@ class Test_list_data_cimac_ids:
                 ]
             )
         )
+
+
+def test_describe_empty_trial():
+    # every assay builds a single, correctly shaped frame even with no data
+    for assay_or_analysis, layout in dbedit_list.LAYOUTS.items():
+        if layout.kind in ("clinical_data", "misc_data"):
+            continue
+
+        df = dbedit_list.describe(metadata_json={}, assay_or_analysis=assay_or_analysis)
+        assert df.shape == (0, len(layout.columns))
+        assert list(df.columns) == list(layout.columns)
+
+
+def test_describe_generic_many_batches():
+    metadata_json = {
+        "assays": {
+            "wes": [
+                {"records": [{"cimac_id": f"CTTTPP{b}{r:02}.00"} for r in range(3)]}
+                for b in range(4)
+            ]
+        }
+    }
+    df = dbedit_list.describe(metadata_json, assay_or_analysis="wes")
+    assert df.shape == (12, 2)
+    assert list(df.index) == list(range(12))
+    assert list(df["batch_id"]) == [str(b) for b in range(4) for _ in range(3)]
+    assert df["cimac_id"].iloc[-1] == "CTTTPP302.00"
+
+
+class Test_list_bulk_cimac_ids:
+    def setup(self):
+        self.Session = MagicMock()
+        self.session = MagicMock()
+        self.begin = MagicMock()
+        self.begin.__enter__.return_value = self.session
+        self.Session.begin.return_value = self.begin
+
+        metadata_text = json.dumps(TEST_METADATA_JSON)
+        self.get_trials_as_text = MagicMock()
+        self.get_trials_as_text.return_value = [
+            ("bar", metadata_text),
+            (TEST_TRIAL_ID, metadata_text),
+        ]
+
+        self.mock_print = MagicMock()
+
+        self.monkeypatch = MonkeyPatch()
+        self.monkeypatch.setattr(dbedit_list, "Session", self.Session)
+        self.monkeypatch.setattr(
+            dbedit_list, "get_trials_as_text", self.get_trials_as_text
+        )
+        self.monkeypatch.setattr("builtins.print", self.mock_print)
+
+    def teardown(self):
+        self.monkeypatch.undo()
+
+    def test_bail_outs(self):
+        dbedit_list.list_bulk_cimac_ids(
+            trial_ids=[TEST_TRIAL_ID], assays_or_analyses=["wes", "foo"]
+        )
+        self.mock_print.assert_called_once_with(
+            "Assay / analysis not supported:", "foo"
+        )
+
+        self.mock_print.reset_mock()
+        dbedit_list.list_bulk_cimac_ids(
+            trial_ids=[TEST_TRIAL_ID], assays_or_analyses=["misc_data"]
+        )
+        self.mock_print.assert_called_once_with(
+            "Bulk listing of misc_data not supported, list each trial instead"
+        )
+
+        self.mock_print.reset_mock()
+        dbedit_list.list_bulk_cimac_ids(
+            trial_ids=[TEST_TRIAL_ID, "baz"], assays_or_analyses=["wes"]
+        )
+        self.mock_print.assert_called_once_with("Trial baz cannot be found")
+        self.get_trials_as_text.assert_called_once_with(
+            [TEST_TRIAL_ID, "baz"], session=self.session
+        )
+
+    def test_combined_table(self):
+        dbedit_list.list_bulk_cimac_ids(
+            trial_ids=[TEST_TRIAL_ID, "bar", TEST_TRIAL_ID],
+            assays_or_analyses=["elisa", "wes_analysis", "elisa"],
+        )
+        self.get_trials_as_text.assert_called_once_with(
+            [TEST_TRIAL_ID, "bar"], session=self.session
+        )
+        self.mock_print.assert_called_once()
+        df = self.mock_print.call_args[0][0]
+
+        elisa = dbedit_list.describe(TEST_METADATA_JSON, "elisa")
+        wes = dbedit_list.describe(TEST_METADATA_JSON, "wes_analysis")
+        assert list(df.columns) == [
+            "trial_id",
+            "assay_or_analysis",
+            "assay_run_id",
+            "cimac_id",
+            "run_id",
+            "tumor_cimac_id",
+            "normal_cimac_id",
+        ]
+        assert len(df) == 2 * (len(elisa) + len(wes))
+        # trials in the order given, each with all of its assays
+        assert list(df["trial_id"]) == [TEST_TRIAL_ID] * (len(elisa) + len(wes)) + [
+            "bar"
+        ] * (len(elisa) + len(wes))
+        first = df[df["trial_id"] == TEST_TRIAL_ID]
+        assert list(first["assay_or_analysis"]) == ["elisa"] * len(elisa) + [
+            "wes_analysis"
+        ] * len(wes)
+        assert list(first["cimac_id"][: len(elisa)]) == list(elisa["cimac_id"])
+        assert list(first["run_id"][len(elisa) :]) == list(wes["run_id"])
+        assert first["run_id"][: len(elisa)].isna().all()
+
+    def test_all_in_process_pool(self):
+        self.monkeypatch.setattr(dbedit_list, "PROCESS_POOL_THRESHOLD", 0)
+        dbedit_list.list_bulk_cimac_ids(
+            trial_ids=[TEST_TRIAL_ID, "bar"], assays_or_analyses=["all"]
+        )
+        df = self.mock_print.call_args[0][0]
+
+        names = set(df["assay_or_analysis"])
+        assert "clinical_data" not in names and "misc_data" not in names
+        assert not any(name.endswith("_old") for name in names)
+        for name in ["olink", "elisa", "nanostring", "wes_analysis", "wes"]:
+            expected = dbedit_list.describe(TEST_METADATA_JSON, name)
+            for trial_id in [TEST_TRIAL_ID, "bar"]:
+                rows = df[
+                    (df["trial_id"] == trial_id) & (df["assay_or_analysis"] == name)
+                ]
+                assert len(rows) == len(expected), name
@@ -0,0 +1,85 @@
+import json
+from datetime import datetime
+
+import click
+import pandas as pd
+import pytest
+
+from cli.dbedit import output
+
+COLUMNS = ("batch_id", "cimac_id", "created", "comment")
+ROWS = [
+    ("batch", "CTTTPP101.00", datetime.fromisoformat("2020-01-01T12:34:45"), "foo"),
+    ("batch", "CTTTPP102.00", datetime.fromisoformat("2020-02-02T12:34:45"), pd.NA),
+]
+
+
+def _rows():
+    # a one-shot generator, like the listing functions produce
+    yield from ROWS
+
+
+def test_write_table(monkeypatch, tmp_path):
+    printed = []
+    monkeypatch.setattr("builtins.print", printed.append)
+    output.write_rows(COLUMNS, _rows())
+    assert len(printed) == 1
+    assert isinstance(printed[0], pd.DataFrame)
+    assert printed[0].shape == (2, 4)
+
+    path = tmp_path / "out.txt"
+    output.write_rows(COLUMNS, _rows(), output_file=str(path))
+    assert "CTTTPP102.00" in path.read_text()
+
+
+def test_write_delimited(capsys, tmp_path):
+    output.write_rows(COLUMNS, _rows(), output_format="csv")
+    assert capsys.readouterr().out.splitlines() == [
+        "batch_id,cimac_id,created,comment",
+        "batch,CTTTPP101.00,2020-01-01T12:34:45,foo",
+        "batch,CTTTPP102.00,2020-02-02T12:34:45,",
+    ]
+
+    path = tmp_path / "out.tsv"
+    output.write_rows(COLUMNS, _rows(), output_format="tsv", output_file=str(path))
+    assert path.read_text().splitlines()[1] == "\t".join(
+        ["batch", "CTTTPP101.00", "2020-01-01T12:34:45", "foo"]
+    )
+
+
+def test_write_jsonl(capsys):
+    output.write_rows(COLUMNS, _rows(), output_format="jsonl")
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        {
+            "batch_id": "batch",
+            "cimac_id": "CTTTPP101.00",
+            "created": "2020-01-01T12:34:45",
+            "comment": "foo",
+        },
+        {
+            "batch_id": "batch",
+            "cimac_id": "CTTTPP102.00",
+            "created": "2020-02-02T12:34:45",
+            "comment": None,
+        },
+    ]
+
+
+def test_write_parquet(monkeypatch, tmp_path):
+    with pytest.raises(click.ClickException, match="--output FILE is required"):
+        output.write_rows(COLUMNS, _rows(), output_format="parquet")
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(output, "PARQUET_CHUNK_SIZE", 1)
+    path = tmp_path / "out.parquet"
+    output.write_rows(COLUMNS, _rows(), output_format="parquet", output_file=str(path))
+    table = pq.read_table(str(path))
+    assert table.num_rows == 2
+    assert table.column("cimac_id").to_pylist() == ["CTTTPP101.00", "CTTTPP102.00"]
+    assert table.column("comment").to_pylist() == ["foo", None]
+
+
+def test_write_unsupported_format():
+    with pytest.raises(click.ClickException, match="Unsupported output format"):
+        output.write_rows(COLUMNS, _rows(), output_format="xml")
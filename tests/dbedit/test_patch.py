@@ -0,0 +1,125 @@
+from copy import deepcopy
+from unittest.mock import MagicMock
+
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
+
+from cli.dbedit import list as dbedit_list, remove as dbedit_remove
+from cli.dbedit.layouts import LAYOUTS
+from cli.dbedit.patch import (
+    apply_patch,
+    diff,
+    diff_paths,
+    patch_expression,
+    PatchOp,
+    size_change,
+    snapshot,
+)
+from .constants import TEST_METADATA_JSON, TEST_TRIAL_ID
+
+
+def test_diff():
+    assert diff({"a": 1}, {"a": 1}) == []
+    assert diff({"a": 1, "b": 2}, {"a": 3, "c": 4}) == [
+        PatchOp("delete", ("b",)),
+        PatchOp("set", ("a",), 3),
+        PatchOp("set", ("c",), 4),
+    ]
+
+    # removed elements are deleted last and from the end, changed ones are diffed
+    old = [{"id": 0}, {"id": 1, "x": [1, 2]}, {"id": 2}, {"id": 3}, {"id": 4}]
+    new = [{"id": 1, "x": [2]}, {"id": 3}]
+    ops = diff(old, new, ("list",))
+    assert ops == [
+        PatchOp("delete", ("list", 1, "x", 0)),
+        PatchOp("delete", ("list", 4)),
+        PatchOp("delete", ("list", 2)),
+        PatchOp("delete", ("list", 0)),
+    ]
+    assert apply_patch({"list": deepcopy(old)}, ops) == {"list": new}
+
+    # anything else sets the whole list
+    assert diff([1], [1, 2], ("list",)) == [PatchOp("set", ("list",), [1, 2])]
+    assert diff([1, 2], [3, 1], ("list",)) == [
+        PatchOp("set", ("list", 0), 3),
+        PatchOp("set", ("list", 1), 1),
+    ]
+
+
+def test_diff_paths():
+    doc = {"a": {"b": [1, 2]}, "c": {"d": 1}, "untouched": [0]}
+    before = snapshot(doc, [("a",), ("c", "d"), ("c", "e"), ("a",)])
+    assert list(before) == [("a",), ("c", "d"), ("c", "e")]
+
+    doc["a"]["b"].pop()
+    doc["c"].pop("d")
+    doc["c"]["e"] = None
+    doc["untouched"].append(1)  # outside of the snapshot, so ignored
+    assert diff_paths(before, doc) == [
+        PatchOp("delete", ("a", "b", 1)),
+        PatchOp("delete", ("c", "d")),
+        PatchOp("set", ("c", "e"), None),
+    ]
+    # drops ", 2" and 1, adds null
+    assert size_change(before, doc) == -3 - 1 + 4
+    doc["c"].pop("e")
+    assert size_change(before, doc) == -4
+
+
+def test_removals_match_full_rewrite(monkeypatch):
+    # every removal in the fixtures gives the same metadata_json either way
+    monkeypatch.setattr("builtins.print", MagicMock())
+    num_checked = 0
+    for name, layout in LAYOUTS.items():
+        if layout.kind in ("clinical_data", "misc_data"):
+            continue
+
+        for row in dbedit_list.iter_rows(TEST_METADATA_JSON, layout):
+            for num_ids in range(1, len(layout.target_ids) + 1):
+                target_id = tuple(str(v) for v in row[:num_ids])
+                full = deepcopy(TEST_METADATA_JSON)
+                before = snapshot(full, layout.paths)
+                updated, _ = dbedit_remove._apply_removal(
+                    full, TEST_TRIAL_ID, layout, target_id
+                )
+                if updated is None:
+                    continue
+
+                patched = apply_patch(
+                    deepcopy(TEST_METADATA_JSON), diff_paths(before, updated)
+                )
+                assert patched == updated, (name, target_id)
+                num_checked += 1
+
+    assert num_checked > 20
+
+
+def test_patch_expression():
+    column = sqlalchemy.column("metadata_json", JSONB)
+    expr = patch_expression(
+        column,
+        [
+            PatchOp("delete", ("assays", "wes", 0)),
+            PatchOp("set", ("assays", "olink"), {"batches": []}),
+        ],
+    )
+    compiled = expr.compile(dialect=postgresql.dialect())
+    assert str(compiled) == (
+        "jsonb_set((metadata_json #- %(patch_path_0)s::TEXT[]), "
+        "%(patch_path_1)s::TEXT[], CAST(%(patch_value_1)s AS JSONB))"
+    )
+    assert compiled.params == {
+        "patch_path_0": ["assays", "wes", "0"],
+        "patch_path_1": ["assays", "olink"],
+        "patch_value_1": '{"batches": []}',
+    }
+    assert patch_expression(column, []) is column
+
+    # however many operations, in one UPDATE
+    ops = [PatchOp("delete", ("assays", "wes", n)) for n in reversed(range(5000))]
+    table = sqlalchemy.table("trial_metadata", column)
+    update = sqlalchemy.update(table).values({column: patch_expression(column, ops)})
+    compiled = update.compile(dialect=postgresql.dialect())
+    assert str(compiled).count(" #- ") == 5000
+    assert compiled.params["patch_path_0"] == ["assays", "wes", "4999"]
@@ -7,6 +7,7 @@ from typing import Dict, List
 from unittest.mock import MagicMock, call
 
 from cli.dbedit import remove as dbedit_remove
+from cli.dbedit.patch import apply_patch, PatchOp
 from .constants import (
     TEST_CLINICAL_URL_CSV,
     TEST_CLINICAL_URL_XLSX,
@@ -62,6 +63,25 @@ CLIPPED_METADATA_ALL_CLINICAL: dict = {
 }
 
 
+def serve_patches(monkeypatch, get_trial_if_exists: MagicMock, mock_trial: MagicMock):
+    """
+    Getting the trial keeps a copy of its metadata_json, which the update then patches
+    as the database would, so the value of the update is the resulting metadata_json
+    """
+    fetched: List[dict] = []
+
+    def get_trial(*args, **kwargs):
+        fetched.append(deepcopy(mock_trial.metadata_json))
+        return mock_trial
+
+    get_trial_if_exists.side_effect = get_trial
+    monkeypatch.setattr(
+        dbedit_remove,
+        "patch_expression",
+        lambda column, ops: apply_patch(deepcopy(fetched[-1]), ops),
+    )
+
+
 def test_remove_clinical(monkeypatch):
     # mock the class
     DownloadableFiles = MagicMock()
@@ -104,11 +124,16 @@ def test_remove_clinical(monkeypatch):
     mock_trial._updated = datetime.fromisoformat("2020-01-01T12:34:45")
     get_trial_if_exists.return_value = mock_trial
     monkeypatch.setattr(dbedit_remove, "get_trial_if_exists", get_trial_if_exists)
+    serve_patches(monkeypatch, get_trial_if_exists, mock_trial)
 
     # mock table class
     TrialMetadata = MagicMock()
     monkeypatch.setattr(dbedit_remove, "TrialMetadata", TrialMetadata)
 
+    # mock deleting the files
+    bulk_delete = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "bulk_delete", bulk_delete)
+
     # convenience function
     def reset_mocks():
         Session.reset_mock()
@@ -116,6 +141,7 @@ def test_remove_clinical(monkeypatch):
         begin.reset_mock()
         query.reset_mock()
         filter_query.reset_mock()
+        bulk_delete.reset_mock()
         get_clinical_downloadable_files.reset_mock()
         [mock.reset_mock() for mock in mock_files]
         get_trial_if_exists.reset_mock()
@@ -159,7 +185,9 @@ def test_remove_clinical(monkeypatch):
         == {}
     )
 
-    session.delete.assert_called_once_with(mock_files[0])
+    bulk_delete.assert_called_once_with(
+        DownloadableFiles.object_url, [mock_files[0].object_url], session=session
+    )
 
     # test for proper removal of all files
     reset_mocks()
@@ -191,12 +219,10 @@ def test_remove_clinical(monkeypatch):
         == {}
     )
 
-    assert session.delete.call_count == 2
-    session.delete.assert_has_calls(
-        [
-            call(mock_files[0]),
-            call(mock_files[1]),
-        ]
+    bulk_delete.assert_called_once_with(
+        DownloadableFiles.object_url,
+        [mock_files[0].object_url, mock_files[1].object_url],
+        session=session,
     )
 
     # check that it exits if no matching file found
@@ -216,7 +242,7 @@ def test_remove_clinical(monkeypatch):
         assert pytest_wrapped_e.type == SystemExit
         assert pytest_wrapped_e.value.code == 0
     session.add.assert_not_called()
-    session.delete.assert_not_called()
+    bulk_delete.assert_not_called()
 
     # check that it exits if no files found for *
     reset_mocks()
@@ -235,7 +261,7 @@ def test_remove_clinical(monkeypatch):
         assert pytest_wrapped_e.type == SystemExit
         assert pytest_wrapped_e.value.code == 0
     session.add.assert_not_called()
-    session.delete.assert_not_called()
+    bulk_delete.assert_not_called()
 
 
 def test_remove_samples_from_blob():
@@ -246,7 +272,7 @@ def test_remove_samples_from_blob():
     }
 
     res = dbedit_remove._remove_samples_from_blob(
-        metadata_json=TEST_METADATA_JSON,
+        metadata_json=deepcopy(TEST_METADATA_JSON),
         samples_to_remove=samples_to_remove,
     )
 
@@ -273,10 +299,11 @@ def test_remove_shipment(monkeypatch):
     # mock getting the trial
     get_trial_if_exists = MagicMock()
     mock_trial = MagicMock()
-    mock_trial.metadata_json = TEST_METADATA_JSON
+    mock_trial.metadata_json = deepcopy(TEST_METADATA_JSON)
     mock_trial._updated = datetime.fromisoformat("2020-01-01T12:34:45")
-    get_trial_if_exists.first.return_value = mock_trial
+    get_trial_if_exists.return_value = mock_trial
     monkeypatch.setattr(dbedit_remove, "get_trial_if_exists", get_trial_if_exists)
+    serve_patches(monkeypatch, get_trial_if_exists, mock_trial)
 
     # mock getting the uploads
     mock_uploads = [MagicMock(), MagicMock(), MagicMock()]
@@ -332,15 +359,22 @@ def test_remove_shipment(monkeypatch):
     get_shipments.return_value = mock_uploads
     monkeypatch.setattr(dbedit_remove, "get_shipments", get_shipments)
 
-    # mock table class
+    # mock table classes
     TrialMetadata = MagicMock()
     monkeypatch.setattr(dbedit_remove, "TrialMetadata", TrialMetadata)
+    UploadJobs = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "UploadJobs", UploadJobs)
+
+    # mock deleting the uploads
+    bulk_delete = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "bulk_delete", bulk_delete)
 
     # convenience function
     def reset_mocks():
         Session.reset_mock()
         session.reset_mock()
         begin.reset_mock()
+        bulk_delete.reset_mock()
         get_trial_if_exists.reset_mock()
         mock_trial.reset_mock()
         [mock.reset_mock() for mock in mock_uploads]
@@ -368,14 +402,13 @@ def test_remove_shipment(monkeypatch):
     assert args[0][TrialMetadata._updated] != datetime.fromisoformat(
         "2020-01-01T12:34:45"
     )
-    args[0][TrialMetadata.metadata_json] == CLIPPED_METADATA_SHIPMENTS
+    # the target uploads remove all but CTTTPP302.00 from CTTTPP3
+    target_metadata = deepcopy(CLIPPED_METADATA_SHIPMENTS)
+    target_metadata["participants"][1]["samples"] = [{"cimac_id": "CTTTPP302.00"}]
+    assert DeepDiff(args[0][TrialMetadata.metadata_json], target_metadata) == {}
 
-    assert session.delete.call_count == 2
-    session.delete.assert_has_calls(
-        [
-            call(mock_uploads[0]),
-            call(mock_uploads[2]),
-        ]
+    bulk_delete.assert_called_once_with(
+        UploadJobs.id, [mock_uploads[0].id, mock_uploads[2].id], session=session
     )
 
     # check that it exits if no samples are in the matching manifest
@@ -404,7 +437,7 @@ def test_remove_shipment(monkeypatch):
         assert pytest_wrapped_e.value.code == 0
     remove_samples_from_blob.assert_not_called()
     session.add.assert_not_called()
-    session.delete.assert_not_called()
+    bulk_delete.assert_not_called()
 
     # check that it exits if no matching manifest found
     reset_mocks()
@@ -421,7 +454,302 @@ def test_remove_shipment(monkeypatch):
         assert pytest_wrapped_e.value.code == 0
     remove_samples_from_blob.assert_not_called()
     session.add.assert_not_called()
-    session.delete.assert_not_called()
+    bulk_delete.assert_not_called()
+
+
+def test_remove_clinical_and_shipment_phases(monkeypatch):
+    """Check --dry-run and --two-phase for clinical files and shipments"""
+    Session = MagicMock()
+    session = MagicMock()
+    Session.begin.return_value.__enter__.return_value = session
+    monkeypatch.setattr(dbedit_remove, "Session", Session)
+    monkeypatch.setattr(dbedit_remove, "TrialMetadata", MagicMock())
+    DownloadableFiles = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "DownloadableFiles", DownloadableFiles)
+    UploadJobs = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "UploadJobs", UploadJobs)
+
+    mock_trial = MagicMock()
+    mock_trial.metadata_json = deepcopy(TEST_METADATA_JSON)
+    mock_trial._etag = "etag"
+    mock_trial._updated = "updated"
+    get_trial_if_exists = MagicMock(return_value=mock_trial)
+    monkeypatch.setattr(dbedit_remove, "get_trial_if_exists", get_trial_if_exists)
+    serve_patches(monkeypatch, get_trial_if_exists, mock_trial)
+    get_trial_version = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "get_trial_version", get_trial_version)
+
+    mock_file = MagicMock()
+    mock_file.object_url = f"{TEST_TRIAL_ID}/clinical/{TEST_CLINICAL_URL_XLSX}"
+    session.query.return_value.filter.return_value.all.return_value = [mock_file]
+    mock_upload = MagicMock()
+    mock_upload.metadata_patch = {
+        "participants": [
+            {
+                "cimac_participant_id": "CTTTPP2",
+                "samples": [{"cimac_id": "CTTTPP201.00"}, {"cimac_id": "CTTTPP202.00"}],
+            }
+        ],
+        "shipments": [{"manifest_id": TEST_MANIFEST_ID}],
+    }
+    monkeypatch.setattr(
+        dbedit_remove, "get_shipments", MagicMock(return_value=[mock_upload])
+    )
+    bulk_count = MagicMock(return_value=1)
+    monkeypatch.setattr(dbedit_remove, "bulk_count", bulk_count)
+    bulk_delete = MagicMock()
+    monkeypatch.setattr(dbedit_remove, "bulk_delete", bulk_delete)
+    update = session.query.return_value.filter.return_value.update
+    mock_print = MagicMock()
+    monkeypatch.setattr("builtins.print", mock_print)
+
+    # dry runs plan from an unlocked read, and change nothing
+    dbedit_remove.remove_clinical(TEST_TRIAL_ID, TEST_CLINICAL_URL_XLSX, dry_run=True)
+    dbedit_remove.remove_shipment(TEST_TRIAL_ID, TEST_MANIFEST_ID, dry_run=True)
+    assert (
+        get_trial_if_exists.call_args_list
+        == [call(TEST_TRIAL_ID, with_for_update=False, session=session)] * 2
+    )
+    assert mock_trial.metadata_json == TEST_METADATA_JSON
+    update.assert_not_called()
+    bulk_delete.assert_not_called()
+    get_trial_version.assert_not_called()
+    printed = [c.args for c in mock_print.call_args_list]
+    assert printed[0] == (f"Plan for trial {TEST_TRIAL_ID}: 1 of 1 removals",)
+    assert ("  1 files, 1 in downloadable_files:",) in printed
+    assert (f"    {mock_file.object_url}",) in printed
+    assert printed[-1] == (
+        "  1 upload_jobs, 2 samples",
+        "across 1 participants",
+    )
+
+    # two phase aborts if the trial changed since it was planned
+    mock_print.reset_mock()
+    get_trial_version.return_value = ("etag", "later")
+    dbedit_remove.remove_clinical(TEST_TRIAL_ID, TEST_CLINICAL_URL_XLSX, two_phase=True)
+    dbedit_remove.remove_shipment(TEST_TRIAL_ID, TEST_MANIFEST_ID, two_phase=True)
+    assert (
+        get_trial_version.call_args_list
+        == [call(TEST_TRIAL_ID, with_for_update=True, session=session)] * 2
+    )
+    update.assert_not_called()
+    bulk_delete.assert_not_called()
+    assert (
+        mock_print.call_args_list
+        == [
+            call(
+                f"Trial {TEST_TRIAL_ID} changed since its removal was planned,",
+                "so nothing was removed; try again",
+            )
+        ]
+        * 2
+    )
+
+    # and otherwise applies the plan under the lock
+    get_trial_version.return_value = ("etag", "updated")
+    dbedit_remove.remove_clinical(TEST_TRIAL_ID, TEST_CLINICAL_URL_XLSX, two_phase=True)
+    assert mock_trial.metadata_json == TEST_METADATA_JSON
+    args, _ = update.call_args
+    assert (
+        DeepDiff(
+            args[0][dbedit_remove.TrialMetadata.metadata_json],
+            CLIPPED_METADATA_TARGET_CLINICAL,
+        )
+        == {}
+    )
+    bulk_delete.assert_called_once_with(
+        DownloadableFiles.object_url, [mock_file.object_url], session=session
+    )
+
+    bulk_delete.reset_mock()
+    dbedit_remove.remove_shipment(TEST_TRIAL_ID, TEST_MANIFEST_ID, two_phase=True)
+    assert mock_trial.metadata_json == TEST_METADATA_JSON
+    args, _ = update.call_args
+    metadata_json = args[0][dbedit_remove.TrialMetadata.metadata_json]
+    assert [s["manifest_id"] for s in metadata_json["shipments"]] == [
+        TEST_MANIFEST_ID + "2"
+    ]
+    assert "CTTTPP2" not in {
+        p["cimac_participant_id"] for p in metadata_json["participants"]
+    }
+    bulk_delete.assert_called_once_with(
+        UploadJobs.id, [mock_upload.id], session=session
+    )
+
+
+def _recursive_object_urls(target: dict) -> List[str]:
+    # the original recursive implementation, for reference
+    ret = []
+    for key, value in target.items():
+        if key == "object_url":
+            ret.append(value)
+        if isinstance(value, dict):
+            ret.extend(_recursive_object_urls(value))
+        if isinstance(value, list):
+            for each in value:
+                if isinstance(each, dict):
+                    ret.extend(_recursive_object_urls(each))
+    return ret
+
+
+def test_get_all_object_urls():
+    expected = _recursive_object_urls(TEST_METADATA_JSON)
+    assert len(expected) > 20
+    assert dbedit_remove._get_all_object_urls(TEST_METADATA_JSON) == expected
+    assert list(dbedit_remove._iter_object_urls({"a": [[{"object_url": 1}]]})) == []
+
+
+def test_removals_with_id_index(monkeypatch):
+    monkeypatch.setattr("builtins.print", MagicMock())
+    targets = [
+        (
+            "olink",
+            (
+                "olink_batch_2",
+                f"{TEST_TRIAL_ID}/olink/batch_olink_batch_2/chip_0/assay_npx.xlsx",
+            ),
+        ),
+        ("olink", ("olink_batch_2",)),
+        ("olink", ("olink_batch",)),
+        ("elisa", ("elisa_batch",)),
+        ("elisa", ("elisa_batch_2",)),
+        ("nanostring", ("nanostring_batch", "nanostring_run")),
+        ("wes_analysis", ("run_1",)),
+        ("cytof_analysis", ("cytof_batch", "CTTTPP101.00")),
+        ("cytof_analysis", ("cytof_batch",)),
+        ("tcr_analysis", ("tcr_batch",)),
+    ]
+
+    without_index = deepcopy(TEST_METADATA_JSON)
+    with_index = deepcopy(TEST_METADATA_JSON)
+    ids = dbedit_remove.IdIndex()
+    num_urls = 0
+    # removing again fails the same way with or without the index
+    for assay_or_analysis, target_id in targets + targets:
+        layout = dbedit_remove.LAYOUTS[assay_or_analysis]
+        expected = dbedit_remove._apply_removal(
+            without_index, TEST_TRIAL_ID, layout, target_id
+        )
+        assert (
+            dbedit_remove._apply_removal(
+                with_index, TEST_TRIAL_ID, layout, target_id, ids=ids
+            )
+            == expected
+        ), (assay_or_analysis, target_id)
+        num_urls += len(expected[1])
+
+    assert num_urls > 10
+
+
+def test_id_index():
+    get_id = lambda entry: entry["id"]
+    entries = [{"id": i % 4, "n": i} for i in range(8)]
+    ids = dbedit_remove.IdIndex()
+    assert ids.find(entries, get_id, 3) == 3
+    assert ids.find(entries, get_id, "foo") is None
+
+    entries.pop(1)
+    assert ids.find(entries, get_id, 3) == 2
+    assert ids.find(entries, get_id, 0) == 0
+    # the first with a repeated id was popped, so finds the next
+    assert ids.find(entries, get_id, 1) == 4
+    assert entries[4] == {"id": 1, "n": 5}
+
+    # a new list with the same contents is indexed again
+    assert ids.find(list(reversed(entries)), get_id, 3) == 0
+
+    # remembered lists are indexed as they were then, even if searched after pops
+    entries = [{"id": i} for i in range(4)]
+    ids = dbedit_remove.IdIndex()
+    ids.remember(entries)
+    ids.remember(entries[:1])
+    entries.pop(1)
+    ids.remember(entries)
+    assert ids.find(entries, get_id, 2) == 1
+    assert ids.find(entries, get_id, 1) is None
+    # positions are from before the pop
+    assert ids.find_position(entries, 0) == 0
+    assert ids.find_position(entries, 1) is None
+    assert ids.find_position(entries, 3) == 2
+    assert ids.find_position(entries, 4) is None
+    entries.pop(0)
+    assert ids.find_position(entries, 2) == 0
+    assert ids.find(entries, get_id, 3) == 1
+
+
+def test_plan_positional_removals(monkeypatch):
+    """Check that positional ids are the positions before any removals"""
+    monkeypatch.setattr("builtins.print", MagicMock())
+    metadata_json = {
+        "assays": {
+            "wes": [{"records": [{"cimac_id": f"CTTTPP10{n}.00"}]} for n in range(4)],
+            "misc_data": [
+                {"files": [{"file": {"object_url": f"{TEST_TRIAL_ID}/misc_data/{n}"}}]}
+                for n in range(3)
+            ],
+        },
+    }
+    targets = [
+        (TEST_TRIAL_ID, "wes", ("1",)),
+        (TEST_TRIAL_ID, "wes", ("2",)),
+        (TEST_TRIAL_ID, "wes", ("3", "CTTTPP103.00")),
+        (TEST_TRIAL_ID, "wes", ("1",)),
+        (TEST_TRIAL_ID, "misc_data", ("0",)),
+        (TEST_TRIAL_ID, "misc_data", ("1",)),
+        (TEST_TRIAL_ID, "misc_data", ("2", "2")),
+    ]
+    expected = deepcopy(metadata_json)
+    # removing its only record removes the batch too
+    expected["assays"]["wes"] = expected["assays"]["wes"][:1]
+    expected["assays"]["misc_data"] = [{"files": []}]
+
+    plan = dbedit_remove._plan_removals(metadata_json, TEST_TRIAL_ID, targets)
+    assert metadata_json == expected
+    # the same batch can't be removed twice
+    assert plan.failed == [targets[3]]
+    assert plan.made == targets[:3] + targets[4:]
+    assert plan.object_urls == [f"{TEST_TRIAL_ID}/misc_data/{n}" for n in range(3)]
+
+
+def test_update_trial_in_chunks(monkeypatch):
+    """Check that many operations are applied in several UPDATEs, in order"""
+    monkeypatch.setattr(dbedit_remove, "PATCH_OPS_PER_STATEMENT", 3)
+    monkeypatch.setattr(dbedit_remove, "TrialMetadata", MagicMock())
+    monkeypatch.setattr(dbedit_remove, "patch_expression", lambda column, ops: ops)
+    session = MagicMock()
+    update = session.query.return_value.filter.return_value.update
+
+    ops = [PatchOp("delete", ("assays", "wes", n)) for n in reversed(range(7))]
+    dbedit_remove._update_trial(session, TEST_TRIAL_ID, ops)
+    chunks = [
+        args[0][dbedit_remove.TrialMetadata.metadata_json]
+        for args, _ in update.call_args_list
+    ]
+    assert chunks == [ops[:3], ops[3:6], ops[6:]]
+
+    # still updates _updated without any operations
+    update.reset_mock()
+    dbedit_remove._update_trial(session, TEST_TRIAL_ID, [])
+    (values,), _ = update.call_args
+    assert list(values) == [dbedit_remove.TrialMetadata._updated]
+
+
+def test_read_removal_targets(tmp_path):
+    removals = tmp_path / "targets.tsv"
+    removals.write_text(
+        "trial_id\tassay_or_analysis\ttarget_id\n"
+        "# comments and blank lines are skipped\n"
+        "\n"
+        "foo\telisa\telisa_batch\n"
+        "bar\tolink\tolink_batch\tcombined\t\n"
+    )
+    assert dbedit_remove.read_removal_targets(str(removals)) == [
+        ("foo", "elisa", ("elisa_batch",)),
+        ("bar", "olink", ("olink_batch", "combined")),
+    ]
+
+    removals.write_text("foo\telisa\telisa_batch\nfoo\telisa\n")
+    assert dbedit_remove.read_removal_targets(str(removals)) is None
 
 
 class Test_remove_data:
@@ -454,6 +782,8 @@ class Test_remove_data:
 
         self.DownloadableFiles = MagicMock()
         self.TrialMetadata = MagicMock()
+        self.bulk_delete = MagicMock()
+        self.bulk_count = MagicMock()
 
         self.monkeypatch = MonkeyPatch()
         self.monkeypatch.setattr(dbedit_remove, "Session", self.Session)
@@ -467,7 +797,15 @@ class Test_remove_data:
             dbedit_remove, "DownloadableFiles", self.DownloadableFiles
         )
         self.monkeypatch.setattr(dbedit_remove, "TrialMetadata", self.TrialMetadata)
+        self.monkeypatch.setattr(dbedit_remove, "bulk_delete", self.bulk_delete)
+        self.monkeypatch.setattr(dbedit_remove, "bulk_count", self.bulk_count)
         self.monkeypatch.setattr("builtins.print", self.mock_print)
+        serve_patches(self.monkeypatch, self.get_trial_if_exists, self.mock_trial)
+
+    def assert_files_deleted(self, object_urls: List[str]):
+        self.bulk_delete.assert_called_once_with(
+            self.DownloadableFiles.object_url, object_urls, session=self.session
+        )
 
     def test_bail_outs(self):
         dbedit_remove.remove_data(
@@ -483,8 +821,179 @@ class Test_remove_data:
         )
         self.mock_print.assert_not_called()
         self.mock_remove_clinical.assert_called_once_with(
-            trial_id="foo", target_id="bar"
+            trial_id="foo",
+            target_id="bar",
+            dry_run=False,
+            two_phase=False,
+            delete_objects=False,
+        )
+
+    def test_batch(self):
+        olink_url = f"{TEST_TRIAL_ID}/olink/batch_olink_batch_2/chip_0/assay_npx.xlsx"
+        targets = [
+            ("foo", "elisa", ("elisa_batch",)),
+            ("foo", "elisa", ("bar",)),
+            ("foo", "elisa", ("elisa_batch_2",)),
+            ("foo", "olink", ("olink_batch_2", olink_url)),
+        ]
+
+        # bails before touching the database
+        dbedit_remove.remove_data_batch(targets + [("foo", "bar", ("baz",))])
+        self.mock_print.assert_called_once_with(
+            "Assay / analysis not supported:", "bar"
+        )
+        self.Session.begin.assert_not_called()
+
+        self.mock_print.reset_mock()
+        dbedit_remove.remove_data_batch(targets + [("foo", "clinical_data", ("baz",))])
+        self.mock_print.assert_called_once_with(
+            "Error: clinical_data cannot be removed in a batch,",
+            "use $ cidc admin remove clinical TRIAL_ID FILE_NAME",
+        )
+        self.Session.begin.assert_not_called()
+
+        # all removals for a trial are applied together, skipping failures
+        target_metadata = deepcopy(TEST_METADATA_JSON)
+        target_metadata["assays"].pop("elisa")
+        target_metadata["assays"]["olink"]["batches"][1]["records"].pop(0)
+        self.mock_print.reset_mock()
+        dbedit_remove.remove_data_batch(targets)
+
+        self.Session.begin.assert_called_once_with()
+        self.get_trial_if_exists.assert_called_once_with(
+            "foo", with_for_update=True, session=self.session
+        )
+        self.filter_query.update.assert_called_once()
+        args, _ = self.filter_query.update.call_args
+        assert (
+            DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
+        )
+        self.assert_files_deleted(
+            [
+                f"{TEST_TRIAL_ID}/elisa/elisa_batch/assay.xlsx",
+                f"{TEST_TRIAL_ID}/elisa/elisa_batch_2/assay.xlsx",
+                f"{TEST_TRIAL_ID}/elisa/elisa_batch_2/ALL object_urls",
+                olink_url,
+            ]
+        )
+        assert self.mock_print.call_args_list == [
+            call("Cannot find elisa batch bar for trial foo"),
+            call(
+                "Updated trial foo, making 3 of 4 removals",
+                f"along with {self.bulk_delete.return_value} files",
+            ),
+            call("Made 3 of 4 removals", "across 1 trials"),
+            call(f"Failed to remove foo elisa values {('bar',)}"),
+        ]
+
+    def test_dry_run_and_two_phase(self):
+        olink_url = f"{TEST_TRIAL_ID}/olink/batch_olink_batch_2/chip_0/assay_npx.xlsx"
+        targets = [
+            ("foo", "elisa", ("elisa_batch",)),
+            ("foo", "elisa", ("bar",)),
+            ("foo", "olink", ("olink_batch_2", olink_url)),
+        ]
+        target_metadata = deepcopy(TEST_METADATA_JSON)
+        target_metadata["assays"]["elisa"].pop(0)
+        target_metadata["assays"]["olink"]["batches"][1]["records"].pop(0)
+        self.mock_trial._etag = "etag"
+        self.mock_trial._updated = "updated"
+        get_trial_version = MagicMock()
+        self.monkeypatch.setattr(dbedit_remove, "get_trial_version", get_trial_version)
+
+        # dry run plans from an unlocked read, and changes nothing
+        self.bulk_count.return_value = 2
+        dbedit_remove.remove_data_batch(targets, dry_run=True)
+        self.get_trial_if_exists.assert_called_once_with("foo", session=self.session)
+        assert self.mock_trial.metadata_json == TEST_METADATA_JSON
+        self.filter_query.update.assert_not_called()
+        self.bulk_delete.assert_not_called()
+        get_trial_version.assert_not_called()
+        self.bulk_count.assert_called_once_with(
+            self.DownloadableFiles.object_url,
+            [f"{TEST_TRIAL_ID}/elisa/elisa_batch/assay.xlsx", olink_url],
+            session=self.session,
+        )
+        printed = [c.args for c in self.mock_print.call_args_list]
+        assert printed[:2] == [
+            ("Cannot find elisa batch bar for trial foo",),
+            ("Plan for trial foo: 2 of 3 removals",),
+        ]
+        assert ("  2 files, 2 in downloadable_files:",) in printed
+        assert (f"    {olink_url}",) in printed
+        assert printed[-3][0].startswith("  metadata_json changes by -")
+        assert printed[-2:] == [
+            ("Can make 2 of 3 removals", "across 1 trials"),
+            (f"Cannot remove foo elisa values {('bar',)}",),
+        ]
+
+        # two phase aborts if the trial changed since it was planned
+        self.mock_print.reset_mock()
+        self.get_trial_if_exists.reset_mock()
+        get_trial_version.return_value = ("etag", "later")
+        dbedit_remove.remove_data_batch(targets, two_phase=True)
+        self.get_trial_if_exists.assert_called_once_with("foo", session=self.session)
+        get_trial_version.assert_called_once_with(
+            "foo", with_for_update=True, session=self.session
+        )
+        self.filter_query.update.assert_not_called()
+        self.bulk_delete.assert_not_called()
+        assert self.mock_print.call_args_list[1:3] == [
+            call(
+                "Trial foo changed since its removals were planned,",
+                "so none were made; try again",
+            ),
+            call("Made 0 of 3 removals", "across 1 trials"),
+        ]
+
+        # and otherwise applies the plan under the lock
+        self.mock_print.reset_mock()
+        get_trial_version.return_value = ("etag", "updated")
+        dbedit_remove.remove_data(
+            trial_id="foo",
+            assay_or_analysis="elisa",
+            target_id=("elisa_batch",),
+            two_phase=True,
+        )
+        dbedit_remove.remove_data_batch(targets, two_phase=True)
+        assert self.mock_trial.metadata_json == TEST_METADATA_JSON
+        assert self.filter_query.update.call_count == 2
+        args, _ = self.filter_query.update.call_args
+        assert (
+            DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
+        )
+        assert self.mock_print.call_args_list[-3:] == [
+            call(
+                "Updated trial foo, making 2 of 3 removals",
+                f"along with {self.bulk_delete.return_value} files",
+            ),
+            call("Made 2 of 3 removals", "across 1 trials"),
+            call(f"Failed to remove foo elisa values {('bar',)}"),
+        ]
+
+    def test_delete_objects(self):
+        # objects are only deleted once the transaction is committed
+        delete_objects = MagicMock(
+            side_effect=lambda urls: self.begin.__exit__.assert_called_once()
+        )
+        self.monkeypatch.setattr(dbedit_remove.gcs, "delete_objects", delete_objects)
+        dbedit_remove.remove_data(
+            trial_id="foo",
+            assay_or_analysis="elisa",
+            target_id=("elisa_batch",),
+            delete_objects=True,
+        )
+        delete_objects.assert_called_once_with(
+            [f"{TEST_TRIAL_ID}/elisa/elisa_batch/assay.xlsx"]
+        )
+
+        # and not if nothing was removed
+        delete_objects.reset_mock()
+        self.begin.__exit__.reset_mock()
+        dbedit_remove.remove_data_batch(
+            [("foo", "elisa", ("bar",))], delete_objects=True
         )
+        delete_objects.assert_not_called()
 
     def test_olink(self):
         # if no matching batch, bails
@@ -536,14 +1045,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing olink values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/olink/batch_olink_batch_2/chip_0/assay_npx.xlsx",
             ]
@@ -551,7 +1060,7 @@ class Test_remove_data:
 
         # remove a combined file
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"]["olink"]["batches"][0].pop("combined")
         self.mock_print.reset_mock()
         target_id = (
@@ -565,14 +1074,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing olink values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/olink/batch_olink_batch/combined_npx.xlsx",
             ]
@@ -580,7 +1089,7 @@ class Test_remove_data:
 
         # remove a whole batch
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"]["olink"]["batches"].pop(1)
         self.mock_print.reset_mock()
         dbedit_remove.remove_data(
@@ -590,14 +1099,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing olink values {('olink_batch_2',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/olink/batch_olink_batch_2/chip_1/assay_npx.xlsx",
             ]
@@ -605,7 +1114,7 @@ class Test_remove_data:
 
         # remove a study-wide file
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"]["olink"].pop("study")
         self.mock_print.reset_mock()
         dbedit_remove.remove_data(
@@ -616,14 +1125,14 @@ class Test_remove_data:
 
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing olink values {('study',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/olink/study_npx.xlsx",
                 f"{TEST_TRIAL_ID}/olink/ALL object_urls",
@@ -632,7 +1141,7 @@ class Test_remove_data:
 
         # remove last record removes whole batch and assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"].pop("olink")
         self.mock_print.reset_mock()
         target_id = (
@@ -646,14 +1155,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing olink values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/olink/batch_olink_batch/chip_0/assay_npx.xlsx",
                 f"{TEST_TRIAL_ID}/olink/batch_olink_batch/chip_0/ALL object_urls",
@@ -672,7 +1181,7 @@ class Test_remove_data:
             "Cannot find elisa batch bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single run
         target_metadata = deepcopy(TEST_METADATA_JSON)
@@ -685,14 +1194,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing elisa values {('elisa_batch',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/elisa/elisa_batch/assay.xlsx",
             ]
@@ -700,7 +1209,7 @@ class Test_remove_data:
 
         # remove last run removes whole assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"].pop("elisa")
         self.mock_print.reset_mock()
         dbedit_remove.remove_data(
@@ -710,14 +1219,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing elisa values {('elisa_batch_2',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/elisa/elisa_batch_2/assay.xlsx",
                 f"{TEST_TRIAL_ID}/elisa/elisa_batch_2/ALL object_urls",
@@ -734,7 +1243,7 @@ class Test_remove_data:
             "Cannot find nanostring batch bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # if no matching run_id, bails
         self.mock_print.reset_mock()
@@ -747,7 +1256,7 @@ class Test_remove_data:
             "Cannot find a run bar in nanostring batch nanostring_batch for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single run
         target_metadata = deepcopy(TEST_METADATA_JSON)
@@ -764,14 +1273,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing nanostring values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/nanostring/nanostring_batch/nanostring_batch_run/control.rcc",
                 f"{TEST_TRIAL_ID}/nanostring/nanostring_batch/nanostring_batch_run/CTTTPP101.00.rcc",
@@ -781,7 +1290,7 @@ class Test_remove_data:
         # remove a single batch
         target_metadata["assays"]["nanostring"].pop(1)
         self.mock_print.reset_mock()
-        self.DownloadableFiles.object_url.reset_mock()
+        self.bulk_delete.reset_mock()
         self.filter_query.update.reset_mock()
         dbedit_remove.remove_data(
             trial_id="foo",
@@ -790,14 +1299,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing nanostring values {('nanostring_batch_2',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/nanostring/nanostring_batch_2/normalized_data.csv",
                 f"{TEST_TRIAL_ID}/nanostring/nanostring_batch_2/nanostring_batch_2_run/control.rcc",
@@ -806,7 +1315,7 @@ class Test_remove_data:
         )
         # remove last run removes whole batch and assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"].pop("nanostring")
         self.mock_print.reset_mock()
         target_id = ("nanostring_batch", "nanostring_batch_run_2")
@@ -817,14 +1326,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing nanostring values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/nanostring/nanostring_batch/nanostring_batch_run_2/control.rcc",
                 f"{TEST_TRIAL_ID}/nanostring/nanostring_batch/nanostring_batch_run_2/CTTTPP201.00.rcc",
@@ -842,7 +1351,7 @@ class Test_remove_data:
             "Cannot find cytof analysis batch bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # if no matching run_id, bails
         self.mock_print.reset_mock()
@@ -855,7 +1364,7 @@ class Test_remove_data:
             "Cannot find cytof analysis for sample bar in batch cytof_batch for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single run
         target_metadata = deepcopy(TEST_METADATA_JSON)
@@ -872,14 +1381,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing cytof_analysis values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/cytof_analysis/cytof_run/cytof_batch/CTTTPP101.00/assignment.csv",
                 f"{TEST_TRIAL_ID}/cytof_analysis/cytof_run/cytof_batch/CTTTPP101.00/source.fcs",
@@ -890,7 +1399,7 @@ class Test_remove_data:
         target_metadata["assays"]["cytof"][1].pop("astrolabe_analysis")
         target_metadata["assays"]["cytof"][1]["records"][0].pop("output_files")
         self.mock_print.reset_mock()
-        self.DownloadableFiles.object_url.reset_mock()
+        self.bulk_delete.reset_mock()
         self.filter_query.update.reset_mock()
         dbedit_remove.remove_data(
             trial_id="foo",
@@ -899,14 +1408,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing cytof_analysis values {('cytof_batch_2',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/cytof_analysis/cytof_run/cytof_batch_2/reports.zip",
                 f"{TEST_TRIAL_ID}/cytof_analysis/cytof_run/cytof_batch_2/CTTTPP102.00/assignment.csv",
@@ -924,7 +1433,7 @@ class Test_remove_data:
             "Cannot find RNA analysis for bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single sample
         self.mock_print.reset_mock()
@@ -937,14 +1446,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing rna_level1_analysis values {('CTTTPP101.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/rna/CTTTPP101.00/analysis/error.yaml",
             ],
@@ -953,7 +1462,7 @@ class Test_remove_data:
         # remove down to a single samples
         self.mock_print.reset_mock()
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["analysis"]["rna_analysis"]["level_1"].pop(
             1
         )  # the last of 3 (now 2)
@@ -964,14 +1473,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing rna_level1_analysis values {('CTTTPP102.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/rna/CTTTPP102.00/analysis/error.yaml",
             ],
@@ -979,7 +1488,7 @@ class Test_remove_data:
 
         # remove last sample removes whole assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         self.mock_print.reset_mock()
         target_metadata["analysis"].pop("rna_analysis")
         self.mock_print.reset_mock()
@@ -990,14 +1499,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing rna_level1_analysis values {('CTTTPP201.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/rna/CTTTPP201.00/analysis/error.yaml",
             ],
@@ -1013,7 +1522,7 @@ class Test_remove_data:
             "Cannot find WES paired analysis for bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single pair run
         self.mock_print.reset_mock()
@@ -1027,14 +1536,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes_analysis values {('CTTTPP101.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes/CTTTPP101.00/analysis/error.yaml",
             ],
@@ -1043,7 +1552,7 @@ class Test_remove_data:
         # remove a pair run in both "wes_analysis" and "wes_analysis_old"
         self.mock_print.reset_mock()
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["analysis"]["wes_analysis"]["pair_runs"].pop(
             0
         )  # the second of 3, now first 2
@@ -1055,14 +1564,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes_analysis values {('CTTTPP102.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes/CTTTPP102.00/analysis/error.yaml",
                 f"{TEST_TRIAL_ID}/wes/CTTTPP102.00/analysis/error.yaml",
@@ -1072,7 +1581,7 @@ class Test_remove_data:
         # old_only, there's another one in wes_analysis
         # remove last pair run removes whole assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         self.mock_print.reset_mock()
         target_metadata["analysis"].pop("wes_analysis_old")
         self.mock_print.reset_mock()
@@ -1083,14 +1592,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes_analysis_old values {('CTTTPP201.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes/CTTTPP201.00/analysis/error.yaml",
             ],
@@ -1108,7 +1617,7 @@ class Test_remove_data:
             "Cannot find WES tumor-only analysis for bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single pair run
         self.mock_print.reset_mock()
@@ -1122,14 +1631,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes_tumor_only_analysis values {('CTTTPP101.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes_tumor_only/CTTTPP101.00/analysis/error.yaml",
             ],
@@ -1138,7 +1647,7 @@ class Test_remove_data:
         # remove a pair run in both "wes_tumor_only_analysis" and "wes_tumor_only_analysis_old"
         self.mock_print.reset_mock()
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["analysis"]["wes_tumor_only_analysis"]["runs"].pop(
             0
         )  # the second of 3, now first 2
@@ -1150,14 +1659,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes_tumor_only_analysis values {('CTTTPP102.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes_tumor_only/CTTTPP102.00/analysis/error.yaml",
                 f"{TEST_TRIAL_ID}/wes_tumor_only/CTTTPP102.00/analysis/error.yaml",
@@ -1167,7 +1676,7 @@ class Test_remove_data:
         # old_only, there's another one in wes_tumor_only_analysis
         # remove last pair run removes whole assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         self.mock_print.reset_mock()
         target_metadata["analysis"].pop("wes_tumor_only_analysis_old")
         self.mock_print.reset_mock()
@@ -1178,14 +1687,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes_tumor_only_analysis_old values {('CTTTPP201.00',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes_tumor_only/CTTTPP201.00/analysis/error.yaml",
             ],
@@ -1201,7 +1710,7 @@ class Test_remove_data:
             "Cannot find tcr_analysis batch bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # if no matching cimac_id, bails
         self.mock_print.reset_mock()
@@ -1214,7 +1723,7 @@ class Test_remove_data:
             "Cannot find tcr_analysis for sample bar in batch tcr_analysis_batch for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single batch
         target_metadata = deepcopy(TEST_METADATA_JSON)
@@ -1231,14 +1740,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing tcr_analysis values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/tcr_analysis/tcr_analysis_batch/CTTTPP101.00/tra_clone.csv",
             ]
@@ -1247,7 +1756,7 @@ class Test_remove_data:
         # remove a single batch
         target_metadata["analysis"]["tcr_analysis"]["batches"].pop(1)
         self.mock_print.reset_mock()
-        self.DownloadableFiles.object_url.reset_mock()
+        self.bulk_delete.reset_mock()
         self.filter_query.update.reset_mock()
         dbedit_remove.remove_data(
             trial_id="foo",
@@ -1256,14 +1765,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing tcr_analysis values {('tcr_analysis_batch_2',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/tcr_analysis/tcr_analysis_batch_2/report_trial.tar.gz",
                 f"{TEST_TRIAL_ID}/tcr_analysis/tcr_analysis_batch_2/CTTTPP102.00/tra_clone.csv",
@@ -1271,7 +1780,7 @@ class Test_remove_data:
         )
         # remove last run removes whole batch and assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["analysis"].pop("tcr_analysis")
         self.mock_print.reset_mock()
         target_id = ("tcr_analysis_batch", "CTTTPP201.00")
@@ -1282,14 +1791,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing tcr_analysis values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/tcr_analysis/tcr_analysis_batch/CTTTPP201.00/tra_clone.csv",
                 f"{TEST_TRIAL_ID}/tcr_analysis/tcr_analysis_batch/report_trial.tar.gz",
@@ -1306,7 +1815,7 @@ class Test_remove_data:
             "Cannot find atacseq_analysis batch bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # if no matching cimac_id, bails
         self.mock_print.reset_mock()
@@ -1319,7 +1828,7 @@ class Test_remove_data:
             "Cannot find atacseq_analysis for sample bar in batch atacseq_analysis_batch for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single batch
         target_metadata = deepcopy(TEST_METADATA_JSON)
@@ -1336,14 +1845,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing atacseq_analysis values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/atacseq/CTTTPP101.00/analysis/aligned_sorted.bam",
             ]
@@ -1352,7 +1861,7 @@ class Test_remove_data:
         # remove a single batch
         target_metadata["analysis"]["atacseq_analysis"].pop(1)
         self.mock_print.reset_mock()
-        self.DownloadableFiles.object_url.reset_mock()
+        self.bulk_delete.reset_mock()
         self.filter_query.update.reset_mock()
         dbedit_remove.remove_data(
             trial_id="foo",
@@ -1361,14 +1870,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing atacseq_analysis values {('atacseq_analysis_batch_2',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/atacseq/analysis/atacseq_analysis_batch_2/report.zip",
                 f"{TEST_TRIAL_ID}/atacseq/CTTTPP102.00/analysis/aligned_sorted.bam",
@@ -1377,7 +1886,7 @@ class Test_remove_data:
 
         # remove last run removes whole batch and assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["analysis"].pop("atacseq_analysis")
         self.mock_print.reset_mock()
         target_id = ("atacseq_analysis_batch", "CTTTPP201.00")
@@ -1388,14 +1897,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing atacseq_analysis values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/atacseq/CTTTPP201.00/analysis/aligned_sorted.bam",
                 f"{TEST_TRIAL_ID}/atacseq/analysis/atacseq_analysis_batch/report.zip",
@@ -1417,7 +1926,7 @@ class Test_remove_data:
             "Cannot find wes batch bar for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # if no matching cimac_id, bails
         self.mock_print.reset_mock()
@@ -1430,7 +1939,7 @@ class Test_remove_data:
             "Cannot find wes for sample bar in batch 0 for trial foo"
         )
         self.query.assert_not_called()
-        self.session.delete.assert_not_called()
+        self.bulk_delete.assert_not_called()
 
         # remove a single batch
         target_metadata = deepcopy(TEST_METADATA_JSON)
@@ -1447,14 +1956,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes/CTTTPP101.00/reads_0.bam",
                 f"{TEST_TRIAL_ID}/wes/CTTTPP101.00/reads_1.bam",
@@ -1464,7 +1973,7 @@ class Test_remove_data:
         # remove a single batch
         target_metadata["assays"]["wes"].pop(1)
         self.mock_print.reset_mock()
-        self.DownloadableFiles.object_url.reset_mock()
+        self.bulk_delete.reset_mock()
         self.filter_query.update.reset_mock()
         dbedit_remove.remove_data(
             trial_id="foo",
@@ -1473,21 +1982,21 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes values {('1',)}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes/CTTTPP102.00/reads_0.bam",
             ]
         )
         # remove last run removes whole batch and assay
         self.filter_query.update.reset_mock()
-        self.DownloadableFiles.object_url.in_.reset_mock()
+        self.bulk_delete.reset_mock()
         target_metadata["assays"].pop("wes")
         self.mock_print.reset_mock()
         target_id = ("0", "CTTTPP201.00")
@@ -1498,14 +2007,14 @@ class Test_remove_data:
         )
         self.mock_print.assert_called_once_with(
             f"Updated trial foo, removing wes values {target_id}",
-            f"along with {self.filter_query.delete()} files",
+            f"along with {self.bulk_delete.return_value} files",
         )
         self.filter_query.update.assert_called_once()
         args, _ = self.filter_query.update.call_args
         assert (
             DeepDiff(args[0][self.TrialMetadata.metadata_json], target_metadata) == {}
         )
-        self.DownloadableFiles.object_url.in_.assert_called_once_with(
+        self.assert_files_deleted(
             [
                 f"{TEST_TRIAL_ID}/wes/CTTTPP201.00/reads_0.bam",
             ]
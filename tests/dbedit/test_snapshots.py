@@ -0,0 +1,109 @@
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from cli.dbedit import core, snapshots
+from .constants import TEST_METADATA_JSON, TEST_TRIAL_ID
+
+
+@pytest.fixture
+def mocks(monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshots, "CIDC_WORKING_DIR", str(tmp_path))
+    monkeypatch.setattr(core, "get_env", lambda: "prod")
+
+    versions = {TEST_TRIAL_ID: ("etag", "2020-01-01"), "other": ("etag", "updated")}
+    get_trial_versions = MagicMock(
+        side_effect=lambda trial_ids, session: [
+            (t, *versions[t]) for t in trial_ids if t in versions
+        ]
+    )
+    get_trials_as_text = MagicMock(
+        side_effect=lambda trial_ids, session: [
+            (t, json.dumps(TEST_METADATA_JSON if t == TEST_TRIAL_ID else {}))
+            for t in trial_ids
+            if t in versions
+        ]
+    )
+    monkeypatch.setattr(snapshots, "get_trial_versions", get_trial_versions)
+    monkeypatch.setattr(core, "get_trials_as_text", get_trials_as_text)
+    return versions, get_trial_versions, get_trials_as_text
+
+
+def test_get_trial_metadata(mocks, tmp_path):
+    versions, get_trial_versions, get_trials_as_text = mocks
+    session = MagicMock()
+
+    # the first listing fetches and stores it
+    assert snapshots.get_trial_metadata(TEST_TRIAL_ID, session=session) == (
+        TEST_METADATA_JSON
+    )
+    get_trial_versions.assert_called_once_with([TEST_TRIAL_ID], session=session)
+    get_trials_as_text.assert_called_once_with([TEST_TRIAL_ID], session=session)
+    cache_dir = tmp_path / "trial_snapshots" / "prod"
+    assert len(os.listdir(cache_dir)) == 1
+
+    # the next only checks the version
+    get_trial_versions.reset_mock()
+    get_trials_as_text.reset_mock()
+    assert snapshots.get_trial_metadata(TEST_TRIAL_ID, session=session) == (
+        TEST_METADATA_JSON
+    )
+    get_trial_versions.assert_called_once()
+    get_trials_as_text.assert_not_called()
+
+    # until it changes, replacing the old snapshot
+    versions[TEST_TRIAL_ID] = ("etag 2", "2020-01-02")
+    assert snapshots.get_trial_metadata(TEST_TRIAL_ID, session=session) == (
+        TEST_METADATA_JSON
+    )
+    get_trials_as_text.assert_called_once_with([TEST_TRIAL_ID], session=session)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # a corrupt snapshot is fetched again
+    (cache_dir / os.listdir(cache_dir)[0]).write_bytes(b"\x1f\x8b broken")
+    get_trials_as_text.reset_mock()
+    assert snapshots.get_trial_metadata(TEST_TRIAL_ID, session=session) == (
+        TEST_METADATA_JSON
+    )
+    get_trials_as_text.assert_called_once()
+
+    # and exits if there's no trial
+    mock_print = MagicMock()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("builtins.print", mock_print)
+        with pytest.raises(SystemExit):
+            snapshots.get_trial_metadata("foo", session=session)
+    mock_print.assert_called_once_with("Trial foo cannot be found")
+
+
+def test_get_trials_as_text(mocks, tmp_path, monkeypatch):
+    versions, get_trial_versions, get_trials_as_text = mocks
+    session = MagicMock()
+
+    snapshots.get_trials_as_text([TEST_TRIAL_ID], session=session)
+    get_trials_as_text.reset_mock()
+
+    # only those without a current snapshot are fetched, in a single query
+    found = snapshots.get_trials_as_text(
+        ["other", "foo", TEST_TRIAL_ID, "other"], session=session
+    )
+    assert found == [
+        ("other", "{}"),
+        (TEST_TRIAL_ID, json.dumps(TEST_METADATA_JSON)),
+    ]
+    get_trials_as_text.assert_called_once_with(["other"], session=session)
+
+    # the least recently used are evicted to stay within size
+    cache_dir = tmp_path / "trial_snapshots" / "prod"
+    trial_path, other_path = (
+        snapshots._snapshot_path(t, *versions[t]) for t in (TEST_TRIAL_ID, "other")
+    )
+    os.utime(trial_path, (0, 0))
+    monkeypatch.setattr(snapshots, "MAX_CACHE_BYTES", os.path.getsize(other_path))
+    versions["other"] = ("etag", "later")
+    snapshots.get_trials_as_text(["other"], session=session)
+    assert os.listdir(cache_dir) == [
+        os.path.basename(snapshots._snapshot_path("other", *versions["other"]))
+    ]
@@ -1,8 +1,11 @@
 import sys
+import threading
+import time
 from io import BytesIO, StringIO
 
 import click
 import pytest
+from jose import jwt
 from unittest.mock import MagicMock
 from typing import Union
 
@@ -158,6 +161,46 @@ def test_initiate_upload(monkeypatch):
         api.initiate_upload(ASSAY, XLSX)
 
 
+def test_initiate_upload_transfer_modes(monkeypatch):
+    """Check that the transfer mode is negotiated, ignoring unknown response keys"""
+    monkeypatch.setattr(api, "_with_auth", lambda: {})
+    upload_info = {
+        "job_id": JOB_ID,
+        "job_etag": JOB_ETAG,
+        "gcs_bucket": "bucket",
+        "url_mapping": {"foo": "bar"},
+        "extra_metadata": {},
+        "gcs_file_map": {"bar": "baz"},
+        "optional_files": [],
+        "token": UPLOAD_TOKEN,
+    }
+    sent_modes = []
+
+    def request(url, headers, data, files):
+        sent_modes.append(data["transfer_modes"])
+        return make_json_response(response)
+
+    monkeypatch.setattr("requests.post", request)
+
+    # an API that can sign URLs does, along with anything else it adds
+    response = {
+        **upload_info,
+        "transfer_mode": "signed_url",
+        "signed_urls": {"bar": "https://signed/bar"},
+    }
+    assert api.initiate_upload("wes", BytesIO(b"")).signed_urls == {
+        "bar": "https://signed/bar"
+    }
+
+    # an older one leaves uploads to gsutil
+    response = upload_info
+    assert api.initiate_upload("wes", BytesIO(b"")).signed_urls is None
+
+    monkeypatch.setenv("CIDC_TRANSFER_MODE", "gsutil")
+    api.initiate_upload("wes", BytesIO(b""))
+    assert sent_modes == ["signed_url,gsutil", "signed_url,gsutil", "gsutil"]
+
+
 def test_update_job_status(monkeypatch):
     """Test that _update_job_status builds a request with the expected structure"""
     monkeypatch.setattr(api, "_with_auth", lambda headers: headers)
@@ -328,3 +371,142 @@ def test_retry_with_reauth(runner, capsys, monkeypatch):
 
         stdout = capsys.readouterr().out
         assert stdout.count("could not read token from clipboard") == 1
+
+
+def test_refresh_token(runner, monkeypatch):
+    """Ensure requests needing a fresh token off the main thread leave it to prompt once."""
+    with runner.isolated_filesystem():
+        cache.store(auth.TOKEN, "stale_token")
+        monkeypatch.setattr(api, "REAUTH_POLL_INTERVAL", 0.01)
+        prompt_threads = []
+
+        def prompt_for_token():
+            prompt_threads.append(threading.current_thread())
+            cache.store(auth.TOKEN, "fresh_token")
+            return "fresh_token"
+
+        prompt = MagicMock(side_effect=prompt_for_token)
+        monkeypatch.setattr(api, "_prompt_for_token", prompt)
+
+        tokens = []
+        threads = [
+            threading.Thread(
+                target=lambda: tokens.append(api._refresh_token("stale_token"))
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            api.refresh_token_if_due()
+            time.sleep(0.01)
+
+        prompt.assert_called_once()
+        assert prompt_threads == [threading.main_thread()]
+        assert tokens == ["fresh_token"] * 3
+        # a thread that asked after the prompt just gets the fresh token
+        api.refresh_token_if_due()
+        prompt.assert_called_once()
+        assert not api._token_wanted.is_set()
+
+        # a thread gives up if the main thread never gets one
+        monkeypatch.setattr(api, "REAUTH_TIMEOUT", 0.05)
+        thread = threading.Thread(
+            target=lambda: tokens.append(api._refresh_token("fresh_token"))
+        )
+        thread.start()
+        thread.join()
+        assert tokens[-1] is None
+        prompt.assert_called_once()
+        api._token_wanted.clear()
+
+
+def test_token_refresher(runner, monkeypatch):
+    """Ensure a fresh token is asked for on the main thread before the cached one expires."""
+    with runner.isolated_filesystem():
+        expiring_token = jwt.encode(
+            {"email": "test@email.com", "exp": int(time.time()) + 60}, "secret"
+        )
+        assert auth.get_token_expiry(expiring_token) == int(time.time()) + 60
+        cache.store(auth.TOKEN, expiring_token)
+        monkeypatch.setattr(click, "secho", MagicMock())
+
+        prompt_threads = []
+
+        def prompt_for_token():
+            prompt_threads.append(threading.current_thread())
+            return None
+
+        prompt = MagicMock(side_effect=prompt_for_token)
+        monkeypatch.setattr(api, "_prompt_for_token", prompt)
+
+        # not if it's a while until the token expires
+        with api.TokenRefresher(margin=10, interval=0.01) as refresher:
+            time.sleep(0.1)
+            assert not refresher.is_due()
+            api.refresh_token_if_due()
+        prompt.assert_not_called()
+
+        with api.TokenRefresher(margin=120, interval=0.01) as refresher:
+            deadline = time.time() + 1
+            while not refresher.is_due() and time.time() < deadline:
+                time.sleep(0.01)
+            # only flagged in the background, never prompted there
+            prompt.assert_not_called()
+            api.refresh_token_if_due()
+            prompt.assert_called_once()
+            assert prompt_threads == [threading.main_thread()]
+
+            # no token came of it, so it stops asking
+            time.sleep(0.1)
+            assert not refresher.is_due()
+            api.refresh_token_if_due()
+            prompt.assert_called_once()
+        assert api._refresher is None
+
+
+def test_list_downloadable_files(monkeypatch):
+    """Check that all pages of a trial's matching files are listed"""
+    monkeypatch.setattr(api, "_with_auth", lambda: {})
+    monkeypatch.setattr(api, "FILES_PAGE_SIZE", 2)
+    items = [
+        {"id": n, "object_url": f"t/{n}.bam", "file_size_bytes": n, "md5_hash": "x"}
+        for n in range(3)
+    ]
+    sent_params = []
+
+    def request(url, params, headers):
+        assert url.endswith("/downloadable_files")
+        sent_params.append(params)
+        page = items[params["page_num"] * 2 :][:2]
+        return make_json_response({"_items": page, "_meta": {"total": len(items)}})
+
+    monkeypatch.setattr("requests.get", request)
+    files = api.list_downloadable_files("t", ["Assay Type|WES|Source", "Clinical"])
+    assert files == [api.DownloadableFile(n, f"t/{n}.bam", n, "x") for n in range(3)]
+    assert [p["page_num"] for p in sent_params] == [0, 1]
+    assert sent_params[0]["trial_ids"] == "t"
+    assert sent_params[0]["facets"] == "Assay Type|WES|Source,Clinical"
+
+    patch_request("get", make_json_response("https://signed/url"), monkeypatch)
+    assert api.get_download_url(1) == "https://signed/url"
+
+
+def test_downloadable_files_errors(monkeypatch):
+    """Check that error responses and unexpected bodies raise ApiErrors"""
+    monkeypatch.setattr(api, "_with_auth", lambda: {})
+    for code in [403, 404, 500]:
+        error = make_error_response("nope", code)
+        error.ok = False
+        patch_request("get", error, monkeypatch)
+        with pytest.raises(api.ApiError, match="nope"):
+            api.list_downloadable_files("t")
+        with pytest.raises(api.ApiError, match="nope"):
+            api.get_download_url(1)
+
+    # eg an error dict that slipped through with a 200
+    patch_request("get", make_json_response({"_error": "nope"}), monkeypatch)
+    with pytest.raises(api.ApiError, match="Cannot decode API response"):
+        api.list_downloadable_files("t")
+    with pytest.raises(api.ApiError, match="Cannot decode API response"):
+        api.get_download_url(1)
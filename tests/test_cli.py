@@ -1,6 +1,6 @@
 from click.testing import CliRunner
 
-from cli import cli, consent, config, __version__
+from cli import api, cli, consent, config, __version__
 from functools import wraps
 
 
@@ -53,19 +53,31 @@ def test_cidc_structure(runner: CliRunner, monkeypatch):
 
 
 @with_default_env
-def test_no_gcloud_installation(runner: CliRunner, monkeypatch):
+def test_no_gcloud_installation(runner: CliRunner, monkeypatch, tmp_path):
     """
-    Check that running `cidc [subcommand]` without a gcloud installation prompts
-    the user to install gcloud.
+    Check that commands run without a gcloud installation, but that uploads that
+    need gsutil prompt the user to install gcloud.
     """
     skip_consent(monkeypatch)
+    monkeypatch.setattr("shutil.which", lambda *args: False)
 
     def assert_gcloud_message(res):
         assert "requires an installation of the gcloud SDK" in res.output
 
-    monkeypatch.setattr("shutil.which", lambda *args: False)
-    assert_gcloud_message(runner.invoke(cli.cidc, ["assays"]))
-    assert_gcloud_message(runner.invoke(cli.cidc, ["login"]))
+    res = runner.invoke(cli.cidc, ["assays"])
+    assert "Usage: cidc assays" in res.output
+    res = runner.invoke(cli.cidc, ["login", "-h"])
+    assert "Usage: cidc login" in res.output
+
+    # the API didn't sign upload URLs, so gsutil is needed
+    upload_info = api.UploadInfo(1, "etag", "bucket", {"a.bam": "a"}, {}, {}, [], "t")
+    monkeypatch.setattr(api, "initiate_upload", lambda *args: upload_info)
+    monkeypatch.setattr("cli.gcloud.is_logged_in", lambda: False)
+    xlsx = tmp_path / "manifest.xlsx"
+    xlsx.write_bytes(b"")
+    assert_gcloud_message(
+        runner.invoke(cli.cidc, ["assays", "upload", "--assay", "wes", "--xlsx", xlsx])
+    )
 
 
 @with_default_env
@@ -0,0 +1,189 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from unittest.mock import MagicMock
+
+import click
+import pytest
+
+from cli import api, download, transfer
+
+
+def md5(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+class StubStorage:
+    """A local stand-in for signed download URLs, serving range requests"""
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = dict()
+        # what to do with each request for an object: cut the body short,
+        # serve corrupt bytes, or fail with a status
+        self.faults: Dict[str, List] = dict()
+        self.ranges: List[tuple] = []
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/{name}?sig=abc"
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        name = request.path.split("?")[0].lstrip("/")
+        data = self.objects[name]
+        start, end = map(
+            int, re.match(r"bytes=(\d+)-(\d+)", request.headers["Range"]).groups()
+        )
+        with self.lock:
+            self.ranges.append((name, start, end))
+            faults = self.faults.get(name)
+            fault = faults.pop(0) if faults else None
+        if isinstance(fault, int):
+            request.send_response(fault)
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+
+        body = data[start : end + 1]
+        request.send_response(206)
+        request.send_header("Content-Length", str(len(body)))
+        request.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        request.end_headers()
+        if fault == "cut":
+            request.wfile.write(body[: len(body) // 2])
+            request.close_connection = True
+            return
+        if fault == "corrupt":
+            body = bytes(len(body))
+        request.wfile.write(body)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubStorage()
+    stub.thread.start()
+    monkeypatch.setattr(download, "SLICE_SIZE", 1000)
+    monkeypatch.setattr(download, "READ_SIZE", 100)
+    monkeypatch.setattr(transfer, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(transfer, "_local", threading.local())
+    monkeypatch.setattr(click, "echo", MagicMock())
+    # as on Windows, which has no positioned writes
+    monkeypatch.delattr(os, "pwrite", raising=False)
+    yield stub
+    stub.server.shutdown()
+
+
+def add_file(stub, monkeypatch, files, name, data, md5_hash=True):
+    stub.objects[name] = data
+    files.append(
+        api.DownloadableFile(
+            len(files), name, len(data), md5(data) if md5_hash else None
+        )
+    )
+    monkeypatch.setattr(
+        api, "get_download_url", lambda file_id: stub.url(files[file_id].object_url)
+    )
+    monkeypatch.setattr(api, "list_downloadable_files", lambda *args: files)
+
+
+def test_run_download(stub, monkeypatch, tmp_path):
+    """Check that files are downloaded in slices, skipping those already present"""
+    files = []
+    small = b"small file"
+    large = bytes(range(256)) * 20
+    add_file(stub, monkeypatch, files, "trial/wes/small.txt", small)
+    add_file(stub, monkeypatch, files, "trial/wes/large.bam", large)
+    add_file(stub, monkeypatch, files, "trial/wes/present.bam", b"present")
+    add_file(stub, monkeypatch, files, "trial/wes/no_md5.bam", b"composite", False)
+    (tmp_path / "trial" / "wes").mkdir(parents=True)
+    (tmp_path / "trial" / "wes" / "present.bam").write_bytes(b"present")
+
+    # a dropped connection carries on from where it stopped, and failed
+    # requests are retried
+    stub.faults = {"trial/wes/large.bam": ["cut", 503]}
+    download.run_download("trial", [], str(tmp_path))
+
+    assert (tmp_path / "trial/wes/small.txt").read_bytes() == small
+    assert (tmp_path / "trial/wes/large.bam").read_bytes() == large
+    assert (tmp_path / "trial/wes/no_md5.bam").read_bytes() == b"composite"
+    assert not [p for p in os.listdir(tmp_path / "trial/wes") if ".part" in p]
+    assert not [r for r in stub.ranges if r[0] == "trial/wes/present.bam"]
+    large_ranges = sorted(r[1:] for r in stub.ranges if r[0] == "trial/wes/large.bam")
+    # 6 slices, one cut short and one failed once
+    assert len(large_ranges) == 6 + 2
+    assert (4000, 4999) in large_ranges and (5000, 5119) in large_ranges
+
+    # running again finds them all present
+    stub.ranges.clear()
+    download.run_download("trial", [], str(tmp_path))
+    assert stub.ranges == []
+
+
+def test_download_resumes(stub, monkeypatch, tmp_path):
+    """Check that an interrupted download carries on from the slices it finished"""
+    files = []
+    data = os.urandom(3500)
+    add_file(stub, monkeypatch, files, "trial/large.bam", data)
+    path = str(tmp_path / "trial/large.bam")
+
+    monkeypatch.setattr(download, "SLICE_WORKERS", 1)
+    # the first 2 slices get through, then the URL stops working
+    stub.faults = {"trial/large.bam": [None, None, 403]}
+    with pytest.raises(transfer.TransferError, match="403"):
+        download.download_file(stub.url("trial/large.bam"), path, files[0])
+    assert os.path.exists(f"{path}.part")
+
+    stub.ranges.clear()
+    download.download_file(stub.url("trial/large.bam"), path, files[0])
+    assert open(path, "rb").read() == data
+    # the slices that finished before aren't downloaded again
+    assert stub.ranges and not [r for r in stub.ranges if r[1] < 2000]
+
+    # a partial download of a file that has since changed starts over
+    os.remove(path)
+    stub.faults = {"trial/large.bam": [None, 403]}
+    with pytest.raises(transfer.TransferError):
+        download.download_file(stub.url("trial/large.bam"), path, files[0])
+    stub.objects["trial/large.bam"] = data = os.urandom(3500)
+    stub.ranges.clear()
+    download.download_file(
+        stub.url("trial/large.bam"), path, files[0]._replace(md5_hash=md5(data))
+    )
+    assert open(path, "rb").read() == data
+    assert len(stub.ranges) == 4
+
+
+def test_download_checksum_mismatch(stub, monkeypatch, tmp_path):
+    """Check that a download that doesn't match its checksum is deleted"""
+    files = []
+    add_file(stub, monkeypatch, files, "trial/reads.bam", os.urandom(1500))
+    stub.faults = {"trial/reads.bam": ["corrupt"]}
+
+    with pytest.raises(click.Abort):
+        download.run_download("trial", [], str(tmp_path))
+    assert os.listdir(tmp_path / "trial") == []
+
+
+def test_local_path(tmp_path):
+    assert download._local_path(str(tmp_path), "trial/wes/a.bam") == str(
+        tmp_path / "trial" / "wes" / "a.bam"
+    )
+    with pytest.raises(ValueError):
+        download._local_path(str(tmp_path), "../elsewhere/a.bam")
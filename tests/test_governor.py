@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from cli import config, governor
+
+pytestmark = pytest.mark.skipif(governor.fcntl is None, reason="needs flock")
+
+
+@pytest.fixture(autouse=True)
+def working_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "CIDC_WORKING_DIR", str(tmp_path))
+    return tmp_path / "transfers"
+
+
+def test_slots_are_shared(working_dir):
+    """Check that slots are capped across governors, and freed on release / exit"""
+    with governor.HostGovernor(max_transfers=3) as first:
+        second = governor.HostGovernor(max_transfers=3)
+        first_slots = [first.try_acquire() for _ in range(2)]
+        second_slots = [second.try_acquire() for _ in range(2)]
+        assert all(first_slots) and second_slots[0] is not None
+        # all 3 of the host's slots are taken
+        assert second_slots[1] is None
+
+        first_slots[0].release()
+        assert second.try_acquire() is not None
+
+    # exiting frees the rest of the first governor's slots
+    assert second.try_acquire() is not None
+    assert not (working_dir / f"process_{os.getpid()}.lock").exists()
+
+
+def test_fair_share(working_dir, monkeypatch):
+    """Check that each uploading process is held to its share of the slots"""
+    monkeypatch.setattr(governor, "PROCESS_COUNT_TTL", 0)
+    working_dir.mkdir()
+    # a process that has exited leaves an unlocked file behind
+    stale = working_dir / "process_1.lock"
+    stale.touch()
+
+    with governor.HostGovernor(max_transfers=4) as host:
+        assert host.uploading_processes() == 1
+        assert not stale.exists()
+
+        # another process that is still uploading holds its file locked
+        other = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import fcntl, sys, time; f = open(sys.argv[1], 'w'); "
+                "fcntl.flock(f, fcntl.LOCK_EX); print(flush=True); time.sleep(30)",
+                str(working_dir / "process_2.lock"),
+            ],
+            stdout=subprocess.PIPE,
+        )
+        try:
+            other.stdout.readline()
+            assert host.uploading_processes() == 2
+            assert host.fair_share() == 2
+            assert [host.try_acquire() is not None for _ in range(3)] == [
+                True,
+                True,
+                False,
+            ]
+        finally:
+            other.kill()
+            other.wait()
+
+        # and once it exits, this process can take them all
+        assert host.uploading_processes() == 1
+        assert host.try_acquire() is not None
+
+
+def test_pace(monkeypatch):
+    """Check that sends are paced to this process's share of the bandwidth"""
+    monkeypatch.setattr(governor, "MAX_HOST_BANDWIDTH_MB", 1)
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", lambda s: sleeps.append(s))
+
+    # without a governor, nothing is paced
+    governor.pace(1_000_000)
+    assert sleeps == []
+
+    with governor.HostGovernor() as host:
+        monkeypatch.setattr(host, "uploading_processes", lambda: 2)
+        for _ in range(3):
+            governor.pace(250_000)
+    # 0.5 MB/s, so each quarter megabyte waits for the one before it
+    assert sleeps == pytest.approx([0, 0.5, 1.0], abs=0.05)
+
+
+def test_process_file_is_never_unlocked(working_dir, monkeypatch):
+    """Check that another process counting never removes a starting process's file"""
+    flock = governor.fcntl.flock
+    other = governor.HostGovernor()
+
+    counting = []
+
+    def count_then_flock(fd, operation):
+        # another process counts just as this one opens its file
+        if not counting:
+            counting.append(True)
+            with monkeypatch.context() as m:
+                m.setattr(os, "getpid", lambda: 1)
+                other._count_processes()
+            counting.clear()
+        return flock(fd, operation)
+
+    working_dir.mkdir()
+    monkeypatch.setattr(governor.fcntl, "flock", count_then_flock)
+    with governor.HostGovernor() as host:
+        process_file = working_dir / f"process_{os.getpid()}.lock"
+        assert process_file.exists()
+        monkeypatch.setattr(governor.fcntl, "flock", flock)
+        with monkeypatch.context() as m:
+            m.setattr(os, "getpid", lambda: 1)
+            assert other._count_processes() == 1
+        assert process_file.exists()
+
+        # and if its file goes missing anyway, exiting doesn't fail
+        process_file.unlink()
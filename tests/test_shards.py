@@ -0,0 +1,170 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+import click
+import pytest
+
+from cli import api, shards, upload
+
+from .test_transfer import BUCKET, FakeGCS
+
+PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import sys
+from cli import gcloud, upload
+gcloud.is_logged_in = lambda: True
+upload.run_upload_worker(sys.argv[1])
+"""
+
+
+def test_split(tmp_path):
+    """Check that shards are about equal in size"""
+    sizes = [50, 40, 30, 20, 10, 10]
+    pairs = []
+    for n, size in enumerate(sizes):
+        (tmp_path / f"{n}.bam").write_bytes(b"x" * size)
+        pairs.append([str(tmp_path / f"{n}.bam"), f"gs://{BUCKET}/{n}.bam"])
+    pairs += [[f"gs://other/{n}.bam", f"gs://{BUCKET}/gs_{n}.bam"] for n in range(2)]
+
+    split = shards.split(pairs, 2)
+    totals = [
+        sum(os.path.getsize(src) for src, _ in s if "gs://" not in src) for s in split
+    ]
+    assert totals == [80, 80]
+    assert sorted(p for s in split for p in s) == sorted(pairs)
+    # files already in GCS are spread by number
+    assert [len(s) for s in split] == [4, 4]
+
+
+def test_claim_and_wait(tmp_path, monkeypatch):
+    """Check that each shard is claimed once, until it fails or is abandoned"""
+    journal = str(tmp_path)
+    monkeypatch.setattr(shards, "POLL_INTERVAL", 0)
+    shards.write_job(journal, 1, [[], [], []], [])
+    assert [shards.claim_shard(journal, 3) for _ in range(4)] == [0, 1, 2, None]
+
+    # a failed shard is tried again, by the next worker to look for one
+    shards.report(journal, 1, ["gs://b/1"])
+    shards.report(journal, 2, [], "upload aborted")
+    assert shards.claim_shard(journal, 3) == 2
+    assert shards.read_result(journal, 2) is None
+    assert shards.attempts(journal, 2) == 2
+
+    # as is one whose worker stopped touching its claim
+    claim = tmp_path / "shard_0.claim"
+    stale = time.time() - shards.STALE_CLAIM_AGE - 60
+    os.utime(claim, (stale, stale))
+    assert shards.claim_shard(journal, 3) == 0
+    assert shards.claim_shard(journal, 3) is None
+
+    # but only up to MAX_SHARD_ATTEMPTS times, when the coordinator gives up
+    monkeypatch.setattr(shards, "MAX_SHARD_ATTEMPTS", 3)
+    shards.report(journal, 2, [], "upload aborted")
+    assert shards.claim_shard(journal, 3) == 2
+    shards.report(journal, 2, [], "still aborted")
+    assert shards.claim_shard(journal, 3) is None
+    seen = []
+    results = shards.wait_for_shards(journal, 3, seen.append)
+    assert [(r.shard, r.error) for r in results] == [(1, None), (2, "still aborted")]
+    assert seen == results
+
+    # a shard can be claimed again by number, whatever its state
+    assert shards.claim_shard(journal, 3, 2) == 2
+    shards.report(journal, 0, ["gs://b/0"])
+    shards.report(journal, 2, ["gs://b/2"])
+    results = shards.wait_for_shards(journal, 3)
+    assert [r.uploaded for r in results] == [["gs://b/0"], ["gs://b/1"], ["gs://b/2"]]
+    # and the journal holds nothing but the job, claims and results
+    assert not list(tmp_path.glob(".clock.*"))
+
+
+def test_wait_for_shards_timeout(tmp_path, monkeypatch):
+    """Check that the coordinator stops waiting on shards nobody is uploading"""
+    journal = str(tmp_path)
+    monkeypatch.setattr(shards, "POLL_INTERVAL", 0.01)
+    shards.write_job(journal, 1, [[], []], [])
+    assert shards.claim_shard(journal, 2) == 0
+    shards.report(journal, 0, ["gs://b/0"])
+
+    results = shards.wait_for_shards(journal, 2, timeout=0.05)
+    assert results[-1].shard == 1
+    assert "no worker uploaded it" in results[-1].error
+
+    # a worker that's still touching its claim is waited on
+    monkeypatch.setattr(shards, "HEARTBEAT_INTERVAL", 0.01)
+    assert shards.claim_shard(journal, 2) == 1
+    claim = tmp_path / "shard_1.claim"
+    os.utime(claim, (0, 0))
+    with shards.Heartbeat(journal, 1):
+        time.sleep(0.1)
+        assert os.stat(claim).st_mtime > time.time() - 60
+        assert not shards._is_stale(journal, 1, shards._fs_now(journal))
+    assert shards.claim_shard(journal, 2) is None
+
+
+def test_sharded_upload(tmp_path, monkeypatch):
+    """Check an upload split between worker processes, against a fake GCS"""
+    fake = FakeGCS()
+    fake.thread.start()
+    monkeypatch.setattr(shards, "POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(click, "echo", MagicMock())
+
+    files = tmp_path / "files"
+    files.mkdir()
+    url_mapping, gcs_file_map = {}, {}
+    for n in range(5):
+        (files / f"{n}.bam").write_bytes(bytes([n]) * ((1 << 20) + n))
+        url_mapping[f"files/{n}.bam"] = f"trial/wes/{n}.bam"
+        gcs_file_map[f"trial/wes/{n}.bam"] = f"artifact-{n}"
+    upload_info = api.UploadInfo(
+        0, "etag", BUCKET, url_mapping, {}, gcs_file_map, [], "token"
+    )
+    journal = str(tmp_path / "journal")
+
+    result = {}
+    coordinator = threading.Thread(
+        target=lambda: result.update(
+            upload._sharded_upload(
+                upload_info, str(tmp_path / "manifest.xlsx"), journal, 2
+            )
+        )
+    )
+    coordinator.start()
+    while not os.path.exists(os.path.join(journal, shards.JOB_FILE)):
+        coordinator.join(0.05)
+
+    env = {
+        **os.environ,
+        "HOME": str(tmp_path),
+        "PYTHONPATH": PACKAGE_PATH,
+        "STORAGE_EMULATOR_HOST": fake.host,
+        "CIDC_MULTIPART_THRESHOLD_MB": "1",
+    }
+    # workers run at once, each claiming a shard until there are none left
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, journal],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(3)
+    ]
+    outputs = [w.communicate(timeout=60) for w in workers]
+    coordinator.join(30)
+    fake.server.shutdown()
+
+    assert [w.returncode for w in workers] == [0, 0, 0], outputs
+    # each shard was uploaded by one of them, leaving at least one with nothing to do
+    assert sum("Shard 0 uploaded" in out for out, _ in outputs) == 1
+    assert sum("Shard 1 uploaded" in out for out, _ in outputs) == 1
+    assert any("already claimed" in out for out, _ in outputs)
+    assert result == gcs_file_map
+    for n in range(5):
+        assert fake.objects[f"trial/wes/{n}.bam"] == (files / f"{n}.bam").read_bytes()
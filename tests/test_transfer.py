@@ -0,0 +1,338 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from unittest.mock import MagicMock
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+import click
+import pytest
+
+from cli import api, gcloud, transfer, upload
+
+BUCKET = "upload-bucket"
+
+
+class FakeGCS:
+    """A local stand-in for the XML API's multipart uploads, for STORAGE_EMULATOR_HOST"""
+
+    def __init__(self):
+        self.objects: Dict[str, bytes] = dict()
+        self.uploads: Dict[str, Dict[int, bytes]] = dict()
+        # part numbers to fail with this status the next this many times
+        self.flaky: Dict[int, List[int]] = dict()
+        self.part_requests = 0
+        self.aborted: List[str] = []
+        # resumable upload sessions' bytes so far, by session id
+        self.sessions: Dict[str, bytearray] = dict()
+        # what to do with each resumable upload chunk: persist only half of it,
+        # persist half but fail anyway, or fail with a status; chunks past the
+        # end of the list are persisted
+        self.chunk_faults: List = []
+        self.chunk_requests = 0
+        # the Authorization header of each signed request
+        self.signed_auth: List = []
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake.handle(self, "POST")
+
+            def do_PUT(self):
+                fake.handle(self, "PUT")
+
+            def do_DELETE(self):
+                fake.handle(self, "DELETE")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        url = urlparse(request.path)
+        bucket, name = unquote(url.path).lstrip("/").split("/", 1)
+        assert bucket == BUCKET
+        query = parse_qs(url.query, keep_blank_values=True)
+        body = request.rfile.read(int(request.headers.get("Content-Length", 0)))
+
+        status, headers, response = 200, {}, b""
+        with self.lock:
+            if "X-Goog-Signature" in query or "upload_id" in query:
+                self.signed_auth.append(request.headers.get("Authorization"))
+            if "upload_id" in query:
+                status, headers = self.handle_resumable(
+                    request, method, name, query["upload_id"][0], body
+                )
+            elif method == "POST" and request.headers.get("x-goog-resumable"):
+                session_id = f"session-{len(self.sessions)}"
+                self.sessions[session_id] = bytearray()
+                status = 201
+                headers[
+                    "Location"
+                ] = f"{self.host}/{BUCKET}/{quote(name)}?upload_id={session_id}"
+            elif method == "POST" and "uploads" in query:
+                upload_id = f"upload-{len(self.uploads)}"
+                self.uploads[upload_id] = dict()
+                response = (
+                    "<InitiateMultipartUploadResult><UploadId>"
+                    f"{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                ).encode()
+            elif method == "PUT":
+                self.part_requests += 1
+                part_number = int(query["partNumber"][0])
+                md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+                if self.flaky.get(part_number):
+                    status = self.flaky[part_number].pop(0)
+                elif request.headers["Content-MD5"] != md5:
+                    status = 400
+                else:
+                    self.uploads[query["uploadId"][0]][part_number] = body
+                    headers["ETag"] = f'"{hashlib.md5(body).hexdigest()}"'
+            elif method == "POST":
+                parts = self.uploads.pop(query["uploadId"][0])
+                numbers = [int(n) for n in re.findall(rb"<PartNumber>(\d+)<", body)]
+                assert numbers == sorted(parts)
+                self.objects[name] = b"".join(parts[n] for n in numbers)
+            elif method == "DELETE":
+                self.uploads.pop(query["uploadId"][0])
+                self.aborted.append(name)
+                status = 204
+
+        request.send_response(status, "Resume Incomplete" if status == 308 else None)
+        for header, value in headers.items():
+            request.send_header(header, value)
+        request.send_header("Content-Length", str(len(response)))
+        request.end_headers()
+        request.wfile.write(response)
+
+    def handle_resumable(self, request, method, name, session_id, body):
+        if method == "DELETE":
+            self.sessions.pop(session_id)
+            self.aborted.append(name)
+            return 499, {}
+        data = self.sessions[session_id]
+        content_range = request.headers["Content-Range"][len("bytes ") :]
+        chunk, size = content_range.split("/")
+        if chunk != "*":
+            self.chunk_requests += 1
+            fault = self.chunk_faults.pop(0) if self.chunk_faults else None
+            if isinstance(fault, int):
+                return fault, {}
+            start = int(chunk.split("-")[0])
+            if fault in ("short", "lost"):
+                body = body[: len(body) // 2]
+            data[start:] = body
+            if fault == "lost":
+                return 503, {}
+        if len(data) == int(size):
+            self.objects[name] = bytes(self.sessions.pop(session_id))
+            return 200, {}
+        return 308, {"Range": f"bytes=0-{len(data) - 1}"} if data else {}
+
+
+@pytest.fixture
+def fake_gcs(monkeypatch, tmp_path):
+    fake = FakeGCS()
+    fake.thread.start()
+    monkeypatch.setenv("STORAGE_EMULATOR_HOST", fake.host)
+    monkeypatch.setattr(transfer, "PART_SIZE", 1024)
+    monkeypatch.setattr(transfer, "RETRY_BACKOFF", 0)
+    monkeypatch.setattr(transfer, "_local", threading.local())
+
+    src = tmp_path / "reads #1.bam"
+    src.write_bytes(bytes(range(256)) * 41)
+    yield fake, str(src)
+    fake.server.shutdown()
+
+
+def test_upload_in_parts(fake_gcs):
+    fake, src = fake_gcs
+    data = open(src, "rb").read()
+
+    # parts are uploaded concurrently and joined, retrying failed ones alone
+    fake.flaky = {3: [503, 429]}
+    progress = []
+    transfer.upload_in_parts(
+        src, f"gs://{BUCKET}/trial/wes/reads #1.bam", lambda *p: progress.append(p)
+    )
+    assert fake.objects["trial/wes/reads #1.bam"] == data
+    assert fake.part_requests == 11 + 2
+    assert progress[-1] == (len(data), len(data))
+    assert fake.uploads == {}
+
+    # and aborted once a part can't be uploaded
+    fake.part_requests = 0
+    fake.flaky = {2: [403]}
+    with pytest.raises(transfer.TransferError, match="403 Forbidden uploading part 2"):
+        transfer.upload_in_parts(src, f"gs://{BUCKET}/other.bam")
+    assert "other.bam" not in fake.objects
+    assert fake.aborted == ["other.bam"]
+    assert fake.uploads == {}
+
+
+def test_parts(monkeypatch):
+    monkeypatch.setattr(transfer, "PART_SIZE", 1000)
+    assert transfer._parts(2500) == [(1, 0, 1000), (2, 1000, 1000), (3, 2000, 500)]
+
+    # parts are made bigger to stay within MAX_PARTS
+    monkeypatch.setattr(transfer, "MAX_PARTS", 2)
+    assert transfer._parts(2500) == [(1, 0, 1250), (2, 1250, 1250)]
+
+
+def test_multipart_gsutil_assay_upload(fake_gcs, monkeypatch):
+    """Check that large files are uploaded in parts, retried whole if a part keeps failing"""
+    fake, src = fake_gcs
+    monkeypatch.setattr(transfer, "MULTIPART_THRESHOLD", 1000)
+    monkeypatch.setattr(click, "echo", MagicMock())
+    monkeypatch.setattr(upload, "UPLOAD_RETRY_BACKOFF", 0)
+
+    # a part that fails every time fails the file, which is retried whole
+    fake.flaky = {5: [500] * transfer.MAX_ATTEMPTS}
+    dst = f"gs://{BUCKET}/trial/wes/reads.bam"
+    monkeypatch.setattr(
+        upload, "_compose_file_mapping", lambda *args: ([[src, dst]], [])
+    )
+    upload._gsutil_assay_upload(
+        api.UploadInfo(0, "etag", BUCKET, {}, {}, {}, [], "token"), ""
+    )
+    assert fake.objects["trial/wes/reads.bam"] == open(src, "rb").read()
+    assert fake.aborted == ["trial/wes/reads.bam"]
+
+
+def test_part_reader(tmp_path, monkeypatch):
+    src = tmp_path / "reads.bam"
+    src.write_bytes(bytes(range(256)) * 10)
+    monkeypatch.setattr(transfer, "PART_SIZE", 1000)
+    parts = transfer._parts(2560)
+    fadvise = MagicMock()
+    monkeypatch.setattr("os.posix_fadvise", fadvise, raising=False)
+    monkeypatch.setattr(transfer, "_parts_in_flight", threading.BoundedSemaphore(2))
+
+    # parts are read in order, a bounded number ahead of those sent
+    reader = transfer._PartReader(str(src), parts)
+    read = []
+    while True:
+        item = reader.get()
+        if item is None:
+            break
+        read.append(item)
+        reader.release()
+    reader.stop()
+    assert [part for part, _ in read] == parts
+    assert b"".join(data for _, data in read) == src.read_bytes()
+    assert reader.error is None
+
+    # with the kernel told to read ahead and drop what's been read, where supported
+    if hasattr(os, "POSIX_FADV_SEQUENTIAL"):
+        advice = [args[3] for args, _ in fadvise.call_args_list]
+        assert advice == [os.POSIX_FADV_SEQUENTIAL] + [os.POSIX_FADV_DONTNEED] * 3
+
+    # stopping frees the slots of parts read but not sent
+    reader = transfer._PartReader(str(src), parts)
+    assert reader.get() is not None
+    reader.stop()
+    reader.release()
+    assert transfer._parts_in_flight.acquire(blocking=False)
+    assert transfer._parts_in_flight.acquire(blocking=False)
+
+
+def test_background_upload():
+    """Check that an upload's return code is only set once its thread is done"""
+    release = threading.Event()
+
+    def fail(on_progress, cancelled):
+        release.wait()
+        on_progress(1, 2)
+        raise transfer.TransferError("lost the connection")
+
+    proc = transfer._BackgroundUpload("upload", "src", "dst", fail)
+    assert proc.poll() is None
+    release.set()
+    proc._thread.join()
+    # not until it's been polled or waited on, like Popen
+    assert proc.returncode is None
+    assert proc.poll() == 1
+    assert proc.returncode == 1
+    assert proc.stderr.readline().startswith("[0/1 files][1.0 B/2.0 B]")
+    assert proc.stderr.readline() == (
+        "_BackgroundUploadException: lost the connection\n"
+    )
+
+    proc = transfer._BackgroundUpload("upload", "src", "dst", lambda *args: None)
+    assert proc.wait() == 0
+    assert proc.poll() == 0
+
+
+def test_upload_resumable(fake_gcs, monkeypatch):
+    """Check resumable uploads from signed URLs, which need no gcloud credentials"""
+    fake, src = fake_gcs
+    data = open(src, "rb").read()
+    monkeypatch.delenv("STORAGE_EMULATOR_HOST")
+    monkeypatch.setattr(gcloud, "get_access_token", MagicMock(side_effect=OSError))
+    monkeypatch.setattr(transfer, "RESUMABLE_CHUNK_SIZE", 4096)
+    signed_url = f"{fake.host}/{BUCKET}/trial/reads.bam?X-Goog-Signature=abc"
+
+    # a chunk only partly persisted, or failed, carries on from what GCS has
+    fake.chunk_faults = [None, "short", 503, "lost"] + ["lost"] * transfer.MAX_ATTEMPTS
+    progress = []
+    transfer.upload_resumable(src, signed_url, lambda *p: progress.append(p))
+    assert fake.objects["trial/reads.bam"] == data
+    assert progress[:3] == [(4096, len(data)), (6144, len(data)), (8192, len(data))]
+    assert progress[-1] == (len(data), len(data))
+    assert set(fake.signed_auth) == {None}
+    assert fake.sessions == {}
+
+    # and is cancelled once a chunk can't be uploaded
+    fake.chunk_faults = [403]
+    with pytest.raises(transfer.TransferError, match="403"):
+        transfer.upload_resumable(
+            src, f"{fake.host}/{BUCKET}/other.bam?X-Goog-Signature=abc"
+        )
+    assert fake.aborted == ["other.bam"]
+    assert fake.sessions == {}
+
+    # empty files take a single request
+    empty = os.path.join(os.path.dirname(src), "empty.txt")
+    open(empty, "wb").close()
+    transfer.upload_resumable(
+        empty, f"{fake.host}/{BUCKET}/empty.txt?X-Goog-Signature=abc"
+    )
+    assert fake.objects["empty.txt"] == b""
+
+
+def test_signed_url_gsutil_assay_upload(fake_gcs, monkeypatch):
+    """Check that files with signed URLs skip gsutil, and the rest fall back to it"""
+    fake, src = fake_gcs
+    monkeypatch.setattr(click, "echo", MagicMock())
+    popen = MagicMock(side_effect=OSError("no gsutil here"))
+    monkeypatch.setattr(upload.subprocess, "Popen", popen)
+
+    dst = f"gs://{BUCKET}/trial/wes/reads.bam"
+    signed_urls = {
+        "trial/wes/reads.bam": f"{fake.host}/{BUCKET}/trial/wes/reads.bam"
+        "?X-Goog-Signature=abc"
+    }
+    monkeypatch.setattr(
+        upload, "_compose_file_mapping", lambda *args: ([[src, dst]], [])
+    )
+    upload._gsutil_assay_upload(
+        api.UploadInfo(0, "etag", BUCKET, {}, {}, {}, [], "token", signed_urls), ""
+    )
+    assert fake.objects["trial/wes/reads.bam"] == open(src, "rb").read()
+    popen.assert_not_called()
+
+    # without a signed URL, it's gsutil's
+    with pytest.raises(OSError, match="no gsutil here"):
+        next(upload._start_procs([[src, f"gs://{BUCKET}/other.bam"]], signed_urls))
+    assert popen.call_args[0][0] == ["gsutil", "cp", src, f"gs://{BUCKET}/other.bam"]
@@ -1,4 +1,6 @@
+import os
 import time
+import zipfile
 from unittest.mock import MagicMock
 
 import pytest
@@ -24,12 +26,18 @@ GCS_FILE_MAP = {
 }
 OPTIONAL_FILES = []
 UPLOAD_TOKEN = "test-upload-token"
+XLSX_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
 
 
 class UploadMocks:
     def __init__(self, monkeypatch):
         self.gcloud_login = MagicMock()
         monkeypatch.setattr("cli.gcloud.login", self.gcloud_login)
+        monkeypatch.setattr("cli.gcloud.check_installed", MagicMock())
+
+        self.gcloud_is_logged_in = MagicMock()
+        self.gcloud_is_logged_in.return_value = False
+        monkeypatch.setattr("cli.gcloud.is_logged_in", self.gcloud_is_logged_in)
 
         self.api_initiate_upload = MagicMock()
         self.api_initiate_upload.return_value = api.UploadInfo(
@@ -62,6 +70,7 @@ class UploadMocks:
         monkeypatch.setattr("cli.api.insert_extra_metadata", self.insert_extra_metadata)
 
     def assert_expected_calls(self, failure=False):
+        self.gcloud_is_logged_in.assert_called_once()
         self.gcloud_login.assert_called_once()
         self.api_initiate_upload.assert_called_once()
         if failure:
@@ -109,6 +118,59 @@ def test_upload_success(runner: CliRunner, monkeypatch):
     mocks.assert_expected_calls()
 
 
+def test_upload_preflight(runner: CliRunner, monkeypatch):
+    """
+    Check that local files found while the API call is in flight are passed on,
+    and that gcloud login is skipped if already logged in.
+    """
+    mocks = UploadMocks(monkeypatch)
+    mocks.gcloud_is_logged_in.return_value = True
+
+    upload_success = MagicMock()
+    upload_success.return_value = GCS_FILE_MAP
+    monkeypatch.setattr(upload, "_gsutil_assay_upload", upload_success)
+
+    with runner.isolated_filesystem():
+        for fname in URL_MAPPING:
+            with open(fname, "wb") as f:
+                f.write(b"blah blah data")
+        with zipfile.ZipFile("wes.xlsx", "w") as xlsx:
+            xlsx.writestr(
+                "xl/sharedStrings.xml",
+                f"""<sst xmlns="{XLSX_NS}">
+                <si><t>protocol identifier</t></si>
+                <si><t>{list(URL_MAPPING)[0]}</t></si>
+                <si><r><t>local_path2</t></r><r><t>.fastq.gz</t></r></si>
+                <si><t>missing.fastq.gz</t></si>
+                <si><t>gs://bucket/file</t></si>
+                </sst>""",
+            )
+        upload.run_upload("wes", "wes.xlsx")
+        local_files = {os.path.abspath(fname) for fname in URL_MAPPING}
+
+    upload_success.assert_called_once_with(
+        mocks.api_initiate_upload.return_value, "wes.xlsx", local_files
+    )
+    mocks.gcloud_login.assert_not_called()
+
+    # files that aren't .xlsx files have nothing to find
+    assert upload._preflight(__file__) == set()
+
+    # only strings that look like local file paths are checked
+    for path in ["a.bam", "data/r1.fastq.gz", "../r2.fq"]:
+        assert upload._is_local_path(path), path
+    for not_path in [
+        "CTTTPP101.00",
+        "2019-09-04",
+        "protocol identifier",
+        "gs://bucket/a.bam",
+        "https://host/a.bam",
+        "a\nb.bam",
+        "dir/",
+    ]:
+        assert not upload._is_local_path(not_path), not_path
+
+
 def test_upload_interrupt(runner: CliRunner, monkeypatch):
     """
     Check that a KeyboardInterrupt-ed upload call alerts the API that the job errored.
@@ -158,7 +220,9 @@ def test_upload_api_initiate_exception(runner: CliRunner, monkeypatch):
     with pytest.raises(Exception, match="bad upload"):
         run_isolated_upload(runner)
 
-    mocks.gcloud_login.assert_called_once()
+    # gcloud login waits on the API call, so isn't needed
+    mocks.gcloud_is_logged_in.assert_called_once()
+    mocks.gcloud_login.assert_not_called()
 
 
 def test_poll_for_upload_completion(monkeypatch):
@@ -285,12 +349,12 @@ def test_gsutil_assay_upload(monkeypatch):
             proc.start()
             yield proc
 
-    def _wait_for_upload(procs, total, optional_files):
+    def _wait_for_upload(procs, total, optional_files, until=None):
         """Mock the _wait_for_upload function"""
         assert total == num_procs
         for proc in procs:
             proc.stop()
-        return []
+        return {}
 
     monkeypatch.setattr(upload, "_start_procs", _start_procs)
     monkeypatch.setattr(upload, "_wait_for_upload", _wait_for_upload)
@@ -417,3 +481,136 @@ def test_compose_file_mapping(tmpdir, monkeypatch):
 
     with pytest.raises(Exception, match=r"gs://bucket/\[brackets\]/subitem"):
         output_map, skipping = upload._compose_file_mapping(upload_job, xlsx)
+
+
+def test_find_local_files(tmpdir, monkeypatch):
+    """Check that local files are found listing directories with many to check"""
+    many, few = tmpdir.mkdir("many"), tmpdir.mkdir("few")
+    files = [many.join(f"{n}.fastq.gz") for n in range(5)] + [few.join("1.bam")]
+    for f in files:
+        f.write("foo")
+    many.mkdir("dir.fastq.gz")
+    missing = [many.join("missing.fastq.gz"), many.join("dir.fastq.gz")]
+    missing += [few.join("missing.bam"), tmpdir.join("missing", "2.bam")]
+
+    isfile = MagicMock(wraps=os.path.isfile)
+    monkeypatch.setattr("os.path.isfile", isfile)
+    found = upload._find_local_files(str(f) for f in files + missing)
+    assert found == {str(f) for f in files}
+
+    # only those in directories with few to check are checked one by one
+    checked = {args[0] for args, _ in isfile.call_args_list}
+    assert checked == {str(f) for f in [files[-1]] + missing[2:]}
+
+
+def test_suffix_matcher():
+    is_optional = upload._suffix_matcher(["r2.fastq.gz", "/b.bam", "x"])
+    assert is_optional("/data/sample_r2.fastq.gz")
+    assert is_optional("/data/b.bam")
+    assert is_optional("x")
+    assert not is_optional("/data/sample_r1.fastq.gz")
+    assert not is_optional("/data/ab.bam")
+    assert not upload._suffix_matcher([])("/data/b.bam")
+
+
+class FakeGsutil:
+    """A `gsutil cp` process that writes `lines` to stderr then exits"""
+
+    def __init__(self, src, dst, lines, returncode):
+        self.args = ["gsutil", "cp", src, dst]
+        self.lines = list(lines)
+        self.exit_code = returncode
+        self.returncode = None
+        self.stderr = self
+
+    def readline(self):
+        return self.lines.pop(0) if self.lines else ""
+
+    def poll(self):
+        if not self.lines:
+            self.returncode = self.exit_code
+        return self.returncode
+
+    def close(self):
+        pass
+
+    def kill(self):
+        pass
+
+
+def test_gsutil_assay_upload_retries(monkeypatch):
+    """Check that failed file uploads are retried alone, if the error is transient"""
+    monkeypatch.setattr(upload, "UPLOAD_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(upload, "MAX_UPLOAD_ATTEMPTS", 3)
+    monkeypatch.setattr(click, "echo", MagicMock())
+    monkeypatch.setattr(click, "secho", MagicMock())
+
+    pairs = [[f"file{n}", f"gs://{GCS_BUCKET}/{n}"] for n in range(3)]
+    monkeypatch.setattr(upload, "_compose_file_mapping", lambda *args: (pairs, []))
+    succeed = ([], 0)
+    unavailable = (["ServiceException: 503 Backend Error\n"], 1)
+    forbidden = (["AccessDeniedException: 403 Forbidden\n"], 1)
+
+    started = []
+
+    def run(outcomes):
+        started.clear()
+
+        def _start_procs(src_dst_pairs, signed_urls=None):
+            for src, dst in src_dst_pairs:
+                started.append(src)
+                yield FakeGsutil(src, dst, *outcomes[src].pop(0))
+
+        monkeypatch.setattr(upload, "_start_procs", _start_procs)
+        upload_info = api.UploadInfo(
+            JOB_ID,
+            JOB_ETAG,
+            GCS_BUCKET,
+            URL_MAPPING,
+            EXTRA_METADATA,
+            dict(GCS_FILE_MAP),
+            OPTIONAL_FILES,
+            UPLOAD_TOKEN,
+        )
+        upload._gsutil_assay_upload(upload_info, "")
+
+    # transient errors are retried, without restarting the other uploads
+    run(
+        {
+            "file0": [succeed],
+            "file1": [unavailable, unavailable, succeed],
+            "file2": [succeed],
+        }
+    )
+    assert sorted(started) == ["file0", "file1", "file1", "file1", "file2"]
+
+    # until the attempts run out
+    with pytest.raises(click.Abort):
+        run({"file0": [succeed], "file1": [unavailable] * 3, "file2": [succeed]})
+    assert started.count("file1") == 3
+
+    # and other errors aren't
+    with pytest.raises(click.Abort):
+        run({"file0": [succeed], "file1": [forbidden], "file2": [succeed]})
+    assert started.count("file1") == 1
+
+
+def test_is_retryable():
+    assert upload._is_retryable("ServiceException: 503 Backend Error")
+    assert upload._is_retryable("429 Too Many Requests")
+    assert upload._is_retryable("ResumableUploadException: Connection reset by peer")
+    assert not upload._is_retryable("AccessDeniedException: 403 Forbidden")
+    assert not upload._is_retryable("CommandException: No URLs matched: foo")
+
+
+def test_needs_gcloud():
+    local = ("/data/a.bam", "trial/a.bam")
+    in_gcs = ("gs://other/b.bam", "trial/b.bam")
+    signed = {"trial/a.bam": "https://signed/a", "trial/b.bam": "https://signed/b"}
+
+    # without signed URLs, everything goes through gsutil
+    assert upload._needs_gcloud([local], None)
+    # with them, only files already in GCS, and local files without one
+    assert not upload._needs_gcloud([local], signed)
+    assert upload._needs_gcloud([local, in_gcs], signed)
+    assert upload._needs_gcloud([local], {})